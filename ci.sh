@@ -14,3 +14,6 @@ touch ipcrawl.sqlite3
 
 inv clean
 tox -e bandit,coverage,docs-html,flake8,py37
+
+# short crawls run from cron pay this on every run, keep an eye on it
+python -m ipcrawl bench --startup-only --number 5
@@ -112,8 +112,8 @@ activate-ci() {
 
   run-pip-if-recent-requirements-change "${BIN_DIR}/test-requirements.txt"
 
-  CSV_FILES=$(find ${BIN_DIR}/data/geolite2 -name '*.csv')
-  if [ -z "${CSV_FILES}" ]; then
+  GEOLITE_FILES=$(find ${BIN_DIR}/data/geolite2 -name '*.csv' -o -name '*.zip')
+  if [ -z "${GEOLITE_FILES}" ]; then
 
     info "$GREEN" "Geolite database files do not exist yet, so I'll download them for you."
     inv download-geolite-dbs
@@ -40,10 +40,22 @@ setup(
     include_package_data=True,
     python_requires='>=3.6',
     zip_safe=False,
+    entry_points={
+        'console_scripts': [
+            'ipcrawl = ipcrawl.cli:main',
+        ],
+    },
     install_requires=[
         'sly==0.3',
         'SQLAlchemy==1.3.5',
     ],
+    extras_require={
+        # a faster encoder for bulk JSON output, see ipcrawl.utils
+        'json': ['orjson'],
+        # sorts large batches of addresses in compiled code, without it
+        # they go through sorted(), see ipcrawl.utils.sort_ips
+        'numpy': ['numpy'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',
@@ -0,0 +1,10 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.cli import main
+
+import sys
+
+sys.exit(main())
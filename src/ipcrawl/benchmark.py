@@ -0,0 +1,318 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.utils import peak_rss
+from ipcrawl.utils import read_json
+
+import datetime
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the sample that ships with the repository, see tests/test_lexer.py
+SAMPLE_CORPUS = os.path.join(
+    os.path.dirname(os.path.dirname(PACKAGE_DIR)), 'data', 'parse.data',
+)
+
+# the default regression threshold, a 10% drop in throughput
+THRESHOLD = 0.10
+
+
+def machine_metadata():
+    """Describe the host and software a benchmark ran on
+
+    Returns:
+        (dict):
+
+    """
+    import sqlite3
+    import sqlalchemy
+
+    return {
+        'hostname': socket.gethostname(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'sqlite': sqlite3.sqlite_version,
+        'sqlalchemy': sqlalchemy.__version__,
+        'ipcrawl': read_json(
+            os.path.join(PACKAGE_DIR, 'metadata.json')
+        )['version'],
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+    }
+
+
+def metric(value, unit, higher_is_better=True):
+    return {
+        'value': value,
+        'unit': unit,
+        'higher_is_better': higher_is_better,
+    }
+
+
+def best_of(func, number):
+    """Call ``func`` ``number`` times and return the fastest wall time
+
+    """
+    timings = []
+
+    for _ in range(number):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    return min(timings)
+
+
+def sample_corpus(size, filename=SAMPLE_CORPUS):
+    """Repeat the sample corpus until it is at least ``size`` characters
+
+    Args:
+        size (int):
+            * The minimum number of characters
+        filename (str):
+            * Default :data:`SAMPLE_CORPUS`
+
+    Returns:
+        (str):
+
+    """
+    with open(filename, mode='r') as fd:
+        sample = fd.read().rstrip('\n') + '\n'
+
+    return sample * max(1, -(-size // len(sample)))
+
+
+def bench_lexer(text, number=3):
+    """Measure lexer throughput over ``text``
+
+    Returns:
+        (dict):
+            * ``lexer_mb_per_sec`` and ``lexer_tokens_per_sec``
+
+    """
+    from ipcrawl.lexer import create_lexer
+
+    tokens = len(create_lexer(text))
+    elapsed = best_of(lambda: create_lexer(text), number)
+    size = len(text.encode('utf-8'))
+
+    return {
+        'lexer_mb_per_sec': metric(size / elapsed / 1024 / 1024, 'MB/s'),
+        'lexer_tokens_per_sec': metric(tokens / elapsed, 'tokens/s'),
+    }
+
+
+def bench_ingestion(filename, rows=20000):
+    """Measure :func:`ipcrawl.geolite2.load_csv` into a new db ``filename``
+
+    The rows are synthetic ASN blocks, see :mod:`ipcrawl.synthetic`.
+
+    Returns:
+        (dict):
+            * ``ingestion_rows_per_sec``
+
+    """
+    from ipcrawl import geolite2
+    from ipcrawl import synthetic
+    from ipcrawl.database import models
+    from ipcrawl.database import sqlite3
+
+    import io
+
+    fd = io.StringIO()
+    synthetic.write_csv(fd, synthetic.ASN_BLOCKS_HEADER, (
+        asn for asn, _, _ in synthetic.iter_blocks(networks=rows)
+    ))
+    fd.seek(0)
+
+    # init_db and load_csv go through the global Session, the caller's is
+    # put back once the benchmark db is loaded
+    saved = sqlite3.Session
+    sqlite3.Session = sqlite3.sessionmaker()
+
+    try:
+        engine = sqlite3.init_db(
+            engine=sqlite3.init_engine(filename=filename), indexes=False,
+        )
+
+        started = time.perf_counter()
+        loaded = geolite2.load_csv(fd, models.GeoLite2AsnBlocksIpv4)
+        sqlite3.finalize_db(engine)
+        elapsed = time.perf_counter() - started
+    finally:
+        sqlite3.Session = saved
+
+    return {
+        'ingestion_rows_per_sec': metric(loaded / elapsed, 'rows/s'),
+    }
+
+
+def bench_lookups(filename, ips, workers=4):
+    """Measure lookups per second of every lookup engine
+
+    Returns:
+        (dict):
+            * ``lookup_<engine>_per_sec`` for ``orm``, ``context`` and
+              ``executor``
+
+    """
+    from ipcrawl.database import lookup
+    from ipcrawl.database import sqlite3
+    from ipcrawl.database.executor import LookupExecutor
+
+    engine = sqlite3.init_engine(filename=filename)
+
+    def orm():
+        for ip in ips:
+            with sqlite3.session_scope(bind=engine) as session:
+                for ModelClass in lookup.LOOKUP_MODELS:
+                    lookup.lookup(session, ModelClass, ip)
+
+    def context():
+        with lookup.LookupContext(filename=filename) as ctx:
+            for ip in ips:
+                ctx.lookup_all(ip)
+
+    def executor():
+        with LookupExecutor(filename=filename, workers=workers) as ex:
+            ex.lookup_all(ips)
+
+    return {
+        'lookup_{}_per_sec'.format(func.__name__): metric(
+            len(ips) / best_of(func, 1), 'lookups/s',
+        )
+        for func in (orm, context, executor)
+    }
+
+
+def bench_startup(number=5):
+    """Measure how long ``ipcrawl extract`` takes on a one line input
+
+    Nearly all of it is interpreter startup and imports, which every short
+    crawl started from cron or ``xargs`` pays.
+
+    Returns:
+        (dict):
+            * ``startup_extract_seconds``
+
+    """
+    import subprocess
+
+    cmd = [sys.executable, '-m', 'ipcrawl', 'extract', '-']
+
+    def start():
+        subprocess.run(
+            cmd, input=b'1.2.3.4\n', stdout=subprocess.DEVNULL, check=True,
+        )
+
+    return {
+        'startup_extract_seconds': metric(
+            best_of(start, number), 'seconds', higher_is_better=False,
+        ),
+    }
+
+
+def run(corpus_size=1024 * 1024, rows=20000, lookups=5000, number=3):
+    """Run the whole benchmark suite
+
+    Args:
+        corpus_size (int):
+            * Characters of text to lex
+        rows (int):
+            * Rows to ingest, the ingested db is used for the lookups
+        lookups (int):
+            * Addresses to look up per engine
+        number (int):
+            * Repeats of the lexer benchmark, the fastest run is kept
+
+    Returns:
+        (dict):
+            * ``{'metadata': ..., 'parameters': ..., 'results': ...}``
+
+    """
+    from ipcrawl import synthetic
+
+    import random
+
+    results = bench_startup(number=number)
+    results.update(bench_lexer(sample_corpus(corpus_size), number=number))
+
+    directory = tempfile.mkdtemp(prefix='ipcrawl-benchmark-')
+    filename = os.path.join(directory, 'benchmark.sqlite3')
+
+    try:
+        results.update(bench_ingestion(filename, rows=rows))
+
+        pool = synthetic.address_pool(size=lookups, networks=rows)
+        ips = random.Random(rows).choices(pool, k=lookups)
+        results.update(bench_lookups(filename, ips))
+    finally:
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    results['peak_rss'] = metric(peak_rss(), 'bytes', higher_is_better=False)
+
+    return {
+        'metadata': machine_metadata(),
+        'parameters': {
+            'corpus_size': corpus_size,
+            'rows': rows,
+            'lookups': lookups,
+            'number': number,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """Find metrics of ``current`` that regressed against ``baseline``
+
+    Args:
+        baseline (dict):
+            * A previous result of :func:`run`
+        current (dict):
+            * The result of :func:`run` to check
+        threshold (float):
+            * The tolerated relative change, ``0.10`` allows throughput to
+              drop by up to 10% and ``peak_rss`` to grow by up to 10%.
+
+    Returns:
+        (list):
+            * One ``dict`` per regressed metric, empty when there are none
+
+    """
+    regressions = []
+
+    for name, base in sorted(baseline['results'].items()):
+        actual = current['results'].get(name)
+
+        if not actual or not base['value'] or actual['value'] is None:
+            continue
+
+        change = (actual['value'] - base['value']) / base['value']
+
+        if not base.get('higher_is_better', True):
+            change = -change
+
+        if change < -threshold:
+            regressions.append({
+                'metric': name,
+                'baseline': base['value'],
+                'current': actual['value'],
+                'unit': base['unit'],
+                'change': change,
+            })
+
+    return regressions
@@ -0,0 +1,249 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.lexer import LEXER_VERSION
+from ipcrawl.utils import array_to_ips
+from ipcrawl.utils import ips_to_array
+from ipcrawl.utils import log
+from ipcrawl.utils import metrics
+from ipcrawl.utils import read_json
+from ipcrawl.utils import to_json
+from ipcrawl.utils import UINT32
+
+import array
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import time
+
+MAGIC = b'IPLC'
+
+# the address count of a cached result
+HEADER = struct.Struct('<I')
+
+# bytes hashed at a time
+READ_SIZE = 1024 * 1024
+
+# a file modified this close to when its size and mtime were recorded may
+# change again without either changing, its content is hashed instead
+RACY_NS = 2 * 10 ** 9
+
+
+def file_digest(filename):
+    """The sha256 hex digest of the content of ``filename``
+
+    """
+    sha = hashlib.sha256()
+
+    with open(filename, mode='rb') as fd:
+        for block in iter(lambda: fd.read(READ_SIZE), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def _atomic_write(filename, data):
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, mode='wb') as tmp_fd:
+            tmp_fd.write(data)
+
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _uint32_bytes(values):
+    if sys.byteorder == 'big':
+        values = array.array(UINT32, values)
+        values.byteswap()
+
+    return values.tobytes()
+
+
+def _uint32_array(data):
+    values = array.array(UINT32)
+    values.frombytes(data)
+
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+    return values
+
+
+def encode_result(ips, lines):
+    """Pack the addresses of a file and their line numbers
+
+    :data:`MAGIC`, the count, then the addresses and the line numbers as
+    little endian unsigned 32-bit ints.
+
+    Returns:
+        (bytes):
+
+    """
+    return b''.join([
+        MAGIC,
+        HEADER.pack(len(ips)),
+        _uint32_bytes(ips_to_array(ips)),
+        _uint32_bytes(array.array(UINT32, lines)),
+    ])
+
+
+def decode_result(data):
+    """Unpack :func:`encode_result`
+
+    Raises:
+        ValueError: When ``data`` is not a complete cached result
+
+    Returns:
+        (tuple):
+            * ``(ips, lines)``
+
+    """
+    start = len(MAGIC) + HEADER.size
+
+    if data[:len(MAGIC)] != MAGIC or len(data) < start:
+        raise ValueError('Not an ipcrawl cached result')
+
+    count, = HEADER.unpack_from(data, len(MAGIC))
+
+    if len(data) != start + count * 8:
+        raise ValueError('Truncated ipcrawl cached result')
+
+    middle = start + count * 4
+    ips = array_to_ips(_uint32_array(data[start:middle]))
+    lines = _uint32_array(data[middle:]).tolist()
+    return ips, lines
+
+
+class LexCache(object):
+    """An on disk cache of what the lexer found in files
+
+    Results are keyed by the sha256 of the file content and
+    :data:`ipcrawl.lexer.LEXER_VERSION`, so renamed or copied files hit the
+    cache and a lexer change never serves stale results. The size and mtime
+    of each path are recorded along with its digest, a file whose size and
+    mtime did not change is not hashed again.
+
+    Layout of ``directory``::
+
+        paths/<sha1 of the path>           size, mtime and digest, JSON
+        lexer-<version>/<ab>/<digest>      see encode_result
+
+    Example:
+
+        .. code-block::
+
+            cache = LexCache('~/.cache/ipcrawl')
+            ips, lines = cache.get('app.log.1', crawl_file)
+
+    Args:
+        directory (str):
+            * Where results are stored, created when missing
+
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+
+    def _path_entry(self, filename):
+        key = hashlib.sha1(os.path.abspath(filename).encode('utf-8'))
+        return os.path.join(self.directory, 'paths', key.hexdigest())
+
+    def _result_entry(self, digest):
+        return os.path.join(
+            self.directory,
+            'lexer-{}'.format(LEXER_VERSION),
+            digest[:2],
+            digest,
+        )
+
+    def digest(self, filename, stat):
+        """The content digest of ``filename``, hashed only when its size or
+        mtime changed since it was last hashed
+
+        """
+        entry = self._path_entry(filename)
+
+        try:
+            recorded = read_json(entry)
+        except (IOError, OSError, ValueError):
+            recorded = None
+
+        unchanged = recorded is not None and (
+            recorded['size'], recorded['mtime_ns'],
+        ) == (stat.st_size, stat.st_mtime_ns)
+
+        if unchanged and stat.st_mtime_ns + RACY_NS < recorded['checked_ns']:
+            return recorded['digest']
+
+        with metrics.timer('lexcache.hash'):
+            digest = file_digest(filename)
+
+        self._write(entry, to_json({
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'checked_ns': time.time_ns(),
+            'digest': digest,
+        }).encode('utf-8'))
+        return digest
+
+    def _write(self, entry, data):
+        # a cache that can not be written to only costs speed
+        try:
+            _atomic_write(entry, data)
+        except (IOError, OSError) as exp:
+            log.warning('unable to write to {}: {}'.format(
+                self.directory, exp,
+            ))
+
+    def get(self, filename, lex):
+        """What ``lex`` finds in ``filename``, from the cache when its
+        content was lexed before
+
+        Args:
+            filename (str):
+                * A path
+            lex (callable):
+                * Called with ``filename`` on a miss, returns ``(ips, lines)``
+                  such as :func:`ipcrawl.crawl.crawl_file`
+
+        Raises:
+            * See :func:`os.stat` and ``lex``
+
+        Returns:
+            (tuple):
+                * ``(ips, lines)``
+
+        """
+        stat = os.stat(filename)
+        entry = self._result_entry(self.digest(filename, stat))
+
+        try:
+            with open(entry, mode='rb') as fd:
+                result = decode_result(fd.read())
+        except (IOError, OSError, ValueError):
+            pass
+        else:
+            metrics.incr('lexcache.hits')
+            return result
+
+        metrics.incr('lexcache.misses')
+        ips, lines = lex(filename)
+
+        # changed while it was lexed, the digest may not match what was lexed
+        if os.stat(filename).st_mtime_ns == stat.st_mtime_ns:
+            self._write(entry, encode_result(ips, lines))
+
+        return ips, lines
+
+    def __repr__(self):
+        return 'LexCache(directory={!r})'.format(self.directory)
@@ -0,0 +1,545 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import argparse
+import os
+import sys
+
+PROG = 'ipcrawl'
+
+FORMATS = ('ndjson', 'csv', 'binary')
+
+# see ipcrawl.database.aggregate.GROUPS
+GROUP_BY = ('asn', 'organization', 'country', 'city')
+
+# modules that `ipcrawl extract` must never import, see tests/test_cli.py
+HEAVY_MODULES = ('sqlalchemy', 'requests', 'ipcrawl.database')
+
+
+def _read_text(filename):
+    fd = _open_input(filename)
+    try:
+        return fd.read()
+    finally:
+        if fd is not sys.stdin:
+            fd.close()
+
+
+def _open_text(filename):
+    if filename == '-':
+        return sys.stdout
+
+    return open(filename, mode='w')
+
+
+def _open_writer(filename, format):
+    from ipcrawl import writers
+
+    if filename != '-':
+        return writers.open_writer(filename, format=format)
+
+    writer_class = writers.get_writer_class(format)
+    fd = sys.stdout.buffer if writer_class.binary else sys.stdout
+    return writer_class(fd)
+
+
+def _db_filename(filename):
+    from ipcrawl.database import sqlite3
+
+    filename = filename or sqlite3.DEFAULT_DB
+
+    # connecting would create an empty db
+    if not os.path.isfile(filename):
+        raise ValueError(
+            'no db at {}, create it with `ipcrawl load`'.format(filename)
+        )
+
+    return filename
+
+
+def _checked_ips(ips):
+    from ipaddress import IPv4Address
+
+    for ip in ips:
+        try:
+            IPv4Address(ip)
+        except ValueError:
+            raise ValueError('invalid IPv4 address {!r}'.format(ip))
+
+        yield ip
+
+
+def _open_input(filename):
+    from ipcrawl.utils import detect_compression
+    from ipcrawl.utils import ENCODING
+    from ipcrawl.utils import open_text
+
+    if filename != '-':
+        return open_text(filename)
+
+    # sys.stdin may have been replaced by a text only stream
+    buffer = getattr(sys.stdin, 'buffer', None)
+    module = detect_compression(buffer) if buffer is not None else None
+
+    if module is None:
+        return sys.stdin
+
+    return module.open(buffer, mode='rt', encoding=ENCODING)
+
+
+def _external_sort(args, unique=True):
+    from ipcrawl.extsort import ExternalSorter
+    from ipcrawl.lexer import iter_tokens
+
+    sorter = ExternalSorter(memory=args.memory * 1024 * 1024, unique=unique)
+
+    for filename in args.files:
+        fd = _open_input(filename)
+        try:
+            sorter.update(token.value for token in iter_tokens(fd))
+        finally:
+            if fd is not sys.stdin:
+                fd.close()
+
+    return sorter
+
+
+def extract(args):
+    """Print every IPv4 address of ``args.files``, one per line
+
+    With ``args.memory`` every address is printed once, sorted within that
+    many MiB, see :class:`ipcrawl.extsort.ExternalSorter`.
+
+    """
+    from ipcrawl.lexer import create_lexer
+    from ipcrawl.utils import sort_ips
+
+    if args.memory:
+        sorter = _external_sort(args)
+        ips = iter(sorter)
+    else:
+        sorter = None
+        ips = []
+        for filename in args.files:
+            tokens = create_lexer(_read_text(filename))
+            ips.extend(token.value for token in tokens)
+
+        if args.sort:
+            ips = sort_ips(ips, unique=args.unique)
+        elif args.unique:
+            ips = list(dict.fromkeys(ips))
+
+    fd = _open_text(args.output)
+    try:
+        for ip in ips:
+            fd.write(ip)
+            fd.write('\n')
+    finally:
+        if sorter is not None:
+            sorter.close()
+
+        if fd is sys.stdout:
+            fd.flush()
+        else:
+            fd.close()
+
+    return 0
+
+
+def crawl(args):
+    """Write every address of the files, directories and globs of
+    ``args.paths`` with the file and line it was found on
+
+    """
+    from ipcrawl.cache import LexCache
+    from ipcrawl.crawl import crawl as crawl_paths
+
+    cache = LexCache(args.cache) if args.cache else None
+
+    with _open_writer(args.output, args.format) as writer:
+        for hit in crawl_paths(
+            args.paths, workers=args.jobs, strict=args.strict, cache=cache,
+        ):
+            writer.write({'ip': hit.ip, 'file': hit.file, 'line': hit.line})
+
+    return 0
+
+
+def follow(args):
+    """Write the addresses appended to ``args.file`` as they are written
+
+    With ``args.checkpoint`` a later run resumes where this one stopped,
+    see :class:`ipcrawl.follow.Tail`.
+
+    """
+    from ipcrawl.follow import Tail
+
+    import time
+
+    with _open_writer(args.output, args.format) as writer, Tail(
+        args.file, checkpoint=args.checkpoint,
+    ) as tail:
+        try:
+            while True:
+                for hit in tail.poll():
+                    writer.write({'ip': hit.ip, 'line': hit.line})
+
+                writer.fd.flush()
+
+                if args.once:
+                    break
+
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+
+def lookup(args):
+    """Write the ASN and city networks of every address
+
+    Addresses are taken from the command line, or one per line from stdin
+    so the output of ``ipcrawl extract`` can be piped in.
+
+    """
+    from ipcrawl.database import lookup as db_lookup
+    from ipcrawl.database.executor import LookupExecutor
+
+    from itertools import tee
+
+    filename = _db_filename(args.db)
+    ips = _checked_ips(
+        args.ips or (line.strip() for line in sys.stdin if line.strip())
+    )
+
+    # the executor reads ahead of the writer, tee buffers the difference
+    ips, pending = tee(ips)
+
+    if args.workers > 1:
+        engine = LookupExecutor(
+            filename=filename, workers=args.workers, cache=args.cache,
+        )
+        lookup_all = engine.map
+    else:
+        engine = db_lookup.LookupContext(
+            filename=filename, cache=args.cache,
+        )
+
+        def lookup_all(ips):
+            return (engine.lookup_all(ip) for ip in ips)
+
+    with _open_writer(args.output, args.format) as writer, engine:
+        for ip, found in zip(ips, lookup_all(pending)):
+            record = {'ip': ip}
+
+            for table, result in found.items():
+                record[table] = result.to_dict() if result else None
+
+            writer.write(record)
+
+    return 0
+
+
+def aggregate(args):
+    """Write the hits per ASN, organization, country or city of the
+    addresses of ``args.files``, the ``args.top`` keys with the most hits
+    of every group or every key when ``0``
+
+    See :func:`ipcrawl.database.aggregate.aggregate`.
+
+    """
+    from ipcrawl.database import sqlite3
+    from ipcrawl.database.aggregate import aggregate as aggregate_ips
+    from ipcrawl.database.aggregate import top
+    from ipcrawl.lexer import iter_tokens
+    from ipcrawl.utils import ips_to_array
+    from ipcrawl.utils import sort_ints
+
+    db = _db_filename(args.db)
+
+    if args.memory:
+        sorter = _external_sort(args, unique=False)
+        ips = sorter.ints()
+    else:
+        sorter = None
+        ips = ips_to_array([])
+        for filename in args.files:
+            fd = _open_input(filename)
+            try:
+                ips.extend(ips_to_array(t.value for t in iter_tokens(fd)))
+            finally:
+                if fd is not sys.stdin:
+                    fd.close()
+
+        ips = sort_ints(ips)
+
+    try:
+        histograms = aggregate_ips(
+            sqlite3.init_engine(db), ips, groups=args.by or GROUP_BY,
+        )
+    finally:
+        if sorter is not None:
+            sorter.close()
+
+    with _open_writer(args.output, args.format) as writer:
+        for record in top(histograms, n=args.top):
+            writer.write(record)
+
+    return 0
+
+
+def load(args):
+    """Populate the db with the GeoLite2 CSVs of ``args.directory``
+
+    """
+    from ipcrawl import geolite2
+    from ipcrawl import progress
+    from ipcrawl.database import sqlite3
+    from ipcrawl.utils import to_json
+
+    reporter = None
+    if args.progress:
+        reporter = progress.Progress(
+            every=args.progress, format=args.progress_format,
+        )
+
+    loaded = geolite2.populate(
+        engine=sqlite3.init_engine(args.db),
+        progress=reporter,
+        directory=args.directory,
+        analyze=args.analyze,
+        vacuum=args.vacuum,
+    )
+    print(to_json(loaded))
+    return 0
+
+
+def bench(args):
+    """Run the benchmark suite, see :mod:`ipcrawl.benchmark`
+
+    Returns ``1`` when a metric regressed against ``args.baseline``.
+
+    """
+    from ipcrawl import benchmark
+    from ipcrawl.utils import read_json
+    from ipcrawl.utils import to_json
+
+    if args.startup_only:
+        results = {
+            'metadata': benchmark.machine_metadata(),
+            'parameters': {'number': args.number},
+            'results': benchmark.bench_startup(number=args.number),
+        }
+    else:
+        results = benchmark.run(
+            corpus_size=args.corpus_size,
+            rows=args.rows,
+            lookups=args.lookups,
+            number=args.number,
+        )
+
+    result_as_json = to_json(results)
+    print(result_as_json)
+
+    if args.output:
+        with open(args.output, mode='w') as fd:
+            fd.write(result_as_json)
+
+    if args.baseline:
+        regressions = benchmark.compare(
+            read_json(args.baseline), results, threshold=args.threshold,
+        )
+
+        if regressions:
+            sys.stderr.write('Benchmark regressions:\n{}\n'.format(
+                to_json(regressions),
+            ))
+            return 1
+
+    return 0
+
+
+def build_parser():
+    """The argument parser of every subcommand
+
+    Returns:
+        (argparse.ArgumentParser):
+
+    """
+    parser = argparse.ArgumentParser(
+        prog=PROG,
+        description='Searches for ip addresses inside unformatted text',
+    )
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    sub = subparsers.add_parser(
+        'extract', help='print the IPv4 addresses found in text',
+    )
+    sub.add_argument(
+        'files', nargs='*', default=['-'],
+        help='files to crawl, - or nothing reads stdin',
+    )
+    sub.add_argument('-o', '--output', default='-')
+    sub.add_argument(
+        '-u', '--unique', action='store_true',
+        help='print every address once',
+    )
+    sub.add_argument(
+        '--no-sort', dest='sort', action='store_false',
+        help='print addresses in the order they were found',
+    )
+    sub.add_argument(
+        '-m', '--memory', type=int, default=None, metavar='MIB',
+        help='print every address once, sorted within MIB of memory',
+    )
+    sub.set_defaults(func=extract)
+
+    sub = subparsers.add_parser(
+        'crawl', help='extract addresses from many files in parallel',
+    )
+    sub.add_argument(
+        'paths', nargs='+',
+        help='files, directories to walk or globs such as logs/**/*.log',
+    )
+    sub.add_argument('-o', '--output', default='-')
+    sub.add_argument('-f', '--format', default='ndjson', choices=FORMATS)
+    sub.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='worker processes, default one per CPU',
+    )
+    sub.add_argument(
+        '--strict', action='store_true',
+        help='stop at the first file that can not be read or lexed',
+    )
+    sub.add_argument(
+        '--cache', default=None, metavar='DIR',
+        help='reuse what was found in files whose content did not change',
+    )
+    sub.set_defaults(func=crawl)
+
+    sub = subparsers.add_parser(
+        'follow', help='extract addresses from a log as it grows',
+    )
+    sub.add_argument('file', help='the log to follow')
+    sub.add_argument(
+        '-c', '--checkpoint', default=None,
+        help='file the position is saved to, a later run resumes from it',
+    )
+    sub.add_argument('-o', '--output', default='-')
+    sub.add_argument('-f', '--format', default='ndjson', choices=FORMATS)
+    sub.add_argument(
+        '-n', '--interval', type=float, default=1.0,
+        help='seconds between polls',
+    )
+    sub.add_argument(
+        '--once', action='store_true',
+        help='exit once everything written so far was read',
+    )
+    sub.set_defaults(func=follow)
+
+    sub = subparsers.add_parser(
+        'lookup', help='resolve addresses to their ASN and city networks',
+    )
+    sub.add_argument(
+        'ips', nargs='*',
+        help='addresses to look up, read one per line from stdin when empty',
+    )
+    sub.add_argument('-o', '--output', default='-')
+    sub.add_argument('-f', '--format', default='ndjson', choices=FORMATS)
+    sub.add_argument('--db', default=None, help='the sqlite3 db filename')
+    sub.add_argument('-w', '--workers', type=int, default=1)
+    sub.add_argument(
+        '--cache', action='store_true',
+        help='remember what addresses resolved to in the db for later runs',
+    )
+    sub.set_defaults(func=lookup)
+
+    sub = subparsers.add_parser(
+        'aggregate', help='count the hits per ASN, organization or location',
+    )
+    sub.add_argument(
+        'files', nargs='*', default=['-'],
+        help='files to crawl, - or nothing reads stdin',
+    )
+    sub.add_argument(
+        '-b', '--by', action='append', choices=GROUP_BY,
+        help='a group to count hits of, repeat for more. Default all',
+    )
+    sub.add_argument(
+        '-n', '--top', type=int, default=10,
+        help='keys with the most hits per group, 0 writes every key',
+    )
+    sub.add_argument('-o', '--output', default='-')
+    sub.add_argument('-f', '--format', default='ndjson', choices=FORMATS)
+    sub.add_argument('--db', default=None, help='the sqlite3 db filename')
+    sub.add_argument(
+        '-m', '--memory', type=int, default=None, metavar='MIB',
+        help='sort the addresses within MIB of memory',
+    )
+    sub.set_defaults(func=aggregate)
+
+    sub = subparsers.add_parser(
+        'load', help='populate the db with GeoLite2 CSV data',
+    )
+    sub.add_argument('-d', '--directory', default=None)
+    sub.add_argument('--db', default=None, help='the sqlite3 db filename')
+    sub.add_argument('--no-analyze', dest='analyze', action='store_false')
+    sub.add_argument('--vacuum', action='store_true')
+    sub.add_argument(
+        '--progress', type=int, default=100000,
+        help='rows between progress reports, 0 disables them',
+    )
+    sub.add_argument(
+        '--progress-format', default='text', choices=('text', 'json'),
+    )
+    sub.set_defaults(func=load)
+
+    sub = subparsers.add_parser('bench', help='run the benchmark suite')
+    sub.add_argument('-o', '--output', default=None)
+    sub.add_argument('--baseline', default=None)
+    sub.add_argument('--threshold', type=float, default=0.10)
+    sub.add_argument('--corpus-size', type=int, default=1024 * 1024)
+    sub.add_argument('--rows', type=int, default=20000)
+    sub.add_argument('--lookups', type=int, default=5000)
+    sub.add_argument('--number', type=int, default=3)
+    sub.add_argument(
+        '--startup-only', action='store_true',
+        help='only measure how long the console script takes to start',
+    )
+    sub.set_defaults(func=bench)
+
+    return parser
+
+
+def main(argv=None):
+    """Run the ``ipcrawl`` console script
+
+    Only :mod:`argparse` is imported up front. Every subcommand imports what
+    it needs when it runs, so ``ipcrawl extract`` never loads SQLAlchemy and
+    a crawl started from cron or ``xargs`` does not pay for the database
+    layer.
+
+    Args:
+        argv (list):
+            * The arguments, default ``sys.argv[1:]``
+
+    Returns:
+        (int):
+            * The exit status
+
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        return args.func(args)
+    except ValueError as exp:
+        parser.exit(1, '{}: error: {}\n'.format(PROG, str(exp).strip()))
+    except BrokenPipeError:
+        # `ipcrawl extract | head` closed its end of the pipe
+        sys.stderr.close()
+        return 1
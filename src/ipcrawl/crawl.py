@@ -0,0 +1,190 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+from ipcrawl.lexer import iter_tokens
+from ipcrawl.utils import log
+from ipcrawl.utils import metrics
+from ipcrawl.utils import open_text
+
+import glob
+import lzma
+import multiprocessing
+import os
+
+# files a worker crawls per task, amortizes the cost of a task
+FILES_PER_TASK = 16
+
+GLOB_CHARS = frozenset('*?[')
+
+Hit = namedtuple('Hit', ('file', 'line', 'ip'))
+
+
+def expand_paths(paths):
+    """Expand files, directories and globs into a list of files
+
+    Directories are walked recursively, ``**`` in a glob matches any number
+    of directories. Files are returned once, in the order they were found.
+
+    Args:
+        paths (list, tuple):
+            * Filenames, directories or glob patterns
+
+    Returns:
+        (list):
+
+    """
+    files = {}
+
+    for path in paths:
+        if GLOB_CHARS.intersection(path):
+            matches = sorted(glob.glob(path, recursive=True))
+        else:
+            matches = [path]
+
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, names in os.walk(match):
+                    dirs.sort()
+                    for name in sorted(names):
+                        files[os.path.join(root, name)] = None
+            else:
+                files[match] = None
+
+    return list(files)
+
+
+def crawl_file(filename, chunk_size=None):
+    """Lex one file, compressed ones are decompressed as they are lexed
+
+    See :func:`ipcrawl.utils.open_text`.
+
+    Returns:
+        (tuple):
+            * ``(ips, lines)``, the value and line number of every token
+
+    """
+    kwargs = {'chunk_size': chunk_size} if chunk_size else {}
+    ips = []
+    lines = []
+
+    with open_text(filename) as fd:
+        for token in iter_tokens(fd, **kwargs):
+            ips.append(token.value)
+            lines.append(token.lineno)
+
+    return ips, lines
+
+
+def _crawl_files(task):
+    """Lex a batch of files in a worker, errors are returned, not raised
+
+    """
+    filenames, chunk_size, cache = task
+    results = []
+
+    def lex(filename):
+        return crawl_file(filename, chunk_size=chunk_size)
+
+    for filename in filenames:
+        try:
+            if cache is None:
+                ips, lines = lex(filename)
+            else:
+                ips, lines = cache.get(filename, lex)
+        except (
+            IOError, OSError, ValueError, EOFError, lzma.LZMAError,
+        ) as exp:
+            results.append((filename, [], [], str(exp).strip()))
+        else:
+            results.append((filename, ips, lines, None))
+
+    return results
+
+
+def crawl(
+    paths, workers=None, files_per_task=FILES_PER_TASK, chunk_size=None,
+    strict=False, cache=None,
+):
+    """Lex every file of ``paths`` across a pool of processes
+
+    Files are handed to the workers in batches of up to ``files_per_task``,
+    one pool serves the whole crawl so a fleet of small files does not pay for
+    a process each. The tokens of each file come back as one batch and are
+    yielded in the order of the files, see :func:`expand_paths`, while the
+    workers move on to the next files.
+
+    Example:
+
+        .. code-block::
+
+            for hit in crawl(['logs/', 'archive/**/*.log'], workers=4):
+                print(hit.file, hit.line, hit.ip)
+
+    Args:
+        paths (list, tuple):
+            * See :func:`expand_paths`
+        workers (int):
+            * Processes. Default is the number of CPUs, ``1`` crawls in the
+              calling process
+        files_per_task (int):
+            * Files a worker lexes per task
+        chunk_size (int):
+            * See :func:`ipcrawl.lexer.iter_tokens`
+        strict (bool):
+            * Raise on the first file that can not be read or lexed instead
+              of logging a warning and moving on
+        cache (ipcrawl.cache.LexCache):
+            * Files lexed before are loaded from it instead
+
+    Raises:
+        ValueError: When ``strict`` and a file can not be read or lexed
+
+    Yields:
+        (Hit):
+            * ``(file, line, ip)`` of every address
+
+    """
+    files = expand_paths(paths)
+    workers = workers or os.cpu_count() or 1
+
+    # a few large files still go to different workers
+    size = max(1, min(files_per_task, len(files) // (workers * 4)))
+    tasks = [
+        (files[i:i + size], chunk_size, cache)
+        for i in range(0, len(files), size)
+    ]
+
+    if workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(processes=min(workers, len(tasks)))
+        batches = pool.imap(_crawl_files, tasks)
+    else:
+        pool = None
+        batches = map(_crawl_files, tasks)
+
+    try:
+        for batch in batches:
+            for filename, ips, lines, error in batch:
+                metrics.incr('crawl.files')
+
+                if error is not None:
+                    err_msg = 'unable to crawl {}: {}'.format(filename, error)
+
+                    if strict:
+                        raise ValueError(err_msg)
+
+                    metrics.incr('crawl.errors')
+                    log.warning(err_msg)
+                    continue
+
+                metrics.incr('crawl.hits', len(ips))
+
+                for ip, line in zip(ips, lines):
+                    yield Hit(filename, line, ip)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,284 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from collections import Counter
+from collections import OrderedDict
+
+from ipcrawl.database import models
+from ipcrawl.utils import int_to_ip
+from ipcrawl.utils import metrics
+from ipcrawl.utils import network_range
+
+from itertools import chain
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+# group name to the model and column its keys are read from. GeoLite2 city
+# blocks only carry GeoNames ids, ``country`` is the registered country
+GROUPS = OrderedDict([
+    ('asn', (models.GeoLite2AsnBlocksIpv4, 'autonomous_system_number')),
+    ('organization', (
+        models.GeoLite2AsnBlocksIpv4, 'autonomous_system_organization',
+    )),
+    ('country', (
+        models.GeoLite2CityBlocksIpv4, 'registered_country_geoname_id',
+    )),
+    ('city', (models.GeoLite2CityBlocksIpv4, 'geoname_id')),
+])
+
+# network rows fetched from the cursor at a time
+BATCH_SIZE = 10000
+
+
+def _runs(values):
+    """``(value, count)`` of every run of equal values
+
+    """
+    values = iter(values)
+    previous = next(values, None)
+
+    if previous is None:
+        return
+
+    count = 1
+
+    for value in values:
+        if value == previous:
+            count += 1
+            continue
+
+        yield previous, count
+        previous = value
+        count = 1
+
+    yield previous, count
+
+
+def iter_networks(
+    connection, ModelClass, columns, low=0, batch_size=BATCH_SIZE,
+):
+    """Yield ``(id, network, values)`` of every network that may contain
+    ``low`` or a higher address, ordered by ``id``
+
+    Only the key columns are read. Rows are fetched ``batch_size`` at a
+    time, the scan ends as soon as the generator is no longer consumed.
+
+    Args:
+        connection (Connection):
+            * Anything with an ``execute`` method
+        ModelClass (Base):
+            * One of the models in :mod:`ipcrawl.database.models`
+        columns (list, tuple):
+            * The names of the columns ``values`` holds
+        low (int):
+            * The lowest address
+        batch_size (int):
+            * Rows fetched from the cursor at a time
+
+    Yields:
+        (tuple):
+
+    """
+    table = ModelClass.__table__
+
+    # the network that contains low starts at or below it
+    start = connection.execute(
+        select([func.max(table.c.id)]).where(table.c.id <= low)
+    ).scalar()
+
+    stmt = select(
+        [table.c.id, table.c.network] + [table.c[name] for name in columns]
+    ).where(table.c.id >= (start or 0)).order_by(table.c.id)
+    result = connection.execute(stmt)
+
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            return
+
+        for row in rows:
+            yield row[0], row[1], tuple(row[2:])
+
+
+class _Join(object):
+    """The merge join of sorted addresses with the networks of one table
+
+    """
+
+    def __init__(self, networks):
+        self.networks = networks
+        self.current = None
+        self.last = None
+        self.next = next(networks, None)
+
+    def find(self, ip):
+        """The network that contains ``ip``, no lower address may follow
+
+        Returns:
+            (tuple, None):
+                * See :func:`iter_networks`
+
+        """
+        following = self.next
+
+        if following is not None and following[0] <= ip:
+            networks = self.networks
+
+            while following is not None and following[0] <= ip:
+                current = following
+                following = next(networks, None)
+
+            self.current = current
+            self.last = None
+            self.next = following
+
+        current = self.current
+
+        if current is None:
+            return None
+
+        if self.last is None:
+            self.last = network_range(current[1])[1]
+
+        return current if ip <= self.last else None
+
+
+def aggregate(engine, ips, groups=tuple(GROUPS), batch_size=BATCH_SIZE):
+    """Count the hits of every group key in one pass over sorted addresses
+
+    ``ips`` is merge joined with the network ranges of every table
+    ``groups`` need. Each table is read once in ``id`` order, from the
+    network of the lowest address until the addresses run out. Hits are
+    first counted per network, a network resolves to its group keys once
+    no matter how many hits it has, no record is built per hit.
+
+    Example:
+
+        .. code-block::
+
+            ips = sort_ints(ips_to_array(addresses))
+            histograms = aggregate(engine, ips, groups=['asn', 'country'])
+            histograms['asn'].most_common(10)
+
+    Args:
+        engine (Engine):
+            * See :class:`sqlalchemy.engine.base.Engine`
+        ips (iterable):
+            * Unsigned 32-bit ``int`` in ascending order, one per hit,
+              see :func:`ipcrawl.utils.sort_ints` and
+              :meth:`ipcrawl.extsort.ExternalSorter.ints`
+        groups (list, tuple):
+            * Keys of :data:`GROUPS`
+        batch_size (int):
+            * Network rows fetched at a time
+
+    Raises:
+        ValueError: When a group is unknown or ``ips`` is not sorted
+
+    Returns:
+        (OrderedDict):
+            * A :class:`collections.Counter` of hits per key for every
+              group. Hits no network contains are counted under ``None``
+
+    """
+    tables = OrderedDict()
+
+    for group in groups:
+        if group not in GROUPS:
+            err_msg = 'Unknown group {!r}, expected one of {}'.format(
+                group, ', '.join(GROUPS),
+            )
+            raise ValueError(err_msg)
+
+        ModelClass, column = GROUPS[group]
+        tables.setdefault(ModelClass, OrderedDict())[group] = column
+
+    runs = _runs(ips)
+    first = next(runs, None)
+    histograms = OrderedDict((group, Counter()) for group in groups)
+
+    if first is None:
+        return histograms
+
+    with engine.connect() as connection:
+        joins = []
+
+        for ModelClass, columns in tables.items():
+            networks = iter_networks(
+                connection,
+                ModelClass,
+                list(columns.values()),
+                low=first[0],
+                batch_size=batch_size,
+            )
+            joins.append((_Join(networks), Counter(), {}))
+
+        previous = -1
+        total = 0
+
+        with metrics.timer('aggregate.join'):
+            for ip, hits in chain([first], runs):
+                if ip <= previous:
+                    err_msg = 'Addresses are not sorted, {} after {}'.format(
+                        int_to_ip(ip), int_to_ip(previous),
+                    )
+                    raise ValueError(err_msg)
+
+                previous = ip
+                total += hits
+
+                for join, counts, values in joins:
+                    network = join.find(ip)
+
+                    if network is None:
+                        counts[None] += hits
+                    else:
+                        counts[network[0]] += hits
+                        values[network[0]] = network[2]
+
+    for (ModelClass, columns), (_, counts, values) in zip(
+        tables.items(), joins,
+    ):
+        for position, group in enumerate(columns):
+            histogram = histograms[group]
+
+            for network, hits in counts.items():
+                key = None if network is None else values[network][position]
+                histogram[key] += hits
+
+    metrics.incr('aggregate.hits', total)
+    return histograms
+
+
+def top(histograms, n=10):
+    """The ``n`` keys with the most hits of every group
+
+    Args:
+        histograms (dict):
+            * See :func:`aggregate`
+        n (int):
+            * ``0`` or ``None`` returns every key, the full histogram
+
+    Yields:
+        (dict):
+            * ``{'group', 'rank', 'key', 'hits', 'share'}`` ordered by group,
+              then by descending hits. ``share`` is the fraction of all hits
+              of the group
+
+    """
+    for group, histogram in histograms.items():
+        total = sum(histogram.values())
+
+        for rank, (key, hits) in enumerate(
+            histogram.most_common(n or None), 1,
+        ):
+            yield {
+                'group': group,
+                'rank': rank,
+                'key': key,
+                'hits': hits,
+                'share': hits / total,
+            }
@@ -0,0 +1,183 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ipcrawl.database import sqlite3
+from ipcrawl.database.lookup import LOOKUP_MODELS
+from ipcrawl.database.lookup import LookupContext
+
+from itertools import islice
+
+import os
+import threading
+
+CHUNK_SIZE = 256
+
+
+class LookupExecutor(object):
+    """Splits batches of addresses across a pool of lookup threads
+
+    Every worker thread lazily opens its own read only
+    :class:`ipcrawl.database.lookup.LookupContext`, connections are never
+    shared between threads. :mod:`sqlite3` releases the GIL while a query
+    runs, so lookups overlap on multi-core hosts, best with a db in WAL
+    mode, see :func:`ipcrawl.database.sqlite3.finalize_db`. With ``cache``,
+    the contexts flush their cached lookups one at a time, and wait up to
+    :data:`ipcrawl.database.sqlite3.BUSY_TIMEOUT` for other writers.
+
+    Example:
+
+        .. code-block::
+
+            with LookupExecutor(workers=4) as executor:
+                for ip, records in zip(ips, executor.map(ips)):
+                    ...
+
+    Args:
+        filename (str):
+            * A path to the db filename. Default
+              :data:`ipcrawl.database.sqlite3.DEFAULT_DB`
+        workers (int):
+            * The number of threads. Default is the number of CPUs
+        chunk_size (int):
+            * The number of addresses each worker looks up per task
+        models (list, tuple):
+            * Default :data:`ipcrawl.database.lookup.LOOKUP_MODELS`
+        query_stats (QueryStats):
+            * See :func:`ipcrawl.database.sqlite3.init_engine`
+        cache (bool):
+            * See :class:`ipcrawl.database.lookup.LookupContext`. The cache
+              table is validated once, when the executor is opened
+
+    """
+
+    def __init__(
+        self, filename=None, workers=None, chunk_size=CHUNK_SIZE,
+        models=LOOKUP_MODELS, query_stats=None, cache=False,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.models = models
+        self.cache = cache
+
+        # connections are only used by the thread that opened them, this
+        # allows close() to run from the calling thread.
+        self.engine = sqlite3.init_engine(
+            filename,
+            query_stats=query_stats,
+            connect_args={
+                'check_same_thread': False,
+                'timeout': sqlite3.BUSY_TIMEOUT,
+            },
+        )
+        self.executor = None
+        self.contexts = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def open(self):
+        if self.executor is None:
+            if self.cache:
+                # creating and emptying the cache table races between
+                # threads, it runs once before any worker starts
+                with LookupContext(engine=self.engine, cache=True):
+                    pass
+
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        return self
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+        with self.lock:
+            for ctx in self.contexts:
+                ctx.close()
+            self.contexts = []
+
+        self.local = threading.local()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def context(self):
+        """The :class:`LookupContext` of the calling thread
+
+        """
+        ctx = getattr(self.local, 'context', None)
+
+        if ctx is None:
+            ctx = LookupContext(
+                engine=self.engine, cache=self.cache, validate=False,
+                write_lock=self.write_lock,
+            )
+            ctx.open()
+            self.local.context = ctx
+
+            with self.lock:
+                self.contexts.append(ctx)
+
+        return ctx
+
+    def lookup_chunk(self, ips):
+        ctx = self.context()
+        return [ctx.lookup_all(ip, models=self.models) for ip in ips]
+
+    def map(self, ips):
+        """Look up every address, yielding results in input order
+
+        ``ips`` is consumed lazily, at most two chunks per worker are in
+        flight, so a stream of any length is looked up in bounded memory.
+
+        Args:
+            ips (iterable):
+                * Dotted quads or unsigned 32-bit ``int``
+
+        Yields:
+            (dict):
+                * See :meth:`ipcrawl.database.lookup.LookupContext.lookup_all`
+
+        """
+        self.open()
+        ips = iter(ips)
+        pending = deque()
+
+        while True:
+            while len(pending) < self.workers * 2:
+                chunk = list(islice(ips, self.chunk_size))
+
+                if not chunk:
+                    break
+
+                pending.append(
+                    self.executor.submit(self.lookup_chunk, chunk)
+                )
+
+            if not pending:
+                return
+
+            for result in pending.popleft().result():
+                yield result
+
+    def lookup_all(self, ips):
+        """Look up every address
+
+        Returns:
+            (list):
+                * See :meth:`map`
+
+        """
+        return list(self.map(ips))
+
+    def __repr__(self):
+        return 'LookupExecutor(workers={!r})'.format(self.workers)
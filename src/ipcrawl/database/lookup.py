@@ -0,0 +1,544 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from collections import namedtuple
+from contextlib import nullcontext
+
+from ipcrawl.database import models
+from ipcrawl.database import sqlite3
+from ipcrawl.database import stats
+from ipcrawl.utils import ip_to_int
+from ipcrawl.utils import metrics
+from ipcrawl.utils import network_range
+
+from sqlalchemy import bindparam
+from sqlalchemy import select
+
+import time
+
+# the models an address is enriched with by default
+LOOKUP_MODELS = (
+    models.GeoLite2AsnBlocksIpv4,
+    models.GeoLite2CityBlocksIpv4,
+)
+
+# cached lookups written to the db at once, see LookupContext.flush
+CACHE_FLUSH_EVERY = 1000
+
+_record_classes = {}
+_lookup_statements = {}
+_cached_statements = {}
+
+
+def _to_dict(self, columns=None):
+    """Return the record as a ``dict``, see
+    :meth:`ipcrawl.database.models.ModelDictMixin.to_dict`
+
+    """
+    if columns is None:
+        return self._asdict()
+
+    return {column: getattr(self, column) for column in columns}
+
+
+def record_class(ModelClass):
+    """Return the lightweight, read only record class of a model
+
+    Records are named tuples with one field per column, named like the
+    columns returned by :meth:`ModelDictMixin.to_dict`, and no session,
+    identity map or change tracking. The class and its column list are
+    built once per model.
+
+    Args:
+        ModelClass (Base):
+            * One of the models in :mod:`ipcrawl.database.models`
+
+    Returns:
+        (type):
+            * A :func:`collections.namedtuple` subclass with a ``to_dict``
+              method.
+
+    """
+    cls = _record_classes.get(ModelClass)
+
+    if cls is None:
+        table = ModelClass.__table__
+        fields = [column.name.lstrip('_') for column in table.columns]
+        name = '{}Record'.format(ModelClass.__name__)
+
+        cls = type(name, (namedtuple(name, fields),), {
+            '__slots__': (),
+            'model': ModelClass,
+            'columns': tuple(table.columns),
+            'to_dict': _to_dict,
+        })
+        _record_classes[ModelClass] = cls
+
+    return cls
+
+
+def select_records(ModelClass, *whereclause):
+    """Build a Core ``select`` of every column of ``ModelClass``
+
+    Args:
+        ModelClass (Base):
+            * One of the models in :mod:`ipcrawl.database.models`
+        whereclause (list):
+            * Optional criteria, such as ``ModelClass.id > 10``
+
+    Returns:
+        (Select):
+            * Rows convert to records with ``record_class(ModelClass)._make``
+
+    """
+    stmt = select(record_class(ModelClass).columns)
+
+    for criterion in whereclause:
+        stmt = stmt.where(criterion)
+
+    return stmt
+
+
+def iter_records(connection, ModelClass, *whereclause, **kwargs):
+    """Yield every matching row of ``ModelClass`` as a record, ordered by id
+
+    Args:
+        connection (Connection, Session):
+            * Anything with an ``execute`` method
+        ModelClass (Base):
+            * One of the models in :mod:`ipcrawl.database.models`
+        whereclause (list):
+            * Optional criteria, see :func:`select_records`
+        batch_size (int):
+            * Rows fetched from the cursor at a time. Default ``10000``
+
+    Yields:
+        (tuple): See :func:`record_class`
+
+    """
+    batch_size = kwargs.pop('batch_size', 10000)
+    make = record_class(ModelClass)._make
+    stmt = select_records(ModelClass, *whereclause).order_by(
+        ModelClass.__table__.c.id
+    )
+    result = connection.execute(stmt)
+
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+
+        for row in rows:
+            yield make(row)
+
+
+def lookup_statement(ModelClass):
+    """The cached statement that finds the network an address may belong to
+
+    The primary key is the first address of each network, so the candidate
+    is the row with the greatest ``id`` not above the address. That is a
+    single seek on the ``rowid`` B-tree.
+
+    """
+    stmt = _lookup_statements.get(ModelClass)
+
+    if stmt is None:
+        table = ModelClass.__table__
+        stmt = select_records(
+            ModelClass, table.c.id <= bindparam('ip'),
+        ).order_by(table.c.id.desc()).limit(1)
+        _lookup_statements[ModelClass] = stmt
+
+    return stmt
+
+
+def lookup(connection, ModelClass, ip):
+    """Find the record of the network that contains ``ip``
+
+    Args:
+        connection (Connection, Session):
+            * Anything with an ``execute`` method
+        ModelClass (Base):
+            * One of the models in :mod:`ipcrawl.database.models`
+        ip (str, int):
+            * A dotted quad or an unsigned 32-bit ``int``
+
+    Returns:
+        (tuple, None):
+            * See :func:`record_class`. ``None`` when no network contains
+              ``ip``
+
+    """
+    if not isinstance(ip, int):
+        ip = ip_to_int(ip)
+
+    row = connection.execute(
+        lookup_statement(ModelClass), {'ip': ip}
+    ).first()
+
+    if row is None:
+        return None
+
+    record = record_class(ModelClass)._make(row)
+
+    if network_range(record.network)[1] < ip:
+        return None
+
+    return record
+
+
+def cache_columns(lookup_models=LOOKUP_MODELS):
+    """The ``enrichment_cache`` columns that hold the ids of ``lookup_models``
+
+    See :class:`ipcrawl.database.models.EnrichmentCache`.
+
+    Returns:
+        (list):
+
+    """
+    table = models.EnrichmentCache.__table__
+    return [
+        table.c['{}_id'.format(ModelClass.__tablename__)]
+        for ModelClass in lookup_models
+    ]
+
+
+def cached_statement(lookup_models=LOOKUP_MODELS):
+    """The statement that reads the cached records of an address
+
+    The cache row is found by its ``rowid`` and every record by its primary
+    key, one statement for all of ``lookup_models``. No row means the address
+    was never looked up. A row whose record columns are all ``NULL`` means no
+    network contained it.
+
+    """
+    lookup_models = tuple(lookup_models)
+    stmt = _cached_statements.get(lookup_models)
+
+    if stmt is None:
+        cache = models.EnrichmentCache.__table__
+        joined = cache
+        columns = []
+
+        for ModelClass, column in zip(
+            lookup_models, cache_columns(lookup_models),
+        ):
+            table = ModelClass.__table__
+            joined = joined.outerjoin(table, table.c.id == column)
+            columns.extend(record_class(ModelClass).columns)
+
+        stmt = select(columns).select_from(joined).where(
+            cache.c.ip == bindparam('ip'),
+        ).apply_labels()
+        _cached_statements[lookup_models] = stmt
+
+    return stmt
+
+
+class LookupContext(object):
+    """A read only lookup scope that lives as long as a whole crawl
+
+    One connection is opened for the lifetime of the context and switched
+    to ``PRAGMA query_only``, nothing is ever committed. Every lookup
+    statement is compiled once, then executed straight on a reused DBAPI
+    cursor, so the cost of a lookup is the cost of the query itself. The
+    cursor bypasses engine events, lookups are recorded by hand when the
+    engine has :class:`ipcrawl.database.stats.QueryStats` attached.
+
+    Example:
+
+        .. code-block::
+
+            with LookupContext() as ctx:
+                for ip in ips:
+                    records = ctx.lookup_all(ip)
+
+    With ``cache``, what every address of :data:`LOOKUP_MODELS` resolved to
+    is also written to the ``enrichment_cache`` table. Addresses looked up
+    before, in this or any earlier run, then cost a single statement, see
+    :func:`cached_statement`. The cache only holds lookups of the GeoLite2
+    release currently loaded, see :func:`ipcrawl.database.sqlite3.set_release`.
+
+    Args:
+        engine (Engine):
+            * When ``None``, an engine is created for ``filename``
+        filename (str):
+            * A path to the db filename. Default
+              :data:`ipcrawl.database.sqlite3.DEFAULT_DB`
+        cache (bool):
+            * Read and write the ``enrichment_cache`` table
+        validate (bool):
+            * Run :meth:`validate_cache` when opened with ``cache``. Pass
+              ``False`` when it already ran on this db, it writes to it
+        write_lock (threading.Lock):
+            * Held while the cache is flushed, share one between contexts
+              of the same process writing to the same db
+
+    """
+
+    def __init__(
+        self, engine=None, filename=None, cache=False, validate=True,
+        write_lock=None,
+    ):
+        self.engine = engine or sqlite3.init_engine(filename)
+        self.query_stats = stats.attached(self.engine)
+        self.cache = cache
+        self.validate = validate
+        self.write_lock = write_lock
+        self.connection = None
+        self.cursor = None
+        self.compiled = {}
+        self.pending = []
+
+    def open(self):
+        if self.connection is None:
+            self.connection = self.engine.connect()
+
+            if self.cache and self.validate:
+                self.validate_cache()
+
+            self.connection.execute('PRAGMA query_only = ON')
+            self.cursor = self.connection.connection.cursor()
+
+        return self
+
+    def validate_cache(self):
+        """Create the cache table of older dbs, and empty it when it holds
+        lookups of another GeoLite2 release
+
+        """
+        sqlite3.create_tables(self.engine)
+        release = sqlite3.get_metadata(self.connection, sqlite3.RELEASE_KEY)
+
+        if sqlite3.get_metadata(
+            self.connection, sqlite3.CACHE_RELEASE_KEY,
+        ) != release:
+            with self.connection.begin():
+                sqlite3.clear_enrichment_cache(self.connection, release)
+
+    def flush(self):
+        """Write the lookups cached since the last flush
+
+        The write lock of the db is taken before anything is written, a
+        flush waits for other writers up to the busy timeout of the
+        connection, see :data:`ipcrawl.database.sqlite3.BUSY_TIMEOUT`.
+
+        """
+        if not self.pending:
+            return
+
+        columns = ['ip'] + [column.name for column in cache_columns()]
+        sql = 'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+            models.EnrichmentCache.__tablename__,
+            ', '.join(columns),
+            ', '.join('?' * len(columns)),
+        )
+
+        dbapi_connection = self.connection.connection
+        write_lock = self.write_lock or nullcontext()
+
+        self.cursor.execute('PRAGMA query_only = OFF')
+        try:
+            with write_lock, metrics.timer('lookup.cache.flush'):
+                # a deferred transaction upgraded to a write fails at once
+                # when another connection writes, rather than waiting
+                self.cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    self.cursor.executemany(sql, self.pending)
+                except Exception:
+                    dbapi_connection.rollback()
+                    raise
+                dbapi_connection.commit()
+        finally:
+            self.cursor.execute('PRAGMA query_only = ON')
+
+        self.pending = []
+
+    def close(self):
+        if self.connection is not None:
+            if self.cache:
+                self.flush()
+
+            self.cursor.close()
+            # pooled connections are shared, hand them back writable
+            self.connection.execute('PRAGMA query_only = OFF')
+            self.connection.close()
+            self.connection = self.cursor = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _compile(self, key, stmt):
+        compiled = self.compiled.get(key)
+
+        if compiled is None:
+            dialect = self.engine.dialect
+            columns = list(stmt.inner_columns)
+            stmt = stmt.compile(dialect=dialect)
+            defaults = stmt.construct_params({'ip': 0})
+            processors = [
+                (i, processor)
+                for i, processor in enumerate(
+                    c.type.result_processor(dialect, None) for c in columns
+                )
+                if processor is not None
+            ]
+
+            compiled = (
+                stmt.string,
+                [defaults[name] for name in stmt.positiontup],
+                stmt.positiontup.index('ip'),
+                processors,
+            )
+            self.compiled[key] = compiled
+
+        return compiled
+
+    def compile(self, ModelClass):
+        """Compile the lookup statement of ``ModelClass`` once
+
+        Returns:
+            (tuple):
+                * ``(sql, params, ip_index, processors)``
+
+        """
+        return self._compile(ModelClass, lookup_statement(ModelClass))
+
+    def execute(self, compiled, ip):
+        """Run a compiled statement for ``ip`` and fetch its first row
+
+        Returns:
+            (list, None):
+                * The row with every column converted, ``None`` when the
+                  statement returned no row
+
+        """
+        sql, params, ip_index, processors = compiled
+        params = list(params)
+        params[ip_index] = ip
+
+        self.open()
+        query_stats = self.query_stats
+
+        if query_stats is not None:
+            query_stats.observe(self.connection.connection, sql, params)
+            started = time.perf_counter()
+
+        self.cursor.execute(sql, params)
+        row = self.cursor.fetchone()
+
+        if query_stats is not None:
+            query_stats.record(
+                sql,
+                time.perf_counter() - started,
+                int(row is not None),
+                parameters=params,
+            )
+
+        if row is not None and processors:
+            row = list(row)
+            for i, processor in processors:
+                row[i] = processor(row[i])
+
+        return row
+
+    def lookup(self, ModelClass, ip):
+        """Find the record of the network that contains ``ip``
+
+        See :func:`lookup`, this returns the same records.
+
+        """
+        if not isinstance(ip, int):
+            ip = ip_to_int(ip)
+
+        row = self.execute(self.compile(ModelClass), ip)
+
+        if row is None:
+            return None
+
+        record = record_class(ModelClass)._make(row)
+
+        if network_range(record.network)[1] < ip:
+            return None
+
+        return record
+
+    def cached(self, ip):
+        """The records of :data:`LOOKUP_MODELS` cached for ``ip``
+
+        Returns:
+            (dict, None):
+                * See :meth:`lookup_all`, ``None`` when ``ip`` is not cached
+
+        """
+        row = self.execute(self._compile('cached', cached_statement()), ip)
+
+        if row is None:
+            return None
+
+        found = {}
+        start = 0
+
+        for ModelClass in LOOKUP_MODELS:
+            cls = record_class(ModelClass)
+            end = start + len(cls.columns)
+            # the primary key is never NULL, unless nothing was joined
+            record = cls._make(row[start:end])
+            found[ModelClass.__tablename__] = (
+                record if record.id is not None else None
+            )
+            start = end
+
+        return found
+
+    def lookup_all(self, ip, models=LOOKUP_MODELS):
+        """Look ``ip`` up in every model
+
+        Args:
+            ip (str, int):
+                * A dotted quad or an unsigned 32-bit ``int``
+            models (list, tuple):
+                * Default :data:`LOOKUP_MODELS`
+
+        Returns:
+            (dict):
+                * The record or ``None`` keyed by ``__tablename__``
+
+        """
+        if not isinstance(ip, int):
+            ip = ip_to_int(ip)
+
+        cache = self.cache and set(models) == set(LOOKUP_MODELS)
+
+        if cache:
+            found = self.cached(ip)
+
+            if found is not None:
+                metrics.incr('lookup.cache.hits')
+                return found
+
+            metrics.incr('lookup.cache.misses')
+
+        found = {
+            ModelClass.__tablename__: self.lookup(ModelClass, ip)
+            for ModelClass in models
+        }
+
+        if cache:
+            self.pending.append([ip] + [
+                getattr(found[ModelClass.__tablename__], 'id', None)
+                for ModelClass in LOOKUP_MODELS
+            ])
+
+            if len(self.pending) >= CACHE_FLUSH_EVERY:
+                self.flush()
+
+        return found
+
+    def __repr__(self):
+        return 'LookupContext(engine={!r})'.format(self.engine)
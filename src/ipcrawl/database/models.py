@@ -5,28 +5,55 @@ from __future__ import unicode_literals
 
 from ipcrawl.utils import log  # noqa
 
+from ipcrawl.utils import network_range
+
 from sqlalchemy import Column
 from sqlalchemy import types
 
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 
-import uuid
-
 # we define this here since there should only be one and each db should
 # reference this instance.
 Base = declarative_base()
 
 
-def generate_uuid():
-    """Generates a random UUID string
+def generate_network_id(context):
+    """Generates a primary key from the first address of the ``network`` column
+
+    GeoLite2 block networks never overlap within a single CSV, so the first
+    address of a network is unique per table. Using it as the key makes the
+    primary key an alias for the SQLite ``rowid``, rows are stored in network
+    order and an address can be resolved with a single ``rowid`` seek.
+
+    Args:
+        context (DefaultExecutionContext):
+            * Provided by sqlalchemy when the row is inserted.
+
+    Returns:
+        (int):
+            * The first address of the network as an unsigned 32-bit ``int``
 
     """
-    return uuid.uuid4().hex
+    network = context.get_current_parameters()['network']
+    return network_range(network)[0]
 
 
 class ModelDictMixin(object):
 
+    @classmethod
+    def dict_columns(cls):
+        """The names :meth:`to_dict` returns, resolved once per class
+
+        """
+        columns = cls.__dict__.get('_dict_columns')
+
+        if columns is None:
+            columns = tuple(c.name.lstrip('_') for c in cls.__table__.columns)
+            cls._dict_columns = columns
+
+        return columns
+
     def to_dict(self, columns=None):
         """Return model as a ``dict``
 
@@ -41,8 +68,7 @@ class ModelDictMixin(object):
                 * With selected columns and values.
 
         """
-        table = Base.metadata.tables[self.__tablename__]
-        columns = columns or [f.name.lstrip('_') for f in table.columns]
+        columns = columns or self.dict_columns()
 
         return {
             column: getattr(self, column)
@@ -58,8 +84,9 @@ class GeoLite2AsnBlocksIpv4(Base, ModelDictMixin):
         * `Using Descriptors and Hybrids <https://docs.sqlalchemy.org/en/13/orm/mapped_attributes.html#using-descriptors-and-hybrids/>`_
 
     Args:
-        id (str):
-            * The primary key
+        id (int):
+            * The primary key, the first address of ``network`` as an
+              unsigned 32-bit ``int``. See :func:`generate_network_id`
         network (str):
             * This is the IPv4 network in CIDR format such as “2.21.92.0/29”
         autonomous_system_number (int):
@@ -72,10 +99,10 @@ class GeoLite2AsnBlocksIpv4(Base, ModelDictMixin):
     __tablename__ = "geolite2_asn_blocks_ipv4"
 
     id = Column(
-        types.String(16),
-        index=True,
+        types.Integer(),
         primary_key=True,
-        default=generate_uuid
+        autoincrement=False,
+        default=generate_network_id
     )
 
     network = Column(
@@ -85,6 +112,7 @@ class GeoLite2AsnBlocksIpv4(Base, ModelDictMixin):
 
     autonomous_system_number = Column(
         types.Integer(),
+        index=True,
     )
 
     autonomous_system_organization = Column(
@@ -102,8 +130,9 @@ class GeoLite2CityBlocksIpv4(Base, ModelDictMixin):
         * `GeoIP2 City and Country CSV Databases <https://dev.maxmind.com/geoip/geoip2/geoip2-city-country-csv-databases/>`_
 
     Args:
-        id (str):
-            * The primary key
+        id (int):
+            * The primary key, the first address of ``network`` as an
+              unsigned 32-bit ``int``. See :func:`generate_network_id`
         network (str):
             * This is the IPv4 network in CIDR format such as “2.21.92.0/29”
         geoname_id (int):
@@ -152,10 +181,10 @@ class GeoLite2CityBlocksIpv4(Base, ModelDictMixin):
     __tablename__ = "geolite2_city_blocks_ipv4"
 
     id = Column(
-        types.String(16),
-        index=True,
+        types.Integer(),
         primary_key=True,
-        default=generate_uuid
+        autoincrement=False,
+        default=generate_network_id
     )
 
     network = Column(
@@ -164,7 +193,8 @@ class GeoLite2CityBlocksIpv4(Base, ModelDictMixin):
     )
 
     geoname_id = Column(
-        types.Integer()
+        types.Integer(),
+        index=True,
     )
 
     registered_country_geoname_id = Column(
@@ -235,3 +265,65 @@ class GeoLite2CityBlocksIpv4(Base, ModelDictMixin):
 
     def __repr__(self):
         return 'GeoLite2CityBlocksIpv4(id={!r})'.format(self.id)
+
+
+class Metadata(Base):
+    """Key value pairs describing the db itself
+
+    Args:
+        key (str):
+            * Such as ``geolite2_release``
+        value (str):
+
+    """
+    __tablename__ = "ipcrawl_metadata"
+
+    key = Column(
+        types.String(),
+        primary_key=True,
+    )
+
+    value = Column(
+        types.String(),
+    )
+
+    def __repr__(self):
+        return 'Metadata(key={!r})'.format(self.key)
+
+
+class EnrichmentCache(Base):
+    """The networks addresses were resolved to by earlier lookups
+
+    One column per model of :data:`ipcrawl.database.lookup.LOOKUP_MODELS`,
+    named ``<__tablename__>_id``, holds the ``id`` of the network the address
+    belongs to or ``NULL`` when no network contains it. Rows are only valid
+    for the GeoLite2 release they were resolved against, see
+    :func:`ipcrawl.database.sqlite3.set_release`.
+
+    Args:
+        ip (int):
+            * The primary key, the address as an unsigned 32-bit ``int``
+        geolite2_asn_blocks_ipv4_id (int):
+            * See :class:`GeoLite2AsnBlocksIpv4`
+        geolite2_city_blocks_ipv4_id (int):
+            * See :class:`GeoLite2CityBlocksIpv4`
+
+    """
+    __tablename__ = "enrichment_cache"
+
+    ip = Column(
+        types.Integer(),
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    geolite2_asn_blocks_ipv4_id = Column(
+        types.Integer(),
+    )
+
+    geolite2_city_blocks_ipv4_id = Column(
+        types.Integer(),
+    )
+
+    def __repr__(self):
+        return 'EnrichmentCache(ip={!r})'.format(self.ip)
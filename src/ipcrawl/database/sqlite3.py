@@ -6,22 +6,41 @@ from __future__ import unicode_literals
 from contextlib import contextmanager
 
 from ipcrawl.database.models import Base
+from ipcrawl.database.models import EnrichmentCache
+from ipcrawl.database.models import Metadata
 from ipcrawl.utils import log
+from ipcrawl.utils import metrics
+from ipcrawl.utils import network_range
 
 from sqlalchemy.orm import sessionmaker
 
 from sqlalchemy import create_engine
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable
 
 Session = sessionmaker()
 DEFAULT_DB = 'ipcrawl.sqlite3'
 
+# Metadata keys, the GeoLite2 release loaded and the one cached lookups were
+# resolved against
+RELEASE_KEY = 'geolite2_release'
+CACHE_RELEASE_KEY = 'enrichment_cache_release'
 
-def init_engine(filename=None, **kwargs):
+# seconds a connection waits for another one to release the write lock
+BUSY_TIMEOUT = 30
+
+
+def init_engine(filename=None, query_stats=None, **kwargs):
     """Initialize a sqlite3 db engine for sqlalchemy
 
     Args:
         filename (str):
             * A path to the db filename
+        query_stats (QueryStats):
+            * Record every statement, see
+              :class:`ipcrawl.database.stats.QueryStats`
         kwargs (dict):
             * Extra key value pairs to pass ``create_engine``
 
@@ -31,22 +50,327 @@ def init_engine(filename=None, **kwargs):
     """
     filename = filename or DEFAULT_DB
     db_uri = 'sqlite:///{filename}'.format(filename=filename)
-    return create_engine(db_uri, **kwargs)
+    engine = create_engine(db_uri, **kwargs)
+
+    if query_stats is not None:
+        query_stats.attach(engine)
+
+    return engine
+
+
+def create_tables(engine):
+    """Create database tables that do not exist yet, without their indexes
+
+    Args:
+        engine (Engine):
+            * See :class:`sqlalchemy.engine.base.Engine`
+
+    """
+    existing = set(inspect(engine).get_table_names())
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            engine.execute(CreateTable(table))
+
+
+def _existing_indexes(engine):
+    inspector = inspect(engine)
+    return {
+        table: {index['name'] for index in inspector.get_indexes(table)}
+        for table in inspector.get_table_names()
+    }
 
 
-def init_db(engine=None, filename=None):
+def create_indexes(engine):
+    """Create every missing index declared on the models for existing tables
+
+    Building an index after a bulk load is a single sorted pass over the
+    table instead of one B-tree update per inserted row.
+
+    Args:
+        engine (Engine):
+            * See :class:`sqlalchemy.engine.base.Engine`
+
+    """
+    existing = _existing_indexes(engine)
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+
+        for index in table.indexes:
+            if index.name not in existing[table.name]:
+                index.create(engine)
+
+
+def drop_indexes(engine):
+    """Drop every index declared on the models that exists
+
+    Call this before a bulk load into a populated db, then rebuild them with
+    :func:`finalize_db`.
+
+    Args:
+        engine (Engine):
+            * See :class:`sqlalchemy.engine.base.Engine`
+
+    """
+    existing = _existing_indexes(engine)
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in existing.get(table.name, ()):
+                index.drop(engine)
+
+
+def finalize_db(engine, analyze=True, vacuum=False, wal=True):
+    """Run the post load phase, create indexes and gather planner statistics
+
+    Args:
+        engine (Engine):
+            * See :class:`sqlalchemy.engine.base.Engine`
+        analyze (bool):
+            * When ``True``, run ``ANALYZE`` so the query planner has
+              statistics from the first query.
+        vacuum (bool):
+            * When ``True``, run ``VACUUM`` to defragment the db file.
+        wal (bool):
+            * When ``True``, switch the db file to write-ahead logging so
+              concurrent readers never block each other. The journal mode
+              is persistent, see
+              :class:`ipcrawl.database.executor.LookupExecutor`
+
+    """
+    create_indexes(engine)
+
+    if analyze:
+        engine.execute('ANALYZE')
+
+    if vacuum:
+        engine.execute('VACUUM')
+
+    if wal:
+        engine.execute('PRAGMA journal_mode = WAL')
+
+
+def init_db(engine=None, filename=None, indexes=True):
     """Create database tables if they do not exist, otherwise do nothing.
 
-    Schema migrations will need to be handled manually.
+    Schema migrations will need to be handled manually, see
+    :func:`migrate_db`.
+
+    Args:
+        engine (Engine):
+            * When ``None``, an engine is created for ``filename``
+        filename (str):
+            * A path to the db filename. Default :data:`DEFAULT_DB`
+        indexes (bool):
+            * When ``False``, only the tables are created. Bulk loaders
+              should pass ``False`` and call :func:`finalize_db` once the
+              data is loaded.
 
     """
     filename = filename or DEFAULT_DB
     engine = engine or init_engine(filename)
-    Base.metadata.create_all(engine)
+    create_tables(engine)
+
+    if indexes:
+        create_indexes(engine)
+
     Session.configure(bind=engine)
     return engine
 
 
+def _check_network_starts(conn, table_name, limit=5):
+    conn.connection.create_function(
+        'network_start', 1, lambda network: network_range(network)[0],
+    )
+    collisions = conn.execute(
+        'SELECT group_concat(network, \', \') FROM {}'
+        ' GROUP BY network_start(network) HAVING count(*) > 1'.format(
+            table_name,
+        )
+    ).fetchall()
+
+    if collisions:
+        err_msg = (
+            'Unable to migrate {}, {} network start addresses are shared by'
+            ' more than one row: {}'.format(
+                table_name,
+                len(collisions),
+                '; '.join(row[0] for row in collisions[:limit]),
+            )
+        )
+        raise ValueError(err_msg)
+
+
+def migrate_db(engine=None, filename=None, vacuum=True, batch_size=10000):
+    """Migrate tables that still use ``uuid4`` hex string primary keys
+
+    Older databases stored a random 32 character ``id`` on every row plus an
+    extra index on it. Each affected table is rebuilt in place with the
+    integer primary key derived from the ``network`` column, see
+    :func:`ipcrawl.database.models.generate_network_id`. Tables that are
+    already migrated or do not exist are left alone.
+
+    Rows whose networks start at the same address would share a key. No row
+    is ever dropped, the migration of such a table fails and it is left as
+    it was.
+
+    Args:
+        engine (Engine):
+            * When ``None``, an engine is created for ``filename``
+        filename (str):
+            * A path to the db filename. Default :data:`DEFAULT_DB`
+        vacuum (bool):
+            * When ``True`` and a table was migrated, ``VACUUM`` the db
+              afterwards to give the reclaimed pages back to the filesystem.
+        batch_size (int):
+            * The number of rows copied per ``INSERT``
+
+    Raises:
+        ValueError: When networks of a table start at the same address
+
+    Returns:
+        (list):
+            * The names of the tables that were migrated
+
+    """
+    engine = engine or init_engine(filename)
+    migrated = []
+
+    for table in Base.metadata.sorted_tables:
+        table_info = engine.execute(
+            'PRAGMA table_info({})'.format(table.name)
+        ).fetchall()
+        column_types = {row[1]: row[2].upper() for row in table_info}
+
+        if column_types.get('id', 'INTEGER') == 'INTEGER':
+            continue
+
+        log.info('migrating primary key for table={}'.format(table.name))
+
+        legacy_name = '{}_legacy'.format(table.name)
+        columns = [c.name for c in table.columns if c.name != 'id']
+        insert = table.insert()
+
+        with engine.begin() as conn:
+            _check_network_starts(conn, table.name)
+            conn.execute(
+                'ALTER TABLE {} RENAME TO {}'.format(table.name, legacy_name)
+            )
+            conn.execute(CreateTable(table))
+
+            # rowid order is the order rows were loaded from the CSV, which
+            # is sorted by network, so the new keys are appended in order.
+            rows = conn.execute(
+                'SELECT {} FROM {} ORDER BY rowid'.format(
+                    ', '.join(columns),
+                    legacy_name,
+                )
+            )
+
+            while True:
+                batch = rows.fetchmany(batch_size)
+                if not batch:
+                    break
+
+                values = []
+                for row in batch:
+                    value = dict(zip(columns, row))
+                    value['id'] = network_range(value['network'])[0]
+                    values.append(value)
+
+                conn.execute(insert, values)
+
+            conn.execute('DROP TABLE {}'.format(legacy_name))
+
+        migrated.append(table.name)
+
+    if migrated:
+        finalize_db(engine, vacuum=vacuum)
+
+    return migrated
+
+
+def get_metadata(connection, key):
+    """Read a value of the ``ipcrawl_metadata`` table
+
+    Args:
+        connection (Engine, Connection):
+            * Anything with an ``execute`` method
+        key (str):
+            * Such as :data:`RELEASE_KEY`
+
+    Returns:
+        (str, None):
+            * ``None`` when ``key`` was never set
+
+    """
+    table = Metadata.__table__
+    return connection.execute(
+        select([table.c.value]).where(table.c.key == key)
+    ).scalar()
+
+
+def set_metadata(connection, key, value):
+    """Write a value of the ``ipcrawl_metadata`` table
+
+    See :func:`get_metadata` for the arguments.
+
+    """
+    connection.execute(
+        Metadata.__table__.insert().prefix_with('OR REPLACE'),
+        {'key': key, 'value': value},
+    )
+
+
+def clear_enrichment_cache(connection, release):
+    """Delete every cached lookup and tag the cache with ``release``
+
+    Args:
+        connection (Engine, Connection):
+            * Anything with an ``execute`` method
+        release (str):
+            * See :func:`ipcrawl.geolite2.release`
+
+    """
+    connection.execute(EnrichmentCache.__table__.delete())
+    set_metadata(connection, CACHE_RELEASE_KEY, release)
+
+
+def set_release(connection, release):
+    """Record the GeoLite2 release the db holds
+
+    Lookups cached against any other release are deleted, see
+    :class:`ipcrawl.database.models.EnrichmentCache`.
+
+    Args:
+        connection (Engine, Connection):
+            * Pass the connection of the transaction that loaded the release
+              to commit both together. An engine runs in its own transaction
+        release (str):
+            * See :func:`ipcrawl.geolite2.release`
+
+    Returns:
+        (bool):
+            * ``True`` when cached lookups were deleted
+
+    """
+    if isinstance(connection, Engine):
+        with connection.begin() as conn:
+            return set_release(conn, release)
+
+    set_metadata(connection, RELEASE_KEY, release)
+
+    if get_metadata(connection, CACHE_RELEASE_KEY) == release:
+        return False
+
+    clear_enrichment_cache(connection, release)
+
+    log.info('geolite2 release is now {}'.format(release))
+    return True
+
+
 @contextmanager
 def session_scope(**kwargs):
     """Provide a transactional scope around a series of operations.
@@ -64,10 +388,13 @@ def session_scope(**kwargs):
         session = Session(**kwargs)
 
     try:
-        yield session
-        session.commit()
+        with metrics.timer('db.session'):
+            yield session
+            session.commit()
+        metrics.incr('db.session.commit')
     except Exception:
         session.rollback()
+        metrics.incr('db.session.rollback')
         raise
     finally:
         session.close()
@@ -0,0 +1,326 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.utils import log
+
+from sqlalchemy import event
+
+import math
+import random
+import threading
+import time
+import weakref
+
+# statements that run longer are logged with their query plan, in seconds
+SLOW_QUERY_THRESHOLD = 0.1
+
+# latencies kept per statement to estimate percentiles
+MAX_SAMPLES = 10000
+
+_attached = weakref.WeakKeyDictionary()
+
+
+def attached(engine):
+    """The :class:`QueryStats` attached to ``engine``
+
+    Returns:
+        (QueryStats, None):
+
+    """
+    return _attached.get(engine)
+
+
+def query_plan(dbapi_connection, statement, parameters=()):
+    """Run ``EXPLAIN QUERY PLAN`` for ``statement``
+
+    Args:
+        dbapi_connection (Connection):
+            * A :mod:`sqlite3` connection, or a pooled proxy of one
+        statement (str):
+            * The SQL, with ``?`` placeholders
+        parameters (list, tuple):
+            * The values of the placeholders
+
+    Returns:
+        (list):
+            * The ``detail`` of every step, such as
+              ``SCAN geolite2_asn_blocks_ipv4``
+
+    """
+    cursor = dbapi_connection.cursor()
+
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def is_full_scan(plan):
+    """Whether a step of ``plan`` reads a whole table or index
+
+    ``SEARCH`` steps seek through an index, ``SCAN`` steps visit every row.
+    Scans of SQLite's own ``sqlite_*`` tables, such as the reflection
+    queries SQLAlchemy runs, are not counted.
+
+    """
+    for step in plan:
+        words = step.split()
+
+        if words[:1] != ['SCAN'] or len(words) < 2:
+            continue
+
+        # SQLite before 3.36 writes "SCAN TABLE name"
+        name = words[2] if words[1] == 'TABLE' and len(words) > 2 else words[1]
+
+        if name != 'CONSTANT' and not name.startswith('sqlite_'):
+            return True
+
+    return False
+
+
+def _explainable(statement):
+    return statement.lstrip()[:6].upper() in ('SELECT', 'UPDATE', 'DELETE')
+
+
+class _CountingCursor(object):
+    """Wraps a DBAPI cursor to time fetches and count the rows returned
+
+    :mod:`sqlite3` steps through a query as rows are fetched, the latency of
+    a statement is the time spent executing plus fetching.
+
+    """
+    __slots__ = ('cursor', 'stats', 'sample')
+
+    def __init__(self, cursor, stats, sample):
+        self.cursor = cursor
+        self.stats = stats
+        self.sample = sample
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        rows = method(*args)
+        self.sample[2] += time.perf_counter() - started
+        return rows
+
+    def fetchone(self):
+        row = self._fetch(self.cursor.fetchone)
+        if row is not None:
+            self.sample[3] += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._fetch(self.cursor.fetchmany, *args)
+        self.sample[3] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self.cursor.fetchall)
+        self.sample[3] += len(rows)
+        return rows
+
+    def close(self):
+        self.cursor.close()
+        self.stats.finish(self.sample)
+
+
+class QueryStats(object):
+    """Per statement counts, latencies and rows of every query on an engine
+
+    Listens to ``before_cursor_execute`` and ``after_cursor_execute``. The
+    latency of a statement runs from execution until its cursor is closed.
+    A ``SELECT``, ``UPDATE`` or ``DELETE`` is explained with ``EXPLAIN QUERY
+    PLAN`` the first time it runs, so full table scans show up right away.
+    Statements slower than ``slow_threshold`` are logged with their plan.
+    The plan is looked up on a cursor of its own, the statement's cursor is
+    left alone. One instance may be shared by connections of many threads.
+
+    Example:
+
+        .. code-block::
+
+            stats = QueryStats()
+            engine = init_engine(query_stats=stats)
+            ...
+            print(to_json(stats.summary()))
+
+    Args:
+        slow_threshold (float):
+            * Seconds. Default :data:`SLOW_QUERY_THRESHOLD`
+        explain (bool):
+            * When ``False``, no query plan is ever looked up
+        max_samples (int):
+            * Latencies kept per statement for :meth:`summary` percentiles
+
+    """
+
+    def __init__(
+        self, slow_threshold=SLOW_QUERY_THRESHOLD, explain=True,
+        max_samples=MAX_SAMPLES,
+    ):
+        self.slow_threshold = slow_threshold
+        self.explain = explain
+        self.max_samples = max_samples
+        self.statements = {}
+        self.plans = {}
+        self.lock = threading.Lock()
+        self.random = random.Random(0)
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_execute)
+        _attached[engine] = self
+        return engine
+
+    def detach(self, engine):
+        event.remove(engine, 'before_cursor_execute', self.before_execute)
+        event.remove(engine, 'after_cursor_execute', self.after_execute)
+        _attached.pop(engine, None)
+
+    def observe(self, dbapi_connection, statement, parameters):
+        """Look up the plan of ``statement`` the first time it runs
+
+        """
+        if not self.explain:
+            return
+
+        with self.lock:
+            if statement in self.plans:
+                return
+
+            # claimed, other threads running it meanwhile do not explain it
+            self.plans[statement] = None
+
+        plan = None
+        if _explainable(statement):
+            try:
+                plan = query_plan(dbapi_connection, statement, parameters)
+            except Exception as exp:
+                log.debug('unable to explain {!r}: {}'.format(statement, exp))
+
+        with self.lock:
+            self.plans[statement] = plan
+
+        if plan and is_full_scan(plan):
+            log.warning('full scan: {}\n    {}'.format(
+                statement, '\n    '.join(plan),
+            ))
+
+    def before_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        if not executemany:
+            self.observe(conn.connection, statement, parameters)
+
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        rows = 0 if cursor.description else max(cursor.rowcount, 0)
+        sample = [statement, parameters, elapsed, rows, False]
+
+        if context is not None and cursor.description:
+            context.cursor = _CountingCursor(cursor, self, sample)
+        else:
+            self.finish(sample)
+
+    def finish(self, sample):
+        statement, parameters, elapsed, rows, finished = sample
+
+        if not finished:
+            sample[4] = True
+            self.record(statement, elapsed, rows, parameters=parameters)
+
+    def record(self, statement, elapsed, rows, parameters=None):
+        """Add one execution of ``statement``
+
+        Args:
+            statement (str):
+                * The SQL
+            elapsed (float):
+                * Seconds
+            rows (int):
+                * Rows returned, or affected by DML
+            parameters (list, tuple):
+                * Only used to log slow statements
+
+        """
+        with self.lock:
+            stats = self.statements.get(statement)
+
+            if stats is None:
+                stats = self.statements[statement] = [0, 0.0, 0.0, 0, []]
+
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3] += rows
+
+            samples = stats[4]
+            if len(samples) < self.max_samples:
+                samples.append(elapsed)
+            else:
+                i = self.random.randrange(stats[0])
+                if i < self.max_samples:
+                    samples[i] = elapsed
+
+            plan = self.plans.get(statement)
+
+        if elapsed >= self.slow_threshold:
+            log.warning('slow query {:.1f} ms, {} rows: {} {!r}\n{}'.format(
+                elapsed * 1000,
+                rows,
+                statement,
+                parameters,
+                '\n'.join(
+                    '    ' + step
+                    for step in plan or ['no plan']
+                ),
+            ))
+
+    def summary(self):
+        """Every statement, most expensive first
+
+        Returns:
+            (list):
+                * One ``dict`` per statement with its ``count``, ``rows``,
+                  ``total``, ``mean``, ``p99`` and ``max`` seconds, ``plan``
+                  and whether it is a ``full_scan``
+
+        """
+        with self.lock:
+            items = [
+                (
+                    statement,
+                    list(stats[:4]),
+                    sorted(stats[4]),
+                    self.plans.get(statement),
+                )
+                for statement, stats in self.statements.items()
+            ]
+
+        summary = []
+        for statement, (count, total, high, rows), samples, plan in items:
+            summary.append({
+                'statement': statement,
+                'count': count,
+                'rows': rows,
+                'total': total,
+                'mean': total / count,
+                'p99': samples[int(math.ceil(0.99 * len(samples))) - 1],
+                'max': high,
+                'plan': plan,
+                'full_scan': bool(plan) and is_full_scan(plan),
+            })
+
+        return sorted(summary, key=lambda item: item['total'], reverse=True)
+
+    def __repr__(self):
+        return 'QueryStats(statements={!r})'.format(len(self.statements))
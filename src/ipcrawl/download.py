@@ -0,0 +1,404 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ipcrawl.utils import log
+
+from requests.adapters import HTTPAdapter
+
+import hashlib
+import os
+import re
+import requests
+import time
+
+CHUNK_SIZE = 65536
+PART_SUFFIX = '.part'
+HASH_ALGORITHMS = ('md5', 'sha256')
+
+
+class HashingWriter(object):
+    """Wraps a binary file object and hashes every byte written through it
+
+    Args:
+        fd (file):
+            * A binary file object opened for writing
+        algorithms (list, tuple):
+            * Names understood by :func:`hashlib.new`. Default
+              :data:`HASH_ALGORITHMS`
+
+    """
+
+    def __init__(self, fd, algorithms=HASH_ALGORITHMS):
+        self.fd = fd
+        self.hashes = {name: hashlib.new(name) for name in algorithms}
+
+    def update(self, data):
+        for hash_obj in self.hashes.values():
+            hash_obj.update(data)
+
+    def write(self, data):
+        self.update(data)
+        return self.fd.write(data)
+
+    def update_from_file(self, filename, blocksize=CHUNK_SIZE):
+        """Hash the existing contents of ``filename`` without writing them"""
+        with open(filename, 'rb') as infile:
+            for block in iter(lambda: infile.read(blocksize), b''):
+                self.update(block)
+
+    def hexdigests(self):
+        return {
+            name: hash_obj.hexdigest()
+            for name, hash_obj in self.hashes.items()
+        }
+
+
+def parse_checksum(content):
+    """Parse the output of ``md5sum``/``sha256sum`` or a bare hex digest
+
+    Args:
+        content (str):
+            * Such as ``"d41d8cd9...  GeoLite2-ASN-CSV.zip"``
+
+    Returns:
+        (str):
+            * The lower case hex digest
+
+    """
+    return content.strip().split()[0].lower()
+
+
+def verify_checksums(url, actual, expected):
+    """Compare hex digests for every algorithm in ``expected``
+
+    Raises:
+        ValueError: On the first mismatch.
+
+    """
+    for name, expected_digest in sorted((expected or {}).items()):
+        if actual.get(name) != parse_checksum(expected_digest):
+            err_msg = (
+                '{name} checksum mismatch for {url},'
+                ' expected {expected} to equal {actual}'
+            ).format(
+                name=name.upper(),
+                url=url,
+                expected=parse_checksum(expected_digest),
+                actual=actual.get(name),
+            )
+            raise ValueError(err_msg)
+
+
+class DownloadResult(object):
+    """The outcome of a single download
+
+    Args:
+        url (str):
+            * The url that was downloaded
+        filename (str):
+            * Where the response body was saved
+        size (int):
+            * The total size of ``filename`` in bytes
+        transferred (int):
+            * The bytes transferred by this request, less than ``size`` when
+              a partial file was resumed.
+        elapsed (float):
+            * The wall time in seconds of the transfer
+        checksums (dict):
+            * Hex digest of the whole file per algorithm, computed while the
+              bytes were written.
+
+    """
+
+    def __init__(self, url, filename, size, transferred, elapsed,
+                 checksums=None):
+        self.url = url
+        self.filename = filename
+        self.size = size
+        self.transferred = transferred
+        self.elapsed = elapsed
+        self.checksums = checksums or {}
+
+    @property
+    def resumed(self):
+        return self.transferred < self.size
+
+    @property
+    def rate(self):
+        """Throughput in bytes per second"""
+        if not self.elapsed:
+            return float(self.transferred)
+        return self.transferred / self.elapsed
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'filename': self.filename,
+            'size': self.size,
+            'transferred': self.transferred,
+            'elapsed': self.elapsed,
+            'resumed': self.resumed,
+            'rate': self.rate,
+            'checksums': self.checksums,
+        }
+
+    def __repr__(self):
+        return 'DownloadResult(url={!r})'.format(self.url)
+
+
+def create_session(pool_size=4, max_retries=3):
+    """Create a :class:`requests.Session` with a connection pool
+
+    Args:
+        pool_size (int):
+            * The number of connections kept alive per host. This should be
+              at least the number of concurrent downloads.
+        max_retries (int):
+            * Retries for failed connection attempts
+
+    Returns:
+        (Session):
+
+    """
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=max_retries,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _content_range(resp):
+    """``(start, total)`` of the ``Content-Range`` header, either is ``None``
+    when the header leaves it out or is missing
+
+    """
+    # Content-Range: bytes 0-99/1234, bytes 0-99/* or bytes */1234
+    match = re.match(
+        r'bytes (?:(\d+)-\d+|\*)/(\d+|\*)$',
+        resp.headers.get('Content-Range', '').strip(),
+    )
+
+    if match is None:
+        return None, None
+
+    start, total = match.groups()
+    return (
+        int(start) if start is not None else None,
+        int(total) if total.isdigit() else None,
+    )
+
+
+def download(
+    url, save_as, session=None, chunk_size=CHUNK_SIZE, timeout=60,
+    checksums=None,
+):
+    """Download ``url`` to ``save_as``, resuming an interrupted transfer
+
+    The body is streamed into ``<save_as>.part`` and only renamed to
+    ``save_as`` once it is complete. When a ``.part`` file already exists,
+    the download continues from its size with a ``Range`` request. Servers
+    that ignore the range and answer ``200``, or answer ``206`` with another
+    range, are downloaded from the start.
+
+    The MD5 and SHA-256 of the file are computed as the bytes are written,
+    so verifying ``checksums`` needs no extra pass over the file. Only the
+    bytes of a resumed ``.part`` file are read back once.
+
+    The body is saved exactly as sent. No ``Content-Encoding`` is asked
+    for and none is decoded, so sizes, ranges and checksums all count the
+    bytes of the file the server published.
+
+    Args:
+        url (str):
+            * The url to download
+        save_as (str):
+            * The filename to save the response body as
+        session (Session):
+            * When ``None``, see :func:`create_session`
+        chunk_size (int):
+            * The number of bytes read from the response at a time
+        timeout (int, float):
+            * Connect and read timeout in seconds
+        checksums (dict):
+            * Expected hex digests keyed by algorithm, such as
+              ``{'md5': '...'}``. See :func:`parse_checksum`
+
+    Raises:
+        ValueError: When the server responds with an unexpected status or
+            a checksum does not match. A mismatching ``.part`` file is
+            removed and ``save_as`` is left untouched.
+        IOError: When the transfer ended before the expected size, the
+            ``.part`` file is kept so the next attempt resumes.
+
+    Returns:
+        (DownloadResult):
+
+    """
+    session = session or create_session(pool_size=1)
+    part = save_as + PART_SUFFIX
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    headers = {'Accept-Encoding': 'identity'}
+
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+
+    started = time.monotonic()
+    resp = session.get(url, headers=headers, stream=True, timeout=timeout)
+
+    with resp:
+        start, total = _content_range(resp)
+
+        # the remote file changed since the partial download, or the range
+        # sent is not the one asked for
+        restart = offset and resp.status_code in (206, 416) and (
+            resp.status_code == 416 or start != offset
+        )
+
+        if resp.status_code == 416 and total == offset:
+            # the previous attempt finished but was never renamed
+            expected = offset
+            transferred = 0
+            writer = HashingWriter(None)
+            writer.update_from_file(part)
+
+        elif restart:
+            os.unlink(part)
+            return download(
+                url, save_as, session=session, chunk_size=chunk_size,
+                timeout=timeout, checksums=checksums,
+            )
+
+        elif resp.status_code in (200, 206):
+            if resp.status_code == 200:
+                offset = 0
+
+            mode = 'ab' if offset else 'wb'
+            length = resp.headers.get('Content-Length')
+            expected = offset + int(length) if length is not None else None
+            transferred = 0
+
+            with open(part, mode) as fd:
+                writer = HashingWriter(fd)
+
+                if offset:
+                    writer.update_from_file(part)
+
+                for chunk in resp.raw.stream(chunk_size, decode_content=False):
+                    writer.write(chunk)
+                    transferred += len(chunk)
+
+        else:
+            err_msg = 'url={} status_code={} reason={}'.format(
+                url,
+                resp.status_code,
+                resp.reason,
+            )
+            raise ValueError(err_msg)
+
+    size = offset + transferred
+
+    if expected is not None and size != expected:
+        err_msg = (
+            'Incomplete download of {url}, received {size} of {expected}'
+            ' bytes, run again to resume'
+        ).format(url=url, size=size, expected=expected)
+        raise IOError(err_msg)
+
+    actual = writer.hexdigests()
+
+    try:
+        verify_checksums(url, actual, checksums)
+    except ValueError:
+        os.unlink(part)
+        raise
+
+    os.replace(part, save_as)
+    result = DownloadResult(
+        url=url,
+        filename=save_as,
+        size=size,
+        transferred=transferred,
+        elapsed=time.monotonic() - started,
+        checksums=actual,
+    )
+
+    log.info('downloaded {} bytes of {} in {:.2f}s ({:.0f} B/s)'.format(
+        result.transferred, url, result.elapsed, result.rate,
+    ))
+    return result
+
+
+def download_all(jobs, workers=4, session=None, **kwargs):
+    """Download every ``(url, save_as)`` in ``jobs`` concurrently
+
+    Every worker shares one pooled session, see :func:`create_session`.
+
+    Args:
+        jobs (list, tuple):
+            * ``(url, save_as)`` pairs or ``(url, save_as, checksums)``
+              triples, see :func:`download`
+        workers (int):
+            * The maximum number of concurrent downloads
+        session (Session):
+            * When ``None``, a session with ``workers`` connections is used.
+        kwargs (dict):
+            * Extra key value pairs to pass :func:`download`
+
+    Raises:
+        * The first exception raised by any download, after every other
+          download has finished.
+
+    Returns:
+        (list):
+            * :class:`DownloadResult` in the same order as ``jobs``
+
+    """
+    session = session or create_session(pool_size=workers)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                download,
+                job[0],
+                job[1],
+                session=session,
+                checksums=job[2] if len(job) > 2 else None,
+                **kwargs
+            )
+            for job in jobs
+        ]
+
+    return [future.result() for future in futures]
+
+
+def summarize(results, elapsed=None):
+    """Summarize the throughput of a batch of :func:`download_all` results
+
+    Args:
+        results (list):
+            * :class:`DownloadResult`
+        elapsed (float):
+            * The wall time of the whole batch. When ``None``, the longest
+              single download is used.
+
+    Returns:
+        (dict):
+
+    """
+    transferred = sum(r.transferred for r in results)
+    elapsed = elapsed or max([r.elapsed for r in results] or [0.0])
+
+    return {
+        'downloads': [r.to_dict() for r in results],
+        'transferred': transferred,
+        'elapsed': elapsed,
+        'rate': transferred / elapsed if elapsed else float(transferred),
+    }
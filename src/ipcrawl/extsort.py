@@ -0,0 +1,321 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.utils import int_to_ip
+from ipcrawl.utils import ips_to_array
+from ipcrawl.utils import metrics
+from ipcrawl.utils import sort_ints
+from ipcrawl.utils import UINT32
+
+from itertools import islice
+
+import array
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+
+# the default memory cap of ExternalSorter, in bytes
+MEMORY = 256 * 1024 * 1024
+
+# what one buffered address costs while a run is sorted: 4 bytes in the
+# buffer plus a list slot and an int object in the sorted copy
+BYTES_PER_ADDRESS = 4 + 8 + 32
+
+# addresses converted at a time, see ExternalSorter.update
+BATCH_SIZE = 65536
+
+# bytes read from each run at a time while merging
+READ_SIZE = 64 * 1024
+
+# runs open at once while merging, see ExternalSorter.merge_runs
+FAN_IN = 64
+
+
+def write_run(fd, values):
+    """Write sorted unsigned 32-bit ints as little endian binary
+
+    Args:
+        fd (file):
+            * A binary file object
+        values (array.array):
+            * See :func:`ipcrawl.utils.ips_to_array`
+
+    """
+    if sys.byteorder == 'big':
+        values = array.array(UINT32, values)
+        values.byteswap()
+
+    values.tofile(fd)
+
+
+def read_run(fd, read_size=READ_SIZE):
+    """Lazily read the ints written by :func:`write_run`
+
+    Args:
+        fd (file):
+            * A binary file object
+        read_size (int):
+            * Bytes read at a time
+
+    Yields:
+        (int):
+
+    """
+    read_size -= read_size % 4
+
+    while True:
+        data = fd.read(read_size)
+
+        if not data:
+            return
+
+        values = array.array(UINT32)
+        values.frombytes(data)
+
+        if sys.byteorder == 'big':
+            values.byteswap()
+
+        for value in values:
+            yield value
+
+
+def _unique(values):
+    previous = None
+
+    for value in values:
+        if value != previous:
+            yield value
+            previous = value
+
+
+class ExternalSorter(object):
+    """Sort and deduplicate more addresses than fit in memory
+
+    Addresses are buffered in an ``array`` of unsigned 32-bit ints. Once
+    the buffer reaches the memory cap it is sorted and spilled to a
+    temporary file as a run of 4 bytes per address, see :func:`write_run`.
+    :meth:`ints` lazily k-way merges the runs with what is still buffered,
+    reading :data:`READ_SIZE` bytes of each run at a time. At most
+    ``fan_in`` runs are open at once, more are first merged into fewer,
+    longer runs, see :meth:`merge_runs`.
+
+    Example:
+
+        .. code-block::
+
+            with ExternalSorter(memory=64 * 1024 * 1024) as sorter:
+                for token in iter_tokens(fd):
+                    sorter.add(token.value)
+
+                for ip in sorter:
+                    ...
+
+    Args:
+        memory (int):
+            * The memory cap in bytes. Default :data:`MEMORY`
+        directory (str):
+            * Where runs are spilled. Default :func:`tempfile.gettempdir`
+        unique (bool):
+            * When ``True``, every address is yielded once
+        fan_in (int):
+            * The most runs open at once. Default :data:`FAN_IN`
+
+    """
+
+    def __init__(
+        self, memory=MEMORY, directory=None, unique=True, fan_in=FAN_IN,
+    ):
+        if fan_in < 2:
+            err_msg = 'fan_in must be at least 2, got {!r}'.format(fan_in)
+            raise ValueError(err_msg)
+
+        self.run_size = max(1, int(memory) // BYTES_PER_ADDRESS)
+        self.directory = directory
+        self.unique = unique
+        self.fan_in = fan_in
+        self.buffer = array.array(UINT32)
+        self.runs = []
+        self.tmpdir = None
+        self.written = 0
+
+    def add(self, ip):
+        """Add one address, as a dotted quad or an ``int``
+
+        """
+        self.update((ip,))
+
+    def update(self, ips):
+        """Add many addresses, see :func:`ipcrawl.utils.ips_to_array`
+
+        ``ips`` is consumed :data:`BATCH_SIZE` addresses at a time, it may
+        be a generator of any length.
+
+        """
+        ips = iter(ips)
+
+        while True:
+            size = min(BATCH_SIZE, self.run_size - len(self.buffer))
+            batch = list(islice(ips, size))
+
+            if not batch:
+                return
+
+            self.buffer.extend(ips_to_array(batch))
+
+            if len(self.buffer) >= self.run_size:
+                self.spill()
+
+    def spill(self):
+        """Sort the buffer and write it to a new run
+
+        """
+        if not self.buffer:
+            return
+
+        filename = self._run_filename()
+
+        with metrics.timer('extsort.spill'):
+            values = sort_ints(self.buffer)
+            self.buffer = array.array(UINT32)
+
+            if self.unique:
+                values = array.array(UINT32, _unique(values))
+
+            with open(filename, mode='wb') as fd:
+                write_run(fd, values)
+
+        self.runs.append(filename)
+        metrics.incr('extsort.runs')
+
+    def _run_filename(self):
+        if self.tmpdir is None:
+            self.tmpdir = tempfile.mkdtemp(
+                prefix='ipcrawl-sort-', dir=self.directory,
+            )
+
+        self.written += 1
+        return os.path.join(self.tmpdir, '{}.run'.format(self.written))
+
+    def _merge(self, iterables):
+        merged = heapq.merge(*iterables)
+        return _unique(merged) if self.unique else merged
+
+    def merge_runs(self):
+        """Merge the runs ``fan_in`` at a time until at most ``fan_in`` remain
+
+        Each pass replaces every ``fan_in`` runs with one run of their merged
+        values, and removes them, so no more than ``fan_in`` runs plus the
+        one being written are open at once.
+
+        """
+        while len(self.runs) > self.fan_in:
+            runs, self.runs = self.runs, []
+
+            for start in range(0, len(runs), self.fan_in):
+                group = runs[start:start + self.fan_in]
+
+                if len(group) == 1:
+                    self.runs.extend(group)
+                    continue
+
+                filename = self._run_filename()
+
+                with metrics.timer('extsort.merge'):
+                    self._merge_group(group, filename)
+
+                for run in group:
+                    os.remove(run)
+
+                self.runs.append(filename)
+                metrics.incr('extsort.merges')
+
+    def _merge_group(self, group, filename):
+        fds = [open(run, mode='rb') for run in group]
+
+        try:
+            merged = self._merge([read_run(fd) for fd in fds])
+
+            with open(filename, mode='wb') as out:
+                while True:
+                    values = array.array(UINT32, islice(merged, READ_SIZE))
+
+                    if not values:
+                        break
+
+                    write_run(out, values)
+        finally:
+            for fd in fds:
+                fd.close()
+
+    def ints(self):
+        """Every address as an ``int``, in ascending order
+
+        Yields:
+            (int):
+
+        """
+        self.merge_runs()
+        fds = [open(filename, mode='rb') for filename in self.runs]
+
+        try:
+            merged = self._merge(
+                [sort_ints(self.buffer)] + [read_run(fd) for fd in fds],
+            )
+
+            for value in merged:
+                yield value
+        finally:
+            for fd in fds:
+                fd.close()
+
+    def __iter__(self):
+        return (int_to_ip(value) for value in self.ints())
+
+    def close(self):
+        """Remove the runs
+
+        """
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
+        self.runs = []
+        self.buffer = array.array(UINT32)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return 'ExternalSorter(run_size={!r}, runs={!r})'.format(
+            self.run_size, len(self.runs),
+        )
+
+
+def external_sort(
+    ips, memory=MEMORY, directory=None, unique=True, as_int=False,
+    fan_in=FAN_IN,
+):
+    """Lazily sort ``ips`` within ``memory`` bytes
+
+    See :class:`ExternalSorter`. The runs are removed once the generator is
+    exhausted or closed.
+
+    Yields:
+        (str, int):
+            * Dotted quads, or ints when ``as_int``
+
+    """
+    with ExternalSorter(
+        memory=memory, directory=directory, unique=unique, fan_in=fan_in,
+    ) as sorter:
+        sorter.update(ips)
+
+        for value in sorter.ints() if as_int else sorter:
+            yield value
@@ -0,0 +1,256 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.crawl import Hit
+from ipcrawl.lexer import CHUNK_SIZE
+from ipcrawl.lexer import create_lexer
+from ipcrawl.utils import ENCODING
+from ipcrawl.utils import log
+from ipcrawl.utils import metrics
+from ipcrawl.utils import read_json
+from ipcrawl.utils import to_json
+
+import hashlib
+import os
+import tempfile
+import time
+
+# leading bytes of the file a checkpoint fingerprints, tells a rewritten
+# file apart from the one the checkpoint was taken on
+FINGERPRINT_SIZE = 1024
+
+# seconds follow waits for new data
+INTERVAL = 1.0
+
+
+def _fingerprint(fd, size):
+    fd.seek(0)
+    return hashlib.sha1(fd.read(size)).hexdigest()
+
+
+class Tail(object):
+    """Incrementally lex the lines appended to a growing log
+
+    The byte offset and line number lexed up to are kept, and written to
+    ``checkpoint`` after every chunk, so each :meth:`poll` and each run
+    that resumes from the checkpoint only reads what was appended since.
+    A trailing line without a newline is left for the next poll.
+
+    The file is read from the start again when it was:
+
+    * rotated, a different file now has its name. Whatever was appended to
+      the old file before the rename is lexed first
+    * truncated below the offset
+    * rewritten, its leading bytes no longer match the checkpoint
+
+    Example:
+
+        .. code-block::
+
+            tail = Tail('/var/log/app.log', checkpoint='app.log.checkpoint')
+
+            for hit in tail.poll():
+                print(hit.line, hit.ip)
+
+    Args:
+        filename (str):
+            * The log to follow
+        checkpoint (str):
+            * A JSON file the position is saved to and restored from.
+              ``None`` keeps it in memory only
+        chunk_size (int):
+            * Roughly how many bytes of whole lines to lex at once
+
+    """
+
+    def __init__(self, filename, checkpoint=None, chunk_size=CHUNK_SIZE):
+        self.filename = filename
+        self.checkpoint = checkpoint
+        self.chunk_size = chunk_size
+        self.fd = None
+        self.state = self._reset()
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.state = read_json(checkpoint)
+
+    @staticmethod
+    def _reset(stat=None):
+        return {
+            'device': stat.st_dev if stat else None,
+            'inode': stat.st_ino if stat else None,
+            'offset': 0,
+            'lineno': 1,
+            'fingerprint': None,
+        }
+
+    def save(self):
+        """Atomically write the position to the checkpoint file
+
+        """
+        if self.checkpoint is None:
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.checkpoint))
+        fd, filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+        with os.fdopen(fd, mode='w', encoding=ENCODING) as tmp:
+            tmp.write(to_json(self.state))
+
+        os.replace(filename, self.checkpoint)
+
+    def _same_file(self, stat):
+        return (self.state['device'], self.state['inode']) == (
+            stat.st_dev, stat.st_ino,
+        )
+
+    def _open(self):
+        try:
+            self.fd = open(self.filename, mode='rb')
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def _rewritten(self, stat):
+        offset = self.state['offset']
+        fingerprint = self.state['fingerprint']
+
+        if stat.st_size < offset:
+            return True
+
+        return fingerprint is not None and fingerprint != _fingerprint(
+            self.fd, min(offset, FINGERPRINT_SIZE),
+        )
+
+    def _check(self):
+        """Start over unless the position still matches the open file
+
+        """
+        stat = os.fstat(self.fd.fileno())
+
+        if not self._same_file(stat):
+            if self.state['inode'] is not None:
+                metrics.incr('follow.rotations')
+                log.info('{} was rotated, reading it from the start'.format(
+                    self.filename,
+                ))
+            self.state = self._reset(stat)
+        elif self._rewritten(stat):
+            metrics.incr('follow.truncations')
+            log.info('{} was truncated, reading it from the start'.format(
+                self.filename,
+            ))
+            self.state = self._reset(stat)
+
+        self.fd.seek(self.state['offset'])
+
+    def _close(self):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+    def _lex(self, final=False):
+        """Lex what was appended to the open file
+
+        Args:
+            final (bool):
+                * Also lex a trailing line without a newline, the file is
+                  not written to anymore
+
+        """
+        while True:
+            lines = self.fd.readlines(self.chunk_size)
+
+            if lines and not final and not lines[-1].endswith(b'\n'):
+                lines.pop()
+
+            if not lines:
+                self.fd.seek(self.state['offset'])
+                return
+
+            data = b''.join(lines)
+            lineno = self.state['lineno']
+
+            for token in create_lexer(data.decode(ENCODING), lineno=lineno):
+                yield Hit(self.filename, token.lineno, token.value)
+
+            previous = self.state['offset']
+            self.state['offset'] += len(data)
+            self.state['lineno'] += len(lines)
+
+            if previous < FINGERPRINT_SIZE:
+                self.state['fingerprint'] = _fingerprint(
+                    self.fd, min(self.state['offset'], FINGERPRINT_SIZE),
+                )
+                self.fd.seek(self.state['offset'])
+
+            metrics.incr('follow.bytes', len(data))
+            self.save()
+
+    def poll(self):
+        """Lex every complete line appended since the last poll
+
+        Raises:
+            ValueError: See :class:`ipcrawl.lexer.CrawlLexer`
+
+        Yields:
+            (Hit):
+                * ``(file, line, ip)`` of every new address
+
+        """
+        if self.fd is None and not self._open():
+            return
+
+        self._check()
+
+        for hit in self._lex():
+            yield hit
+
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            stat = None
+
+        if stat is None or not self._same_file(stat):
+            # rotated, drain the old file then move on to the new one
+            for hit in self._lex(final=True):
+                yield hit
+
+            self._close()
+
+            if stat is not None:
+                for hit in self.poll():
+                    yield hit
+
+    def close(self):
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return 'Tail(filename={!r}, offset={!r}, lineno={!r})'.format(
+            self.filename, self.state['offset'], self.state['lineno'],
+        )
+
+
+def follow(filename, checkpoint=None, interval=INTERVAL, **kwargs):
+    """Yield the addresses appended to ``filename`` as they are written
+
+    Polls every ``interval`` seconds forever, see :class:`Tail`.
+
+    Yields:
+        (Hit):
+
+    """
+    with Tail(filename, checkpoint=checkpoint, **kwargs) as tail:
+        while True:
+            for hit in tail.poll():
+                yield hit
+
+            time.sleep(interval)
@@ -0,0 +1,336 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+from contextlib import nullcontext
+
+from ipcrawl.database import models
+from ipcrawl.database import sqlite3
+from ipcrawl.utils import ENCODING
+from ipcrawl.utils import log
+from ipcrawl.utils import metrics
+
+import csv
+import io
+import os
+import shutil
+import zipfile
+
+DEFAULT_DATA_DIR = os.path.join('data', 'geolite2')
+
+# edition name to the archive that MaxMind publishes it as
+ARCHIVES = {
+    'asn': 'GeoLite2-ASN-CSV.zip',
+    'city': 'GeoLite2-City-CSV.zip',
+    'country': 'GeoLite2-Country-CSV.zip',
+}
+
+# (edition, CSV member, model) in the order they are loaded
+BLOCKS = [
+    ('city', 'GeoLite2-City-Blocks-IPv4.csv', models.GeoLite2CityBlocksIpv4),
+    ('asn', 'GeoLite2-ASN-Blocks-IPv4.csv', models.GeoLite2AsnBlocksIpv4),
+]
+
+
+def find_member(zipf, name):
+    """Find an archive member by its basename
+
+    MaxMind archives nest every file below a dated directory such as
+    ``GeoLite2-ASN-CSV_20190618/``, so members are matched on basename only.
+
+    Args:
+        zipf (ZipFile):
+            * See :class:`zipfile.ZipFile`
+        name (str):
+            * The basename of the member, such as
+              ``GeoLite2-ASN-Blocks-IPv4.csv``
+
+    Returns:
+        (ZipInfo, None):
+            * ``None`` when the archive has no such member.
+
+    """
+    for info in zipf.infolist():
+        if not info.is_dir() and os.path.basename(info.filename) == name:
+            return info
+
+
+def extract_members(archive, directory, whitelist):
+    """Extract only the whitelisted members of ``archive`` into ``directory``
+
+    Members are written flat into ``directory`` without the dated parent
+    directory they are stored under in the archive.
+
+    Args:
+        archive (str):
+            * A path to a GeoLite2 zip archive
+        directory (str):
+            * The destination directory, created when it does not exist
+        whitelist (list, tuple):
+            * The basenames of the members to extract
+
+    Returns:
+        (list):
+            * The paths of the extracted files
+
+    """
+    extracted = []
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with zipfile.ZipFile(archive) as zipf:
+        for name in whitelist:
+            info = find_member(zipf, name)
+            if info is None:
+                continue
+
+            dst = os.path.join(directory, name)
+            with zipf.open(info) as src, open(dst, 'wb') as fd:
+                shutil.copyfileobj(src, fd)
+
+            extracted.append(dst)
+
+    return extracted
+
+
+@contextmanager
+def open_csv(edition, name, directory=None, encoding=ENCODING):
+    """Open a GeoLite2 CSV as a text stream
+
+    The CSV is streamed straight out of the downloaded archive through
+    :meth:`zipfile.ZipFile.open`, nothing is written to disk. When the
+    archive does not exist, the CSV is read from a previously extracted
+    ``<directory>/<edition>/<name>`` instead.
+
+    Args:
+        edition (str):
+            * One of the keys of :data:`ARCHIVES`
+        name (str):
+            * The basename of the CSV file
+        directory (str):
+            * Where the archives are stored. Default :data:`DEFAULT_DATA_DIR`
+        encoding (str):
+            * The file encoding. Default :class:`ipcrawl.utils.ENCODING`
+
+    Raises:
+        IOError: When neither the archive member nor the file exist.
+
+    """
+    directory = directory or DEFAULT_DATA_DIR
+    archive = os.path.join(directory, ARCHIVES[edition])
+
+    if os.path.isfile(archive):
+        with zipfile.ZipFile(archive) as zipf:
+            info = find_member(zipf, name)
+            if info is None:
+                err_msg = '{name} is not a member of {archive}'.format(
+                    name=name,
+                    archive=archive,
+                )
+                raise IOError(err_msg)
+
+            with zipf.open(info) as raw:
+                yield io.TextIOWrapper(raw, encoding=encoding, newline='')
+
+    else:
+        filename = os.path.join(directory, edition, name)
+        with open(filename, mode='r', encoding=encoding, newline='') as fd:
+            yield fd
+
+
+def csv_size(edition, name, directory=None):
+    """The uncompressed size of a GeoLite2 CSV in bytes
+
+    See :func:`open_csv` for the arguments.
+
+    Returns:
+        (int, None):
+            * ``None`` when neither the archive member nor the file exist
+
+    """
+    directory = directory or DEFAULT_DATA_DIR
+    archive = os.path.join(directory, ARCHIVES[edition])
+
+    if os.path.isfile(archive):
+        with zipfile.ZipFile(archive) as zipf:
+            info = find_member(zipf, name)
+            return info.file_size if info is not None else None
+
+    filename = os.path.join(directory, edition, name)
+    return os.path.getsize(filename) if os.path.isfile(filename) else None
+
+
+def release(directory=None):
+    """Identify the GeoLite2 data of ``directory``
+
+    Every CSV of :data:`BLOCKS` is identified by the dated directory it is
+    stored under in its archive, such as ``GeoLite2-ASN-CSV_20190618``, and
+    its CRC-32. An extracted CSV is identified by its size and mtime.
+
+    Args:
+        directory (str):
+            * Where the archives are stored. Default :data:`DEFAULT_DATA_DIR`
+
+    Returns:
+        (str):
+            * The same string for the same data
+
+    """
+    directory = directory or DEFAULT_DATA_DIR
+    parts = []
+
+    for edition, name, _ in BLOCKS:
+        archive = os.path.join(directory, ARCHIVES[edition])
+
+        if os.path.isfile(archive):
+            with zipfile.ZipFile(archive) as zipf:
+                info = find_member(zipf, name)
+
+            if info is not None:
+                parts.append('{}:{:08x}'.format(
+                    os.path.dirname(info.filename) or name, info.CRC,
+                ))
+                continue
+
+        filename = os.path.join(directory, edition, name)
+
+        if os.path.isfile(filename):
+            stat = os.stat(filename)
+            parts.append('{}:{}:{}'.format(
+                name, stat.st_size, stat.st_mtime_ns,
+            ))
+
+    return ','.join(parts)
+
+
+def load_csv(
+    fd, ModelClass, commit_every=10000, progress=None, session=None,
+):
+    """Load every row of a GeoLite2 CSV stream into ``ModelClass``
+
+    Args:
+        fd (file):
+            * A text stream, see :func:`open_csv`
+        ModelClass (Base):
+            * One of the models in :mod:`ipcrawl.database.models`
+        commit_every (int):
+            * Commit after this many rows to keep memory bounded
+        progress (Progress):
+            * Reported to every ``progress.every`` rows, see
+              :class:`ipcrawl.progress.Progress`. It must already be started.
+        session (Session):
+            * Load within the transaction of this session, rows are only
+              flushed every ``commit_every`` rows and never committed
+
+    Returns:
+        (int):
+            * The number of rows loaded
+
+    """
+    reader = csv.reader(fd)
+    headers = next(reader)
+    count = 0
+    report_every = progress.every if progress is not None else 0
+    owned = session is None
+    scope = sqlite3.session_scope() if owned else nullcontext(session)
+
+    with scope as session:
+        flush = session.commit if owned else session.flush
+
+        for count, line in enumerate(reader, 1):
+            model = ModelClass()
+
+            for key, value in zip(headers, line):
+                setattr(model, key, value)
+
+            session.add(model)
+
+            if count % commit_every == 0:
+                flush()
+
+            if report_every and count % report_every == 0:
+                progress.report(count)
+
+    return count
+
+
+def populate(
+    directory=None, engine=None, analyze=True, vacuum=False, progress=None,
+):
+    """Populate the db with every CSV in :data:`BLOCKS`
+
+    Indexes are dropped, the rows of every table are replaced by the rows
+    of its CSV and then the db is finalized, see
+    :func:`ipcrawl.database.sqlite3.finalize_db`. Loading a new release
+    deletes every cached lookup, see
+    :func:`ipcrawl.database.sqlite3.set_release`.
+
+    Every table and the release are replaced in one transaction. When a CSV
+    is missing, invalid or the load is interrupted the db keeps the release
+    it held before, indexes included.
+
+    Args:
+        directory (str):
+            * Where the archives are stored. Default :data:`DEFAULT_DATA_DIR`
+        engine (Engine):
+            * When ``None``, the default db is used.
+        analyze (bool):
+            * Passed to :func:`ipcrawl.database.sqlite3.finalize_db`
+        vacuum (bool):
+            * Passed to :func:`ipcrawl.database.sqlite3.finalize_db`
+        progress (Progress):
+            * Reports the load of every table, see
+              :class:`ipcrawl.progress.Progress`
+
+    Returns:
+        (dict):
+            * The number of rows loaded per table
+
+    """
+    engine = sqlite3.init_db(engine=engine, indexes=False)
+    loaded = {}
+
+    try:
+        sqlite3.drop_indexes(engine)
+
+        with sqlite3.session_scope(bind=engine) as session:
+            for edition, name, ModelClass in BLOCKS:
+                table = ModelClass.__tablename__
+
+                # network ids are unique, rows of an earlier load would
+                # collide with the ones read from the CSV
+                session.execute(ModelClass.__table__.delete())
+
+                with metrics.timer('populate.{}'.format(table)), \
+                        open_csv(edition, name, directory=directory) as fd:
+                    if progress is not None:
+                        progress.start(
+                            table,
+                            fd=fd,
+                            total=csv_size(
+                                edition, name, directory=directory,
+                            ),
+                        )
+
+                    loaded[table] = load_csv(
+                        fd, ModelClass, progress=progress, session=session,
+                    )
+
+                    if progress is not None:
+                        progress.finish(loaded[table])
+
+                metrics.incr('populate.rows', loaded[table])
+                log.info('loaded {} rows from {}'.format(loaded[table], name))
+
+            sqlite3.set_release(session.connection(), release(directory))
+
+        with metrics.timer('populate.finalize'):
+            sqlite3.finalize_db(engine, analyze=analyze, vacuum=vacuum)
+    finally:
+        # a failed load rolled back to the earlier rows, which need them
+        sqlite3.create_indexes(engine)
+
+    return loaded
@@ -0,0 +1,521 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from bisect import bisect_left
+
+from ipcrawl.utils import int_to_ip
+from ipcrawl.utils import ip_to_int
+from ipcrawl.utils import ips_to_array
+from ipcrawl.utils import sort_ints
+
+from itertools import islice
+
+import array
+import struct
+import sys
+
+MAGIC = b'IPS4'
+VERSION = 1
+
+# containers with more addresses than this are stored as bitmaps
+ARRAY_MAX = 4096
+
+# a bitmap container has one bit for each of the 65536 addresses of a /16
+BITMAP_SIZE = 65536 // 8
+
+# addresses sorted at a time by IPv4Set.update
+BATCH_SIZE = 65536
+
+# more addresses than this are merged into an array container by rebuilding
+# it, fewer are inserted one at a time
+MERGE_MAX = 512
+
+KIND_ARRAY = 0
+KIND_BITMAP = 1
+
+HEADER = struct.Struct('<BI')
+CONTAINER_HEADER = struct.Struct('<HBI')
+
+# the positions of the set bits of every byte value
+_BITS = [
+    tuple(bit for bit in range(8) if byte & (1 << bit))
+    for byte in range(256)
+]
+
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # python < 3.10
+    def _popcount(value):
+        return bin(value).count('1')
+
+
+def _to_int(ip):
+    try:
+        value = ip_to_int(ip) if isinstance(ip, str) else int(ip)
+    except OSError:
+        value = -1
+
+    if not 0 <= value <= 0xffffffff:
+        err_msg = '{!r} is not an IPv4 address'.format(ip)
+        raise ValueError(err_msg)
+
+    return value
+
+
+def _bitmap(lows):
+    bits = bytearray(BITMAP_SIZE)
+
+    for low in lows:
+        bits[low >> 3] |= 1 << (low & 7)
+
+    return bits
+
+
+def _iter_bitmap(bits):
+    for i, byte in enumerate(bits):
+        if byte:
+            base = i << 3
+            for bit in _BITS[byte]:
+                yield base + bit
+
+
+def _container(lows):
+    """The container of the sorted, unique ``lows`` of one /16
+
+    """
+    if len(lows) > ARRAY_MAX:
+        return _bitmap(lows)
+
+    return array.array('H', lows)
+
+
+def _as_int(container):
+    if isinstance(container, bytearray):
+        return int.from_bytes(container, 'little')
+
+    return int.from_bytes(_bitmap(container), 'little')
+
+
+def _from_int(value):
+    """The container of a bitmap held in an ``int``, ``None`` when empty
+
+    """
+    count = _popcount(value)
+
+    if not count:
+        return None
+
+    bits = bytearray(value.to_bytes(BITMAP_SIZE, 'little'))
+    return bits if count > ARRAY_MAX else array.array('H', _iter_bitmap(bits))
+
+
+def _contains(container, low):
+    if isinstance(container, bytearray):
+        return bool(container[low >> 3] & (1 << (low & 7)))
+
+    i = bisect_left(container, low)
+    return i < len(container) and container[i] == low
+
+
+def _union(a, b):
+    if isinstance(a, array.array) and isinstance(b, array.array):
+        # both are sorted, which sorted() merges in linear time
+        return _container(list(dict.fromkeys(sorted(a + b))))
+
+    return _from_int(_as_int(a) | _as_int(b))
+
+
+def _lows(a, b, keep):
+    """The lows of the array ``a`` that are, or are not, in ``b``
+
+    """
+    if isinstance(b, bytearray):
+        lows = [
+            low for low in a
+            if bool(b[low >> 3] & (1 << (low & 7))) is keep
+        ]
+    elif keep:
+        lows = sorted(set(a).intersection(b))
+    else:
+        lows = sorted(set(a).difference(b))
+
+    return array.array('H', lows) if lows else None
+
+
+def _intersection(a, b):
+    if isinstance(a, array.array):
+        return _lows(a, b, keep=True)
+
+    if isinstance(b, array.array):
+        return _lows(b, a, keep=True)
+
+    return _from_int(_as_int(a) & _as_int(b))
+
+
+def _difference(a, b):
+    if isinstance(a, array.array):
+        return _lows(a, b, keep=False)
+
+    return _from_int(_as_int(a) & ~_as_int(b))
+
+
+def _count(container):
+    if isinstance(container, bytearray):
+        return _popcount(int.from_bytes(container, 'little'))
+
+    return len(container)
+
+
+def _to_bytes(container):
+    if isinstance(container, bytearray):
+        return bytes(container)
+
+    if sys.byteorder == 'big':
+        container = array.array('H', container)
+        container.byteswap()
+
+    return container.tobytes()
+
+
+class IPv4Set(object):
+    """A compressed set of IPv4 addresses
+
+    Addresses are split on their /16. The low 16 bits of the addresses of
+    each /16 are kept in a container, a sorted ``array`` of 2 bytes per
+    address while it holds up to :data:`ARRAY_MAX` of them, a bitmap of
+    8 KiB otherwise. A Python ``set`` of the same addresses takes around
+    70 bytes per entry.
+
+    Example:
+
+        .. code-block::
+
+            seen = IPv4Set(['10.0.0.1', '10.0.0.2'])
+            seen.add('192.168.1.1')
+
+            new = IPv4Set(ips) - seen
+
+            with open('seen.ipset', mode='wb') as fd:
+                (seen | new).dump(fd)
+
+    Args:
+        ips (iterable):
+            * Addresses to add, as dotted quad strings or ints
+
+    """
+
+    def __init__(self, ips=None):
+        self.containers = {}
+
+        if ips is not None:
+            self.update(ips)
+
+    def add(self, ip):
+        """Add a single address
+
+        Raises:
+            ValueError: When ``ip`` is not an IPv4 address
+
+        """
+        value = _to_int(ip)
+        high = value >> 16
+        low = value & 0xffff
+        container = self.containers.get(high)
+
+        if container is None:
+            self.containers[high] = array.array('H', [low])
+        elif isinstance(container, bytearray):
+            container[low >> 3] |= 1 << (low & 7)
+        else:
+            i = bisect_left(container, low)
+
+            if i == len(container) or container[i] != low:
+                container.insert(i, low)
+
+                if len(container) > ARRAY_MAX:
+                    self.containers[high] = _bitmap(container)
+
+    def update(self, ips, batch_size=BATCH_SIZE):
+        """Add many addresses
+
+        ``ips`` is read ``batch_size`` addresses at a time. Each batch is
+        packed into an array and sorted, see :func:`ipcrawl.utils.sort_ints`,
+        then merged into its containers, so at most one batch is held on
+        top of the set itself however long ``ips`` is.
+
+        Raises:
+            ValueError: When one of ``ips`` is not an IPv4 address
+
+        """
+        ips = iter(ips)
+
+        while True:
+            batch = list(islice(ips, batch_size))
+
+            if not batch:
+                return
+
+            try:
+                values = sort_ints(ips_to_array(batch), unique=True)
+            except (OSError, OverflowError, TypeError) as exp:
+                raise ValueError('Not an IPv4 address: {}'.format(exp))
+
+            del batch
+            self._merge(values)
+
+    def _merge(self, values):
+        """Merge sorted, unique ``values`` into the containers
+
+        """
+        high = None
+        lows = []
+
+        for value in values:
+            if value >> 16 != high:
+                if lows:
+                    self._merge_lows(high, lows)
+
+                high = value >> 16
+                lows = []
+
+            lows.append(value & 0xffff)
+
+        if lows:
+            self._merge_lows(high, lows)
+
+    def _merge_lows(self, high, lows):
+        """Merge the sorted, unique ``lows`` of one /16 into its container
+
+        """
+        existing = self.containers.get(high)
+
+        if existing is None:
+            self.containers[high] = _container(lows)
+        elif isinstance(existing, bytearray):
+            for low in lows:
+                existing[low >> 3] |= 1 << (low & 7)
+        elif len(lows) > MERGE_MAX:
+            self.containers[high] = _union(existing, _container(lows))
+        else:
+            # a few addresses per batch, as with spread out addresses, are
+            # cheaper to insert than to rebuild the container for
+            i = 0
+
+            for low in lows:
+                # lows are sorted, none goes before the previous one
+                i = bisect_left(existing, low, i)
+
+                if i == len(existing) or existing[i] != low:
+                    existing.insert(i, low)
+
+            if len(existing) > ARRAY_MAX:
+                self.containers[high] = _bitmap(existing)
+
+    def ints(self):
+        """Every address as an ``int``, in ascending order
+
+        """
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            base = high << 16
+
+            if isinstance(container, bytearray):
+                container = _iter_bitmap(container)
+
+            for low in container:
+                yield base + low
+
+    def __iter__(self):
+        return (int_to_ip(value) for value in self.ints())
+
+    def __contains__(self, ip):
+        try:
+            value = _to_int(ip)
+        except (ValueError, TypeError):
+            return False
+
+        container = self.containers.get(value >> 16)
+        return container is not None and _contains(container, value & 0xffff)
+
+    def __len__(self):
+        return sum(_count(c) for c in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __eq__(self, other):
+        if not isinstance(other, IPv4Set):
+            return NotImplemented
+
+        return self.containers == other.containers
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def _combine(self, other, func, keep_missing):
+        result = IPv4Set()
+
+        for high, container in self.containers.items():
+            theirs = other.containers.get(high)
+
+            if theirs is None:
+                if keep_missing:
+                    result.containers[high] = container[:]
+                continue
+
+            combined = func(container, theirs)
+            if combined is not None:
+                result.containers[high] = combined
+
+        return result
+
+    def union(self, other):
+        """Addresses in either set
+
+        Returns:
+            (IPv4Set):
+
+        """
+        result = self._combine(other, _union, keep_missing=True)
+
+        for high, container in other.containers.items():
+            if high not in self.containers:
+                result.containers[high] = container[:]
+
+        return result
+
+    def intersection(self, other):
+        """Addresses in both sets
+
+        Returns:
+            (IPv4Set):
+
+        """
+        return self._combine(other, _intersection, keep_missing=False)
+
+    def difference(self, other):
+        """Addresses in this set but not in ``other``
+
+        Returns:
+            (IPv4Set):
+
+        """
+        return self._combine(other, _difference, keep_missing=True)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    @property
+    def nbytes(self):
+        """The size of the containers in bytes
+
+        """
+        return sum(
+            len(container) * container.itemsize
+            if isinstance(container, array.array) else len(container)
+            for container in self.containers.values()
+        )
+
+    def to_bytes(self):
+        """Serialize the set, see :meth:`from_bytes`
+
+        Returns:
+            (bytes):
+
+        """
+        parts = [MAGIC, HEADER.pack(VERSION, len(self.containers))]
+
+        for high in sorted(self.containers):
+            container = self.containers[high]
+
+            kind = KIND_BITMAP if isinstance(
+                container, bytearray
+            ) else KIND_ARRAY
+
+            parts.append(
+                CONTAINER_HEADER.pack(high, kind, _count(container))
+            )
+            parts.append(_to_bytes(container))
+
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Load a set serialized by :meth:`to_bytes`
+
+        Raises:
+            ValueError: When ``data`` is not a serialized set
+
+        Returns:
+            (IPv4Set):
+
+        """
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not an ipcrawl IPv4 set, bad magic')
+
+        pos = len(MAGIC)
+
+        try:
+            version, containers = HEADER.unpack_from(data, pos)
+            pos += HEADER.size
+
+            if version != VERSION:
+                err_msg = 'Unsupported IPv4 set version {}'.format(version)
+                raise ValueError(err_msg)
+
+            result = cls()
+
+            for _ in range(containers):
+                high, kind, count = CONTAINER_HEADER.unpack_from(data, pos)
+                pos += CONTAINER_HEADER.size
+
+                size = BITMAP_SIZE if kind == KIND_BITMAP else count * 2
+                payload = data[pos:pos + size]
+                pos += size
+
+                if len(payload) != size:
+                    raise ValueError('Truncated IPv4 set')
+
+                if kind == KIND_BITMAP:
+                    container = bytearray(payload)
+                elif kind == KIND_ARRAY:
+                    container = array.array('H')
+                    container.frombytes(payload)
+
+                    if sys.byteorder == 'big':
+                        container.byteswap()
+                else:
+                    err_msg = 'Unknown IPv4 set container {}'.format(kind)
+                    raise ValueError(err_msg)
+
+                result.containers[high] = container
+        except struct.error:
+            raise ValueError('Truncated IPv4 set')
+
+        return result
+
+    def dump(self, fd):
+        """Write the set to the binary file object ``fd``
+
+        """
+        fd.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, fd):
+        """Read a set written by :meth:`dump` from the binary file ``fd``
+
+        Returns:
+            (IPv4Set):
+
+        """
+        return cls.from_bytes(fd.read())
+
+    def __repr__(self):
+        return 'IPv4Set(len={!r}, containers={!r})'.format(
+            len(self), len(self.containers),
+        )
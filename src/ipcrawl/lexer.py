@@ -4,6 +4,7 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 from ipcrawl.utils import calculate_position
+from ipcrawl.utils import metrics
 
 from ipaddress import ip_address
 from sly import Lexer
@@ -11,9 +12,54 @@ from sly import Lexer
 # from sly import Parser
 
 
-def create_lexer(text):
+# characters of whole lines iter_tokens hands the lexer at once
+CHUNK_SIZE = 1024 * 1024
+
+# bump whenever CrawlLexer finds different tokens in the same text, results
+# cached by ipcrawl.cache are keyed by it
+LEXER_VERSION = 1
+
+
+def create_lexer(text, lineno=1):
     lexer = CrawlLexer()
-    return [token for token in lexer.tokenize(text)]
+
+    with metrics.timer('lexer.tokenize'):
+        tokens = [token for token in lexer.tokenize(text, lineno=lineno)]
+
+    metrics.incr('lexer.chars', len(text))
+    metrics.incr('lexer.tokens', len(tokens))
+    return tokens
+
+
+def iter_tokens(fd, chunk_size=CHUNK_SIZE):
+    """Lex a text file object a chunk of whole lines at a time
+
+    Addresses never span lines, so only about ``chunk_size`` characters of
+    ``fd`` are held at once. Line numbers in errors count from the start of
+    the file.
+
+    Args:
+        fd (file):
+            * A text file object
+        chunk_size (int):
+            * Roughly how many characters to lex at once
+
+    Yields:
+        (Token):
+
+    """
+    lineno = 1
+
+    while True:
+        lines = fd.readlines(chunk_size)
+
+        if not lines:
+            return
+
+        for token in create_lexer(''.join(lines), lineno=lineno):
+            yield token
+
+        lineno += len(lines)
 
 
 class CrawlLexer(Lexer):
@@ -0,0 +1,208 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.utils import peak_rss
+from ipcrawl.utils import to_json_compact
+
+import datetime
+import os
+import sys
+import time
+
+# rows between two reports
+EVERY = 100000
+
+FORMATS = ('text', 'json')
+
+
+def current_rss():
+    """The resident set size of this process in bytes
+
+    Read from ``/proc/self/statm``, see :func:`ipcrawl.utils.peak_rss` for
+    other platforms.
+
+    Returns:
+        (int, None):
+            * ``None`` without ``/proc``
+
+    """
+    try:
+        with open('/proc/self/statm', mode='rb') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _bytes_read(fd):
+    """How far into its underlying binary file ``fd`` has read
+
+    """
+    buffer = getattr(fd, 'buffer', None)
+
+    try:
+        return buffer.tell() if buffer is not None else None
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _megabytes(value):
+    return '{:.1f} MB'.format(value / 1024 / 1024)
+
+
+class Progress(object):
+    """Report the throughput of a long running load every ``every`` rows
+
+    Every report has the rows loaded, rows/s, the bytes read out of the
+    total size of the input, an ETA, the current RSS where ``/proc`` has it
+    and the peak RSS. Callers check ``count % progress.every == 0`` before
+    calling :meth:`report`, so rows in between cost nothing.
+
+    Example:
+
+        .. code-block::
+
+            progress = Progress(every=10000)
+            progress.start('geolite2_asn_blocks_ipv4', fd=fd, total=size)
+
+            for count, row in enumerate(rows, 1):
+                ...
+                if count % progress.every == 0:
+                    progress.report(count)
+
+            progress.finish(count)
+
+    Args:
+        every (int):
+            * Rows between two reports. Default :data:`EVERY`
+        format (str):
+            * ``text`` for one human readable line per report, ``json`` for
+              one JSON document per line. See :data:`FORMATS`
+        stream (file):
+            * Where reports are written. Default :data:`sys.stderr`
+
+    Raises:
+        ValueError: When ``format`` is not one of :data:`FORMATS`
+
+    """
+
+    def __init__(self, every=EVERY, format='text', stream=None):
+        if format not in FORMATS:
+            err_msg = 'Unknown progress format {!r}, expected one of {}'
+            raise ValueError(err_msg.format(format, ', '.join(FORMATS)))
+
+        self.every = every
+        self.format = format
+        self.stream = stream
+        self.label = None
+        self.fd = None
+        self.total = None
+        self.started = None
+
+    def start(self, label, fd=None, total=None):
+        """Start reporting on a new input
+
+        Args:
+            label (str):
+                * Names the input in every report, such as a table name
+            fd (file):
+                * The text stream being read, bytes read are taken from its
+                  underlying binary file
+            total (int):
+                * The size of the input in bytes
+
+        """
+        self.label = label
+        self.fd = fd
+        self.total = total
+        self.started = time.perf_counter()
+
+    def sample(self, rows, done=False):
+        """Measure the progress after ``rows`` rows
+
+        Returns:
+            (dict):
+
+        """
+        elapsed = time.perf_counter() - self.started
+        read = self.total if done else _bytes_read(self.fd)
+        eta = None
+        percent = None
+
+        if read and self.total:
+            percent = min(100.0, 100.0 * read / self.total)
+            eta = max(0.0, elapsed * (self.total - read) / read)
+
+        return {
+            'label': self.label,
+            'rows': rows,
+            'elapsed': elapsed,
+            'rows_per_sec': rows / elapsed if elapsed else None,
+            'bytes': read,
+            'total_bytes': self.total,
+            'percent': percent,
+            'eta': eta,
+            'rss': current_rss(),
+            'peak_rss': peak_rss(),
+            'done': done,
+        }
+
+    def format_text(self, sample):
+        parts = ['{}: {:,} rows'.format(sample['label'], sample['rows'])]
+
+        if sample['rows_per_sec'] is not None:
+            parts.append('{:,.0f} rows/s'.format(sample['rows_per_sec']))
+
+        if sample['bytes'] is not None and sample['total_bytes']:
+            parts.append('{} of {} ({:.1f}%)'.format(
+                _megabytes(sample['bytes']),
+                _megabytes(sample['total_bytes']),
+                sample['percent'],
+            ))
+
+        if sample['done']:
+            parts.append('done in {}'.format(
+                datetime.timedelta(seconds=round(sample['elapsed'])),
+            ))
+        elif sample['eta'] is not None:
+            parts.append('ETA {}'.format(
+                datetime.timedelta(seconds=round(sample['eta'])),
+            ))
+
+        if sample['rss'] is not None:
+            parts.append('RSS {}'.format(_megabytes(sample['rss'])))
+        elif sample['peak_rss'] is not None:
+            parts.append('peak RSS {}'.format(_megabytes(sample['peak_rss'])))
+
+        return ', '.join(parts)
+
+    def report(self, rows, done=False):
+        """Write one report
+
+        Returns:
+            (dict): See :meth:`sample`
+
+        """
+        sample = self.sample(rows, done=done)
+        stream = self.stream or sys.stderr
+
+        if self.format == 'json':
+            stream.write(to_json_compact(sample))
+        else:
+            stream.write(self.format_text(sample))
+
+        stream.write('\n')
+        stream.flush()
+        return sample
+
+    def finish(self, rows):
+        """Write the final report of the current input
+
+        """
+        return self.report(rows, done=True)
+
+    def __repr__(self):
+        return 'Progress(every={!r}, format={!r})'.format(
+            self.every, self.format,
+        )
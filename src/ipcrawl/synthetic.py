@@ -0,0 +1,617 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from contextlib import ExitStack
+from itertools import accumulate
+
+from ipcrawl.geolite2 import ARCHIVES
+from ipcrawl.utils import ENCODING
+from ipcrawl.utils import int_to_ip
+
+import csv
+import io
+import os
+import random
+import zipfile
+
+# networks and addresses are generated in 1.0.0.0 - 223.255.255.255
+FIRST_ADDRESS = 16777216
+LAST_ADDRESS = 3758096383
+
+# (prefix length, weight) roughly following the GeoLite2 City IPv4 blocks,
+# mostly /24 with a long tail of larger and smaller networks. The address
+# space holds about 2.5 million networks of this distribution.
+PREFIX_LENGTHS = (
+    (16, 2), (17, 4), (18, 8), (19, 15), (20, 30), (21, 50), (22, 90),
+    (23, 100), (24, 330), (25, 30), (26, 40), (27, 50), (28, 60),
+    (29, 70), (30, 40), (31, 10), (32, 71),
+)
+
+STYLES = ('log', 'prose')
+
+WORDS = tuple('''
+lorem ipsum dolor sit amet consectetur adipiscing elit pellentesque finibus
+massa vitae augue faucibus quam aenean condimentum risus at justo suscipit
+bibendum curabitur consequat tempus vestibulum sagittis odio in fermentum
+velit auctor eget etiam mollis aliquet semper sed id turpis ac nulla congue
+rhoncus facilisis sem non posuere ligula praesent nec nisl integer efficitur
+nibh malesuada aliquam porta ullamcorper erat scelerisque eu leo fusce arcu
+metus dignissim hendrerit a eros elementum mi interdum dapibus purus ut duis
+lacus vel vivamus laoreet sollicitudin sapien fringilla et tellus
+'''.split())
+
+SYLLABLES = (
+    'ba', 'ken', 'lo', 'mar', 'no', 'ra', 'sa', 'ti', 'vo', 'zu', 'del',
+    'gor', 'hal', 'ix', 'jan', 'qua', 'ste', 'wen', 'yo', 'dor',
+)
+
+PROGRAMS = ('sshd', 'nginx', 'postfix', 'kernel', 'named', 'haproxy')
+
+LEVELS = ('INFO', 'INFO', 'INFO', 'NOTICE', 'WARNING', 'ERROR')
+
+CONTINENTS = (
+    ('AF', 'Africa'),
+    ('AS', 'Asia'),
+    ('EU', 'Europe'),
+    ('NA', 'North America'),
+    ('OC', 'Oceania'),
+    ('SA', 'South America'),
+)
+
+ACCURACY_RADII = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+ASN_BLOCKS_HEADER = (
+    'network',
+    'autonomous_system_number',
+    'autonomous_system_organization',
+)
+
+COUNTRY_BLOCKS_HEADER = (
+    'network',
+    'geoname_id',
+    'registered_country_geoname_id',
+    'represented_country_geoname_id',
+    'is_anonymous_proxy',
+    'is_satellite_provider',
+)
+
+CITY_BLOCKS_HEADER = COUNTRY_BLOCKS_HEADER + (
+    'postal_code',
+    'latitude',
+    'longitude',
+    'accuracy_radius',
+)
+
+COUNTRY_LOCATIONS_HEADER = (
+    'geoname_id',
+    'locale_code',
+    'continent_code',
+    'continent_name',
+    'country_iso_code',
+    'country_name',
+    'is_in_european_union',
+)
+
+CITY_LOCATIONS_HEADER = COUNTRY_LOCATIONS_HEADER[:-1] + (
+    'subdivision_1_iso_code',
+    'subdivision_1_name',
+    'subdivision_2_iso_code',
+    'subdivision_2_name',
+    'city_name',
+    'metro_code',
+    'time_zone',
+    'is_in_european_union',
+)
+
+# (edition, CSV member, header) of every generated file
+LOCATIONS = [
+    (
+        'country',
+        'GeoLite2-Country-Locations-en.csv',
+        COUNTRY_LOCATIONS_HEADER,
+    ),
+    ('city', 'GeoLite2-City-Locations-en.csv', CITY_LOCATIONS_HEADER),
+]
+
+BLOCKS = [
+    ('asn', 'GeoLite2-ASN-Blocks-IPv4.csv', ASN_BLOCKS_HEADER),
+    ('city', 'GeoLite2-City-Blocks-IPv4.csv', CITY_BLOCKS_HEADER),
+    ('country', 'GeoLite2-Country-Blocks-IPv4.csv', COUNTRY_BLOCKS_HEADER),
+]
+
+
+def _random(seed, stream):
+    """A generator for one ``stream`` of ``seed``
+
+    Every kind of data draws from its own stream, so generating more of one
+    never changes another.
+
+    """
+    return random.Random('{}:{}'.format(seed, stream))
+
+
+def _name(rand, syllables):
+    return ''.join(rand.choice(SYLLABLES) for _ in range(syllables)).title()
+
+
+def _zipf_weights(size, skew):
+    """Cumulative weights where rank ``n`` is drawn ``1 / n ** skew`` as often
+
+    """
+    return list(accumulate(1.0 / rank ** skew for rank in range(1, size + 1)))
+
+
+def iter_networks(seed=0, count=None, prefix_lengths=PREFIX_LENGTHS):
+    """Yield sorted, aligned and non overlapping IPv4 networks
+
+    Networks are spread over the whole unicast space with random gaps in
+    between, so any ``count`` covers the space like the real databases do.
+
+    Args:
+        seed (int, str):
+            * The same seed always yields the same networks
+        count (int):
+            * The number of networks. ``None`` yields until the address space
+              is exhausted. Fewer are yielded when ``count`` networks do not
+              fit, see :data:`PREFIX_LENGTHS`.
+        prefix_lengths (list, tuple):
+            * ``(prefix length, weight)`` pairs
+
+    Yields:
+        (tuple):
+            * ``(start, prefix length)``, ``start`` is an unsigned 32-bit
+              ``int``
+
+    """
+    rand = _random(seed, 'networks')
+    prefixes = [prefixlen for prefixlen, _ in prefix_lengths]
+    cum_weights = list(accumulate(weight for _, weight in prefix_lengths))
+    mean_size = sum(
+        weight * (1 << (32 - prefixlen))
+        for prefixlen, weight in prefix_lengths
+    ) / cum_weights[-1]
+
+    address = FIRST_ADDRESS
+    yielded = 0
+    max_gap = int(mean_size)
+
+    while True:
+        batch = rand.choices(prefixes, cum_weights=cum_weights, k=1024)
+
+        for prefixlen in batch:
+            if count is not None:
+                if yielded >= count:
+                    return
+
+                # spread what is left of the space over the networks left,
+                # aligning wastes about half a network on average.
+                stride = (LAST_ADDRESS - address) / (count - yielded)
+                max_gap = int(2 * (stride - 1.5 * mean_size))
+
+            size = 1 << (32 - prefixlen)
+            gap = rand.randrange(max_gap) if max_gap > 0 else 0
+            start = -(-(address + gap) // size) * size
+
+            if start + size - 1 > LAST_ADDRESS:
+                # the gap overshot the end of the space, try without it
+                start = -(-address // size) * size
+                if start + size - 1 > LAST_ADDRESS:
+                    return
+
+            yield start, prefixlen
+            address = start + size
+            yielded += 1
+
+
+def generate_locations(seed=0, countries=200, cities=5000):
+    """Generate GeoLite2 country and city locations
+
+    Args:
+        seed (int, str):
+            * The same seed always generates the same locations
+        countries (int):
+            * The number of countries, at most 676
+        cities (int):
+            * The number of cities
+
+    Returns:
+        (tuple):
+            * ``(countries, cities)`` lists of rows following
+              :data:`COUNTRY_LOCATIONS_HEADER` and
+              :data:`CITY_LOCATIONS_HEADER`
+
+    """
+    rand = _random(seed, 'locations')
+    letters = [chr(i) for i in range(ord('A'), ord('Z') + 1)]
+    codes = rand.sample([a + b for a in letters for b in letters], countries)
+
+    country_rows = []
+    for i, code in enumerate(codes):
+        continent_code, continent_name = rand.choice(CONTINENTS)
+        is_in_eu = int(continent_code == 'EU' and rand.random() < 0.5)
+
+        country_rows.append((
+            6000000 + i,
+            'en',
+            continent_code,
+            continent_name,
+            code,
+            _name(rand, rand.randint(2, 3)),
+            is_in_eu,
+        ))
+
+    city_rows = []
+    for i in range(cities):
+        country = rand.choice(country_rows)
+        subdivision = rand.randrange(1, 20)
+        longitude = rand.uniform(-180, 180)
+
+        city_rows.append((1000000 + i,) + country[1:-1] + (
+            '{}-{:02d}'.format(country[4], subdivision),
+            _name(rand, 3),
+            '',
+            '',
+            _name(rand, rand.randint(2, 4)),
+            '',
+            'Etc/GMT{:+d}'.format(-int(longitude // 15)),
+            country[-1],
+        ))
+
+    return country_rows, city_rows
+
+
+def iter_blocks(seed=0, networks=100000, countries=None, cities=None):
+    """Yield the ASN, city and country blocks of every generated network
+
+    Every network gets a city, drawn with a Zipf distribution so a few
+    cities hold most networks, and the country of that city. Autonomous
+    systems own runs of adjacent networks, as they do in the real data.
+
+    Args:
+        seed (int, str):
+            * The same seed always yields the same blocks
+        networks (int):
+            * The number of networks, see :func:`iter_networks`
+        countries (list):
+            * See :func:`generate_locations`
+        cities (list):
+            * See :func:`generate_locations`
+
+    Yields:
+        (tuple):
+            * ``(asn, city, country)`` rows following
+              :data:`ASN_BLOCKS_HEADER`, :data:`CITY_BLOCKS_HEADER` and
+              :data:`COUNTRY_BLOCKS_HEADER`
+
+    """
+    if countries is None or cities is None:
+        countries, cities = generate_locations(seed)
+
+    rand = _random(seed, 'blocks')
+    country_ids = {row[4]: row[0] for row in countries}
+    city_weights = _zipf_weights(len(cities), 1.0)
+
+    asn_count = max(1, min(networks // 8, 70000))
+    asn_numbers = rand.sample(range(1, 400000), asn_count)
+    asn_organizations = [
+        '{} {}'.format(_name(rand, rand.randint(2, 4)), rand.choice(
+            ('NET', 'TELECOM', 'HOSTING', 'ISP', 'LLC', 'AS'),
+        )).upper()
+        for _ in range(asn_count)
+    ]
+    asn_weights = _zipf_weights(asn_count, 1.0)
+    asn = 0
+
+    for start, prefixlen in iter_networks(seed, count=networks):
+        network = '{}/{}'.format(int_to_ip(start), prefixlen)
+
+        if rand.random() > 0.7:
+            asn = rand.choices(range(asn_count), cum_weights=asn_weights)[0]
+
+        city = rand.choices(cities, cum_weights=city_weights)[0]
+        country_id = country_ids[city[4]]
+        registered_id = country_id
+
+        if rand.random() < 0.05:
+            registered_id = rand.choice(countries)[0]
+
+        flags = (
+            '',
+            int(rand.random() < 0.001),
+            int(rand.random() < 0.001),
+        )
+
+        yield (
+            (network, asn_numbers[asn], asn_organizations[asn]),
+            (network, city[0], registered_id) + flags + (
+                '{}{:03d}'.format(city[4], rand.randrange(1000)),
+                round(rand.uniform(-60, 70), 4),
+                round(rand.uniform(-180, 180), 4),
+                rand.choice(ACCURACY_RADII),
+            ),
+            (network, country_id, registered_id) + flags,
+        )
+
+
+def write_csv(fd, header, rows):
+    """Write ``header`` and ``rows`` as a GeoLite2 style CSV
+
+    Returns:
+        (int):
+            * The number of rows, without the header
+
+    """
+    writer = csv.writer(fd, lineterminator='\n')
+    writer.writerow(header)
+
+    count = 0
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+
+    return count
+
+
+def _member_opener(stack, directory, edition, seed, archive, compression):
+    """Return a function that opens a CSV of ``edition`` for writing
+
+    Archives are laid out like the MaxMind downloads, see
+    :func:`ipcrawl.geolite2.open_csv`.
+
+    """
+    if archive:
+        filename = os.path.join(directory, ARCHIVES[edition])
+        zipf = stack.enter_context(
+            zipfile.ZipFile(filename, mode='w', compression=compression)
+        )
+        prefix = '{}_synthetic-{}/'.format(
+            os.path.splitext(ARCHIVES[edition])[0], seed,
+        )
+
+        def open_member(name):
+            raw = zipf.open(prefix + name, mode='w', force_zip64=True)
+            return io.TextIOWrapper(raw, encoding=ENCODING, newline='')
+
+    else:
+        dirname = os.path.join(directory, edition)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        def open_member(name):
+            return io.open(
+                os.path.join(dirname, name),
+                mode='w',
+                encoding=ENCODING,
+                newline='',
+            )
+
+    return open_member
+
+
+def generate_geolite2(
+    directory, networks=100000, seed=0, countries=200, cities=5000,
+    archive=True, compression=zipfile.ZIP_DEFLATED,
+):
+    """Write synthetic GeoLite2 ASN, City and Country CSVs
+
+    The output can be loaded like the real downloads, see
+    :func:`ipcrawl.geolite2.populate`. Blocks are streamed to disk as they
+    are generated, memory use does not grow with ``networks``.
+
+    Args:
+        directory (str):
+            * The destination directory, created when it does not exist
+        networks (int):
+            * The number of networks in every blocks file
+        seed (int, str):
+            * The same seed always generates the same files
+        countries (int):
+            * See :func:`generate_locations`
+        cities (int):
+            * See :func:`generate_locations`
+        archive (bool):
+            * When ``True``, write zip archives named like
+              :data:`ipcrawl.geolite2.ARCHIVES`. Otherwise write the CSVs
+              into ``<directory>/<edition>/``
+        compression (int):
+            * The :mod:`zipfile` compression of the archives
+
+    Returns:
+        (dict):
+            * The number of rows written per CSV
+
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    written = {}
+    country_rows, city_rows = generate_locations(
+        seed, countries=countries, cities=cities,
+    )
+    locations = {'country': country_rows, 'city': city_rows}
+
+    with ExitStack() as stack:
+        openers = {
+            edition: _member_opener(
+                stack, directory, edition, seed, archive, compression,
+            )
+            for edition in ARCHIVES
+        }
+
+        for edition, name, header in LOCATIONS:
+            with openers[edition](name) as fd:
+                written[name] = write_csv(fd, header, locations[edition])
+
+        writers = []
+        for edition, name, header in BLOCKS:
+            fd = stack.enter_context(openers[edition](name))
+            writer = csv.writer(fd, lineterminator='\n')
+            writer.writerow(header)
+            writers.append(writer.writerow)
+
+        count = 0
+        for count, rows in enumerate(iter_blocks(
+            seed, networks, countries=country_rows, cities=city_rows,
+        ), 1):
+            for writerow, row in zip(writers, rows):
+                writerow(row)
+
+        for _, name, _ in BLOCKS:
+            written[name] = count
+
+    return written
+
+
+def address_pool(seed=0, size=10000, networks=None):
+    """Draw the distinct addresses a text corpus mentions
+
+    Args:
+        seed (int, str):
+            * The same seed always draws the same addresses
+        size (int):
+            * The number of addresses
+        networks (int):
+            * When set, every address falls in one of the networks
+              generated by :func:`iter_networks` for ``seed`` and
+              ``networks``, so looking them up finds a record. Otherwise the
+              addresses are uniform over the unicast space.
+
+    Returns:
+        (list):
+            * Dotted quads
+
+    """
+    rand = _random(seed, 'addresses')
+
+    if networks:
+        sample = []
+        for i, network in enumerate(iter_networks(seed, count=networks)):
+            if i < size:
+                sample.append(network)
+            else:
+                j = rand.randrange(i + 1)
+                if j < size:
+                    sample[j] = network
+
+        addresses = [
+            start + rand.randrange(1 << (32 - prefixlen))
+            for start, prefixlen in sample
+        ]
+        rand.shuffle(addresses)
+
+    else:
+        addresses = [
+            rand.randint(FIRST_ADDRESS, LAST_ADDRESS) for _ in range(size)
+        ]
+
+    return [int_to_ip(address) for address in addresses]
+
+
+def iter_lines(seed=0, density=0.05, skew=1.0, pool=None, style='log'):
+    """Yield an endless log like text corpus with embedded IPv4 addresses
+
+    Args:
+        seed (int, str):
+            * The same seed always yields the same text
+        density (float):
+            * The fraction of words that are addresses
+        skew (float):
+            * The Zipf exponent addresses are drawn from ``pool`` with.
+              ``0`` draws uniformly, higher values concentrate on fewer
+              addresses.
+        pool (list):
+            * The addresses to draw from. Default :func:`address_pool`
+        style (str):
+            * ``log`` for tab separated level, host, program and message
+              lines, ``prose`` for paragraphs like ``data/parse.data``. See
+              :data:`STYLES`. Both only use characters
+              :class:`ipcrawl.lexer.CrawlLexer` accepts.
+
+    Raises:
+        ValueError: When ``style`` is not one of :data:`STYLES`
+
+    Yields:
+        (str):
+            * ASCII lines ending in a newline
+
+    """
+    if style not in STYLES:
+        err_msg = 'Unknown style {!r}, expected one of {}'.format(
+            style, ', '.join(STYLES),
+        )
+        raise ValueError(err_msg)
+
+    rand = _random(seed, 'text')
+    pool = pool or address_pool(seed)
+    cum_weights = _zipf_weights(len(pool), skew)
+    hosts = ['host' + _name(rand, 1).lower() for _ in range(16)]
+    log = style == 'log'
+
+    while True:
+        k = rand.randint(8, 24) if log else rand.randint(40, 120)
+        words = rand.choices(WORDS, k=k)
+
+        # rounding at random keeps the mean density exact
+        hits = min(k, int(k * density + rand.random()))
+        if hits:
+            for position, address in zip(
+                rand.sample(range(k), hits),
+                rand.choices(pool, cum_weights=cum_weights, k=hits),
+            ):
+                words[position] = address
+
+        if log:
+            yield '{}\t{}\t{}\t{}\n'.format(
+                rand.choice(LEVELS),
+                rand.choice(hosts),
+                rand.choice(PROGRAMS),
+                ' '.join(words),
+            )
+
+        else:
+            sentences = []
+            i = 0
+            while i < k:
+                sentence = words[i:i + rand.randint(6, 18)]
+                sentence[0] = sentence[0].capitalize()
+                sentences.append(' '.join(sentence) + '.')
+                i += len(sentence)
+
+            yield ' '.join(sentences) + '\n\n'
+
+
+def write_text(fd, size, batch_size=1024, **kwargs):
+    """Stream at least ``size`` bytes of :func:`iter_lines` to ``fd``
+
+    Args:
+        fd (file):
+            * A text file object
+        size (int):
+            * The minimum number of bytes, the last line is always complete
+        batch_size (int):
+            * Lines joined per write
+        kwargs (dict):
+            * Passed to :func:`iter_lines`
+
+    Returns:
+        (int):
+            * The number of bytes written
+
+    """
+    written = 0
+    batch = []
+
+    for line in iter_lines(**kwargs):
+        batch.append(line)
+        written += len(line)
+
+        if written >= size:
+            break
+
+        if len(batch) == batch_size:
+            fd.write(''.join(batch))
+            batch = []
+
+    fd.write(''.join(batch))
+    return written
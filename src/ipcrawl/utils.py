@@ -3,15 +3,39 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from contextlib import contextmanager
 from socket import inet_aton
+from socket import inet_ntoa
 
 
+import array
+import importlib
 import json
 import logging
+import socket
 import struct
+import sys
+import time
 
 ENCODING = 'utf-8'
 
+# optional JSON encoders in order of preference, see get_json_backend
+JSON_BACKENDS = ('orjson', 'ujson', 'json')
+
+# sort_ips hands inputs this large to numpy when it is installed
+NUMPY_SORT_THRESHOLD = 100000
+
+# the array typecode of an unsigned 32-bit int
+UINT32 = 'I' if array.array('I').itemsize == 4 else 'L'
+
+# leading bytes of compressed files and the module that reads them, see
+# open_text
+COMPRESSIONS = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'lzma'),
+)
+
 logging.basicConfig(
     level=logging.WARNING,
     format=(
@@ -58,9 +82,72 @@ def calculate_position(lexdata, lexpos):
     return(lexpos - last_newline_pos)
 
 
+def detect_compression(fd):
+    """The module that decompresses ``fd``, by its leading bytes
+
+    Nothing is consumed from ``fd``.
+
+    Example:
+
+        .. code-block::
+
+            module = detect_compression(sys.stdin.buffer)
+
+            if module is not None:
+                fd = module.open(sys.stdin.buffer, mode='rt')
+
+    Args:
+        fd (file):
+            * A buffered binary file object
+
+    Returns:
+        (module, None):
+            * :mod:`gzip`, :mod:`bz2`, :mod:`lzma` or ``None`` for plain
+              data
+
+    """
+    head = fd.peek(max(len(magic) for magic, _ in COMPRESSIONS))
+
+    for magic, name in COMPRESSIONS:
+        if head.startswith(magic):
+            return importlib.import_module(name)
+
+    return None
+
+
+def open_text(filename, encoding=ENCODING):
+    """Open a file for reading text, decompressing it on the fly
+
+    gzip, bz2 and xz files are detected by their leading bytes, whatever
+    their extension. They are decompressed a buffer at a time as the text
+    is read, so reading one with ``readlines(hint)`` holds about ``hint``
+    characters in memory, see :func:`ipcrawl.lexer.iter_tokens`.
+
+    Args:
+        filename (str):
+            * A path to a filename.
+        encoding (str):
+            * The text encoding. Default :class:`ENCODING`
+
+    Returns:
+        (file):
+            * A text file object
+
+    """
+    with open(filename, mode='rb') as fd:
+        module = detect_compression(fd)
+
+    if module is None:
+        return open(filename, mode='r', encoding=encoding)
+
+    return module.open(filename, mode='rt', encoding=encoding)
+
+
 def read_file(filename, mode='r', encoding=ENCODING):
     """Reads a file
 
+    Compressed text files are decompressed, see :func:`open_text`.
+
     Args:
         filename (str):
             * A path to a filename.
@@ -70,7 +157,12 @@ def read_file(filename, mode='r', encoding=ENCODING):
             * The file encoding. Default :class:`ENCODING`
 
     """
-    with open(filename, mode=mode, encoding=encoding) as fd:
+    if 'b' in mode:
+        fd = open(filename, mode=mode)
+    else:
+        fd = open_text(filename, encoding=encoding)
+
+    with fd:
         content = fd.read()
 
     return content
@@ -116,6 +208,8 @@ def to_json(
     Returns:
         (str): By default a `utf-8` encoded BLOB of JSON text.
 
+    See :func:`to_json_compact` for bulk output.
+
     """
     separators = separators or (',', ': ')
     json_str = json.dumps(
@@ -128,14 +222,572 @@ def to_json(
     return json_str
 
 
-def sort_ips(ips):
+def _stdlib_json_dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _load_json_backend(name):
+    if name == 'json':
+        return _stdlib_json_dumps
+
+    module = importlib.import_module(name)
+
+    if name == 'orjson':
+        def dumps(data):
+            return module.dumps(data).decode(ENCODING)
+
+    elif name == 'ujson':
+        def dumps(data):
+            return module.dumps(
+                data, ensure_ascii=False, escape_forward_slashes=False,
+            )
+
+    else:
+        raise ValueError('Unknown JSON backend {!r}'.format(name))
+
+    return dumps
+
+
+_json_backends = {}
+
+
+def get_json_backend(name=None):
+    """Return the compact JSON encoding function of a backend
+
+    Backends are imported the first time they are requested.
+
+    Args:
+        name (str):
+            * One of :data:`JSON_BACKENDS`. When ``None``, the first one
+              that is installed.
+
+    Raises:
+        ImportError: When ``name`` is given but not installed.
+
+    Returns:
+        (tuple):
+            * ``(name, dumps)`` where ``dumps(data)`` returns a ``str``
+
+    """
+    names = [name] if name else JSON_BACKENDS
+
+    for backend in names:
+        if backend not in _json_backends:
+            try:
+                _json_backends[backend] = _load_json_backend(backend)
+            except ImportError:
+                if name:
+                    raise
+                _json_backends[backend] = None
+
+        if _json_backends[backend] is not None:
+            return backend, _json_backends[backend]
+
+
+def to_json_compact(data, backend=None):
+    """Converts to compact, unsorted JSON for machines and bulk output
+
+    Uses the fastest installed backend, see :func:`get_json_backend`. Data
+    the backend can not encode, such as non ``str`` keys with ``orjson``,
+    falls back to :mod:`json`. Use :func:`to_json` for output meant to be
+    read by humans.
+
+    Args:
+        data (dict, list):
+            * The data to convert to a string.
+        backend (str):
+            * Force one of :data:`JSON_BACKENDS`
+
+    Returns:
+        (str): JSON text without whitespace and with non ASCII characters
+        left as is.
+
+    """
+    _, dumps = get_json_backend(backend)
+
+    try:
+        return dumps(data)
+    except TypeError:
+        return _stdlib_json_dumps(data)
+
+
+def ip_to_int(ip):
+    """Convert a dotted quad IPv4 address into an unsigned 32-bit ``int``
+
+    Args:
+        ip (str):
+            * An IPv4 address such as ``1.2.3.4``
+
+    Returns:
+        (int):
+
+    """
+    return struct.unpack('!L', inet_aton(ip))[0]
+
+
+def int_to_ip(value):
+    """Convert an unsigned 32-bit ``int`` into a dotted quad IPv4 address
+
+    Args:
+        value (int):
+            * See :func:`ip_to_int`
+
+    Returns:
+        (str):
+
+    """
+    return inet_ntoa(struct.pack('!L', value))
+
+
+def network_range(network):
+    """Given an IPv4 network in CIDR format return the first and last address
+
+    Example:
+
+        .. code-block::
+
+            network_range('1.0.0.0/24')  # >>> (16777216, 16777471)
+
+    Args:
+        network (str):
+            * An IPv4 network in CIDR format such as ``2.21.92.0/29``. When
+              the prefix length is omitted a ``/32`` is assumed.
+
+    Returns:
+        (tuple):
+            * ``(start, end)`` as unsigned 32-bit ``int``
+
+    """
+    address, _, prefixlen = network.partition('/')
+    hostbits = 32 - int(prefixlen or 32)
+    start = (ip_to_int(address) >> hostbits) << hostbits
+    return start, start + (1 << hostbits) - 1
+
+
+def ips_to_array(ips):
+    """Convert IPv4 addresses into an array of unsigned 32-bit ints
+
+    Strings are packed with one :func:`socket.inet_aton` call each and
+    converted in bulk, the array takes 4 bytes per address.
+
+    Args:
+        ips (list, tuple, iterable):
+            * Dotted quad strings, or ints as returned by :func:`ip_to_int`
+
+    Returns:
+        (array.array):
+
+    """
+    if not isinstance(ips, (list, tuple, array.array)):
+        ips = list(ips)
+
+    if not ips or not isinstance(ips[0], str):
+        return array.array(UINT32, ips)
+
+    values = array.array(UINT32)
+    values.frombytes(b''.join(map(inet_aton, ips)))
+
+    if sys.byteorder == 'little':
+        values.byteswap()
+
+    return values
+
+
+def array_to_ips(values):
+    """Convert unsigned 32-bit ints back into dotted quad strings
+
+    Args:
+        values (array.array, list):
+            * See :func:`ips_to_array`
+
+    Returns:
+        (list):
+
+    """
+    # a copy, the caller's array is not byteswapped
+    values = array.array(UINT32, values)
+
+    if sys.byteorder == 'little':
+        values.byteswap()
+
+    data = values.tobytes()
+    return [inet_ntoa(data[i:i + 4]) for i in range(0, len(data), 4)]
+
+
+_optional_modules = {}
+
+
+def _load_numpy():
+    if 'numpy' not in _optional_modules:
+        try:
+            _optional_modules['numpy'] = importlib.import_module('numpy')
+        except ImportError:
+            _optional_modules['numpy'] = None
+
+    return _optional_modules['numpy']
+
+
+def _sort_numpy(size, numpy=None):
+    if numpy is None:
+        numpy = size >= NUMPY_SORT_THRESHOLD
+
+    return _load_numpy() if numpy else None
+
+
+def sort_ints(values, unique=False, numpy=None):
+    """Sort unsigned 32-bit ints
+
+    Inputs of at least :data:`NUMPY_SORT_THRESHOLD` values are sorted by
+    numpy on a ``uint32`` view of the array when it is installed. Smaller
+    ones, or all of them without numpy, are sorted by :func:`sorted` on
+    plain ints, which compares them without calling back into Python, see
+    :func:`sort_ips` for what that costs.
+
+    Args:
+        values (array.array):
+            * See :func:`ips_to_array`
+        unique (bool):
+            * Drop duplicates
+        numpy (bool):
+            * Force the numpy path on or off. When ``None``, numpy is used
+              for large inputs if it is installed.
+
+    Returns:
+        (array.array):
+
+    """
+    np = _sort_numpy(len(values), numpy=numpy)
+
+    if np is None:
+        return array.array(
+            UINT32, sorted(set(values) if unique else values),
+        )
+
+    view = np.frombuffer(values, dtype=np.uint32)
+    view = np.unique(view) if unique else np.sort(view)
+    return array.array(UINT32, view.tobytes())
+
+
+def _check_types(ips):
+    kind = str if isinstance(ips[0], str) else int
+
+    for index, ip in enumerate(ips):
+        if not isinstance(ip, kind):
+            err_msg = (
+                'Expected only {} addresses, got {!r} at index {}'.format(
+                    kind.__name__, ip, index,
+                )
+            )
+            raise ValueError(err_msg)
+
+
+def _sort_ips(ips, as_int, unique, numpy):
+    if as_int or not ips or not isinstance(ips[0], str):
+        values = sort_ints(ips_to_array(ips), unique=unique, numpy=numpy)
+        return values.tolist() if as_int else array_to_ips(values)
+
+    np = _sort_numpy(len(ips), numpy=numpy)
+
+    if np is None:
+        return sorted(set(ips) if unique else ips, key=inet_aton)
+
+    view = np.frombuffer(ips_to_array(ips), dtype=np.uint32)
+
+    if unique:
+        order = np.unique(view, return_index=True)[1]
+    else:
+        order = np.argsort(view, kind='stable')
+
+    return list(map(ips.__getitem__, order.tolist()))
+
+
+def sort_ips(ips, as_int=False, unique=False, numpy=None):
     """Given a list of ips, sort them
 
-    Credit: https://stackoverflow.com/questions/6545023/how-to-sort-ip-addresses-stored-in-dictionary-in-python/6545090#6545090
+    Every address is converted once, never per comparison. Strings are
+    sorted on their packed big endian form, which compares like the ints
+    it encodes, or through a numpy ``argsort`` of their ints for large
+    inputs, so the original strings are returned as is. Ints are sorted by
+    :func:`sort_ints`.
+
+    Large inputs need numpy, the ``numpy`` extra, to be sorted in compiled
+    code over a packed array. Without it every input is sorted by
+    :func:`sorted`, ``O(n log n)`` comparisons of Python objects, about a
+    second per million addresses. A pure Python bucket sort by /16 is
+    slower still, the loop over the addresses costs more than it saves.
 
     Args:
         ips (list, tuple):
-            * A ``list`` or ``tuple`` of ips
+            * A ``list`` or ``tuple`` of ips, either all strings or all ints
+        as_int (bool):
+            * Return unsigned 32-bit ints instead of dotted quad strings
+        unique (bool):
+            * Drop duplicates
+        numpy (bool):
+            * See :func:`sort_ints`
+
+    Raises:
+        ValueError: When strings and ints are mixed, naming the first
+            address whose type differs from the first one
+
+    Returns:
+        (list):
+
+    """
+    with metrics.timer('sort_ips'):
+        if not isinstance(ips, (list, tuple)):
+            ips = list(ips)
+
+        try:
+            return _sort_ips(ips, as_int, unique, numpy)
+        except TypeError:
+            # only mixed types fail this way, find the culprit
+            _check_types(ips)
+            raise
+
+
+def peak_rss():
+    """The peak resident set size of this process in bytes
+
+    Returns:
+        (int, None):
+            * ``None`` on platforms without :mod:`resource`
+
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes, macOS bytes
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class _NullTimer(object):
+    """The timer handed out while :data:`metrics` is disabled
+
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Timer(object):
+    """Times a block with :func:`time.perf_counter`, see :meth:`Metrics.timer`
+
+    """
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.timing(self.name, time.perf_counter() - self.started)
+
+
+class Metrics(object):
+    """Timers, counters and gauges of the crawl pipeline
+
+    Disabled by default, every method then returns right away and
+    :meth:`timer` returns a shared no-op context manager, so instrumented
+    code costs a method call. Use the module level :data:`metrics`.
+
+    Example:
+
+        .. code-block::
+
+            metrics.enable(StatsdSink())
+
+            with metrics.timer('lexer.tokenize'):
+                ...
+
+            metrics.incr('lexer.tokens', len(tokens))
+            print(to_json(metrics.summary()))
+
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sinks = []
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def enable(self, *sinks):
+        """Start recording
+
+        Args:
+            sinks (list):
+                * Objects with a ``send(name, value, kind)`` method that
+                  receive every event as it is recorded, such as
+                  :class:`StatsdSink`
+
+        """
+        self.enabled = True
+        self.sinks.extend(sinks)
+
+    def disable(self):
+        """Stop recording and close every sink, recorded values are kept
+
+        """
+        self.enabled = False
+
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = []
+
+    def incr(self, name, value=1):
+        if not self.enabled:
+            return
+
+        self.counters[name] = self.counters.get(name, 0) + value
+
+        for sink in self.sinks:
+            sink.send(name, value, 'c')
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+
+        self.gauges[name] = value
+
+        for sink in self.sinks:
+            sink.send(name, value, 'g')
+
+    def timing(self, name, seconds):
+        if not self.enabled:
+            return
+
+        stats = self.timers.get(name)
+
+        if stats is None:
+            self.timers[name] = [1, seconds, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = min(stats[2], seconds)
+            stats[3] = max(stats[3], seconds)
+
+        for sink in self.sinks:
+            sink.send(name, seconds * 1000, 'ms')
+
+    def timer(self, name):
+        """Time a ``with`` block as ``name``
+
+        Returns:
+            (Timer, _NullTimer):
+
+        """
+        if not self.enabled:
+            return NULL_TIMER
+
+        return Timer(self, name)
+
+    def summary(self):
+        """Everything recorded so far, ready for :func:`to_json`
+
+        Returns:
+            (dict):
+                * ``counters`` and ``gauges`` by name. ``timers`` by name as
+                  ``count``, ``total``, ``mean``, ``min`` and ``max``
+                  seconds.
+
+        """
+        return {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'timers': {
+                name: {
+                    'count': count,
+                    'total': total,
+                    'mean': total / count,
+                    'min': low,
+                    'max': high,
+                }
+                for name, (count, total, low, high) in self.timers.items()
+            },
+        }
+
+    def __repr__(self):
+        return 'Metrics(enabled={!r})'.format(self.enabled)
+
+
+class StatsdSink(object):
+    """Send every :class:`Metrics` event to a StatsD compatible UDP server
+
+    Args:
+        address (str):
+            * ``host:port``. Default ``127.0.0.1:8125``
+        prefix (str):
+            * Prepended to every metric name
+
+    """
+
+    def __init__(self, address='127.0.0.1:8125', prefix='ipcrawl'):
+        host, _, port = address.rpartition(':')
+        self.address = (host or '127.0.0.1', int(port))
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, name, value, kind):
+        packet = '{}.{}:{}|{}'.format(self.prefix, name, value, kind)
+
+        try:
+            self.socket.sendto(packet.encode(ENCODING), self.address)
+        except OSError as exp:
+            # metrics must never break a crawl
+            log.debug('unable to send {!r}: {}'.format(packet, exp))
+
+    def close(self):
+        self.socket.close()
+
+    def __repr__(self):
+        return 'StatsdSink(address={!r})'.format(self.address)
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def profile(filename=None):
+    """Profile a ``with`` block with :mod:`cProfile`
+
+    Args:
+        filename (str):
+            * Where the stats are dumped, read them with :mod:`pstats`.
+              When ``None``, nothing is profiled.
+
+    """
+    if not filename:
+        yield None
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
 
-    """  # noqa
-    return sorted(ips, key=lambda ip: struct.unpack('!L', inet_aton(ip))[0])
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
+        log.warning('profile written to {}'.format(filename))
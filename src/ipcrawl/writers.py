@@ -0,0 +1,441 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.utils import ENCODING
+from ipcrawl.utils import to_json_compact
+
+import csv
+import io
+import struct
+
+# bytes buffered by the sink before they reach the file
+BUFFER_SIZE = 1024 * 1024
+
+# records written between flushes, so the output can be read while a crawl
+# is still running.
+FLUSH_EVERY = 1000
+
+BINARY_MAGIC = b'IPCR'
+BINARY_VERSION = 1
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_LIST = 6
+TAG_DICT = 7
+
+DOUBLE = struct.Struct('<d')
+
+
+def flatten(record, prefix=''):
+    """Flatten nested ``dict`` into a single level with dotted keys
+
+    Example:
+
+        .. code-block::
+
+            flatten({'ip': '1.0.0.1', 'asn': {'network': '1.0.0.0/24'}})
+            # >>> {'ip': '1.0.0.1', 'asn.network': '1.0.0.0/24'}
+
+    Args:
+        record (dict):
+            * The record to flatten
+        prefix (str):
+            * Prepended to every key
+
+    Returns:
+        (dict):
+
+    """
+    flat = {}
+
+    for key, value in record.items():
+        key = prefix + key
+
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix=key + '.'))
+        else:
+            flat[key] = value
+
+    return flat
+
+
+class ResultWriter(object):
+    """Base class for streaming one record per address to a file object
+
+    Subclasses implement :meth:`write_record` and set :attr:`binary` and
+    :attr:`extension`.
+
+    Args:
+        fd (file):
+            * A text file object, or a binary one when :attr:`binary`
+        flush_every (int):
+            * Flush ``fd`` after this many records. ``0`` disables periodic
+              flushing.
+        close_fd (bool):
+            * When ``True``, :meth:`close` also closes ``fd``
+
+    """
+    binary = False
+    extension = None
+
+    def __init__(self, fd, flush_every=FLUSH_EVERY, close_fd=False):
+        self.fd = fd
+        self.flush_every = flush_every
+        self.close_fd = close_fd
+        self.count = 0
+
+    def write_record(self, record):
+        raise NotImplementedError()
+
+    def write(self, record):
+        """Write a single ``dict`` record
+
+        """
+        self.write_record(record)
+        self.count += 1
+
+        if self.flush_every and self.count % self.flush_every == 0:
+            self.fd.flush()
+
+    def close(self):
+        self.fd.flush()
+
+        if self.close_fd:
+            self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '{}(count={!r})'.format(type(self).__name__, self.count)
+
+
+class NDJSONWriter(ResultWriter):
+    """Newline delimited JSON, one compact JSON document per line
+
+    """
+    extension = 'ndjson'
+
+    def write_record(self, record):
+        self.fd.write(to_json_compact(record))
+        self.fd.write('\n')
+
+
+class CSVWriter(ResultWriter):
+    """CSV with a header row, nested records are flattened with dotted keys
+
+    Lists can not be represented by a single cell, they are written as JSON.
+
+    Args:
+        fieldnames (list, tuple):
+            * The columns to write. When ``None``, the keys of the first
+              flattened record are used. Keys not in ``fieldnames`` are
+              ignored.
+
+    """
+    extension = 'csv'
+
+    def __init__(self, fd, fieldnames=None, **kwargs):
+        super(CSVWriter, self).__init__(fd, **kwargs)
+        self.fieldnames = fieldnames
+        self.writer = None
+
+    def write_record(self, record):
+        record = flatten(record)
+
+        if self.writer is None:
+            self.fieldnames = self.fieldnames or list(record)
+            self.writer = csv.DictWriter(
+                self.fd,
+                fieldnames=self.fieldnames,
+                extrasaction='ignore',
+            )
+            self.writer.writeheader()
+
+        for key, value in record.items():
+            if isinstance(value, (list, tuple)):
+                record[key] = to_json_compact(value)
+
+        self.writer.writerow(record)
+
+
+def _write_varint(buf, value):
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(data, pos):
+    shift = value = 0
+
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class BinaryWriter(ResultWriter):
+    """A compact, self describing binary encoding of JSON like records
+
+    The stream starts with :data:`BINARY_MAGIC` and a version byte. Every
+    record follows as a varint byte length and a tagged value, see
+    ``TAG_*``. Integers are zigzag varints, floats are little endian
+    doubles and dict keys are interned: the first occurrence of a key is
+    written as ``0`` followed by the string, later occurrences as
+    ``index + 1``. Read it back with :func:`read_binary`.
+
+    The keys first seen in a record are only interned once the record is
+    written, a record that fails to encode leaves the key table as it was.
+
+    """
+    binary = True
+    extension = 'ipcr'
+
+    def __init__(self, fd, **kwargs):
+        super(BinaryWriter, self).__init__(fd, **kwargs)
+        self.keys = {}
+        self.fd.write(BINARY_MAGIC + bytes([BINARY_VERSION]))
+
+    def encode(self, buf, value, new_keys):
+        """Append ``value`` to ``buf``
+
+        Args:
+            buf (bytearray):
+                * The payload of the record
+            value:
+                * What is encoded
+            new_keys (dict):
+                * The keys first seen in this record, by index
+
+        Raises:
+            ValueError: When ``value`` holds a type that is not encodable
+
+        """
+        if value is None:
+            buf.append(TAG_NONE)
+
+        elif value is True:
+            buf.append(TAG_TRUE)
+
+        elif value is False:
+            buf.append(TAG_FALSE)
+
+        elif isinstance(value, int):
+            buf.append(TAG_INT)
+            _write_varint(buf, value << 1 if value >= 0 else (~value << 1) | 1)
+
+        elif isinstance(value, float):
+            buf.append(TAG_FLOAT)
+            buf += DOUBLE.pack(value)
+
+        elif isinstance(value, str):
+            data = value.encode(ENCODING)
+            buf.append(TAG_STR)
+            _write_varint(buf, len(data))
+            buf += data
+
+        elif isinstance(value, (list, tuple)):
+            buf.append(TAG_LIST)
+            _write_varint(buf, len(value))
+            for item in value:
+                self.encode(buf, item, new_keys)
+
+        elif isinstance(value, dict):
+            buf.append(TAG_DICT)
+            _write_varint(buf, len(value))
+            for key, item in value.items():
+                index = self.keys.get(key, new_keys.get(key))
+
+                if index is None:
+                    data = key.encode(ENCODING)
+                    new_keys[key] = len(self.keys) + len(new_keys)
+                    buf.append(0)
+                    _write_varint(buf, len(data))
+                    buf += data
+                else:
+                    _write_varint(buf, index + 1)
+
+                self.encode(buf, item, new_keys)
+
+        else:
+            err_msg = 'Unable to encode type {!r}'.format(type(value))
+            raise ValueError(err_msg)
+
+    def write_record(self, record):
+        payload = bytearray()
+        new_keys = {}
+        self.encode(payload, record, new_keys)
+
+        header = bytearray()
+        _write_varint(header, len(payload))
+        self.fd.write(bytes(header))
+        self.fd.write(bytes(payload))
+        self.keys.update(new_keys)
+
+
+def read_binary(fd):
+    """Read back every record written by :class:`BinaryWriter`
+
+    Args:
+        fd (file):
+            * A binary file object
+
+    Raises:
+        ValueError: When the stream does not start with :data:`BINARY_MAGIC`,
+            is truncated or a record does not decode to its length
+
+    Yields:
+        (dict):
+
+    """
+    header = fd.read(len(BINARY_MAGIC) + 1)
+
+    if header[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError('Not an ipcrawl binary result stream')
+
+    keys = []
+
+    def decode(data, pos):
+        tag = data[pos]
+        pos += 1
+
+        if tag == TAG_NONE:
+            return None, pos
+        if tag == TAG_FALSE:
+            return False, pos
+        if tag == TAG_TRUE:
+            return True, pos
+        if tag == TAG_INT:
+            value, pos = _read_varint(data, pos)
+            return (value >> 1) ^ -(value & 1), pos
+        if tag == TAG_FLOAT:
+            return DOUBLE.unpack_from(data, pos)[0], pos + DOUBLE.size
+        if tag == TAG_STR:
+            size, pos = _read_varint(data, pos)
+            return data[pos:pos + size].decode(ENCODING), pos + size
+        if tag == TAG_LIST:
+            size, pos = _read_varint(data, pos)
+            items = []
+            for _ in range(size):
+                item, pos = decode(data, pos)
+                items.append(item)
+            return items, pos
+        if tag == TAG_DICT:
+            size, pos = _read_varint(data, pos)
+            items = {}
+            for _ in range(size):
+                index, pos = _read_varint(data, pos)
+                if index == 0:
+                    length, pos = _read_varint(data, pos)
+                    keys.append(data[pos:pos + length].decode(ENCODING))
+                    pos += length
+                    index = len(keys)
+                items[keys[index - 1]], pos = decode(data, pos)
+            return items, pos
+
+        raise ValueError('Unknown tag {!r}'.format(tag))
+
+    while True:
+        prefix = bytearray()
+        while True:
+            byte = fd.read(1)
+            if not byte:
+                if prefix:
+                    raise ValueError('Truncated ipcrawl binary result stream')
+                return
+            prefix += byte
+            if byte[0] < 0x80:
+                break
+
+        size, _ = _read_varint(prefix, 0)
+        payload = fd.read(size)
+
+        if len(payload) != size:
+            raise ValueError('Truncated ipcrawl binary result stream')
+
+        try:
+            record, end = decode(payload, 0)
+        except (IndexError, struct.error):
+            end = None
+
+        if end != size:
+            raise ValueError('Corrupt ipcrawl binary result record')
+
+        yield record
+
+
+WRITERS = {
+    'ndjson': NDJSONWriter,
+    'csv': CSVWriter,
+    'binary': BinaryWriter,
+}
+
+
+def register_writer(name, writer_class):
+    """Make ``writer_class`` available to :func:`open_writer` as ``name``
+
+    Args:
+        name (str):
+            * The format name
+        writer_class (ResultWriter):
+            * A subclass of :class:`ResultWriter`
+
+    """
+    WRITERS[name] = writer_class
+
+
+def get_writer_class(format):
+    try:
+        return WRITERS[format]
+    except KeyError:
+        err_msg = 'Unknown output format {!r}, expected one of {}'.format(
+            format,
+            ', '.join(sorted(WRITERS)),
+        )
+        raise ValueError(err_msg)
+
+
+def open_writer(filename, format='ndjson', buffering=BUFFER_SIZE, **kwargs):
+    """Open ``filename`` through a buffered sink and return a writer for it
+
+    Args:
+        filename (str):
+            * The output filename
+        format (str):
+            * One of the keys of :data:`WRITERS`
+        buffering (int):
+            * The size of the write buffer in bytes
+        kwargs (dict):
+            * Extra key value pairs to pass the writer class
+
+    Returns:
+        (ResultWriter):
+
+    """
+    writer_class = get_writer_class(format)
+
+    if writer_class.binary:
+        fd = io.open(filename, mode='wb', buffering=buffering)
+    else:
+        fd = io.open(
+            filename,
+            mode='w',
+            buffering=buffering,
+            encoding=ENCODING,
+            newline='',
+        )
+
+    return writer_class(fd, close_fd=True, **kwargs)
@@ -4,30 +4,45 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from contextlib import contextmanager
+from contextlib import ExitStack
 from glob import glob
 from invoke import task
 
-import json
-
+from ipcrawl.extsort import ExternalSorter
 from ipcrawl.lexer import create_lexer
+from ipcrawl.lexer import iter_tokens
+from ipcrawl.utils import ips_to_array
+from ipcrawl.utils import metrics
+from ipcrawl.utils import open_text
+from ipcrawl.utils import profile as profiled
 from ipcrawl.utils import read_json
+from ipcrawl.utils import sort_ints
 from ipcrawl.utils import sort_ips
+from ipcrawl.utils import StatsdSink
 from ipcrawl.utils import to_json
 
-from ipcrawl.database import models
+from ipcrawl import download
+from ipcrawl import geolite2
+from ipcrawl import progress as ipcrawl_progress
+from ipcrawl import synthetic
+from ipcrawl import writers
+from ipcrawl.database import aggregate
+from ipcrawl.database import lookup
 from ipcrawl.database import sqlite3
+from ipcrawl.database.executor import LookupExecutor
+from ipcrawl.database.stats import QueryStats
+from ipcrawl.database.stats import SLOW_QUERY_THRESHOLD
+
+from itertools import tee
 
 from shutil import rmtree
 
 from urllib import parse as urlparse
 
-import csv
-import hashlib
 import logging
 import os
-import requests
-import shutil
-import zipfile
+import time
 
 PROJECT_ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -39,8 +54,15 @@ BANDIT_TARGET_DIRS = [
 
 PROJECT_NAME = os.path.basename(PROJECT_ROOT_DIR)
 
-GEOLITE_BASE_URI = 'http://localhost:8080/'
-GEOLITE_BASE_URI = 'https://geolite.maxmind.com/download/geoip/database/'
+GEOLITE_DATA_DIR = os.path.join(PROJECT_ROOT_DIR, geolite2.DEFAULT_DATA_DIR)
+
+SYNTHETIC_DATA_DIR = os.path.join(PROJECT_ROOT_DIR, 'data', 'synthetic')
+
+# export GEOLITE_BASE_URI=http://localhost:8080/ to use a local mirror
+GEOLITE_BASE_URI = os.environ.get(
+    'GEOLITE_BASE_URI',
+    'https://geolite.maxmind.com/download/geoip/database/',
+)
 
 
 logging.basicConfig(
@@ -54,36 +76,6 @@ log = logging.getLogger('ipcrawl')
 log.setLevel(logging.WARNING)
 
 
-def md5_checksum(filename, blocksize=65536):
-    md5 = hashlib.md5()
-    try:
-        with open(os.path.realpath(filename), 'rb') as infile:
-            block = infile.read(blocksize)
-            while block:
-                md5.update(block)
-                block = infile.read(blocksize)
-        return md5.hexdigest()
-    except IOError:
-        pass
-
-
-def unzip_file(filename, directory):
-    zipf = zipfile.ZipFile(filename)
-    zipf.extractall(directory)
-
-
-def rename_directory(src, dst, **kwargs):
-    unpack_directory = glob(src, **kwargs)
-
-    if unpack_directory:
-        src = unpack_directory[0]
-
-        if os.path.isdir(dst):
-            shutil.rmtree(dst)
-
-        shutil.move(src, dst)
-
-
 def remove_file(filename, whitelist=None, **kwargs):
     filenames = glob(filename, **kwargs)
     whitelist = whitelist or []
@@ -96,45 +88,46 @@ def remove_file(filename, whitelist=None, **kwargs):
             os.unlink(filename)
 
 
-def validate_md5_checksum(filename, expected):
-    actual_md5 = md5_checksum(filename)
-    expected_md5 = expected
-
-    if os.path.isfile(expected):
-        with open(expected, 'r') as fd:
-            expected_md5 = fd.read().strip()
-
-    if actual_md5 != expected_md5:
-        err_msg = (
-            'MD5 checksum mismatch for {filename},'
-            ' expected {expected} to equal {actual}'
-        ).format(
-            filename=filename,
-            expected=expected_md5,
-            actual=actual_md5,
-        )
-        raise ValueError(err_msg)
-
+@contextmanager
+def instrumented(
+    stats=False, statsd=None, profile=None, query_stats=False,
+    slow_query=SLOW_QUERY_THRESHOLD,
+):
+    """Record :data:`ipcrawl.utils.metrics` and profile the ``with`` block
+
+    Args:
+        stats (bool):
+            * Print the metrics summary as JSON when the block exits
+        statsd (str):
+            * ``host:port`` of a StatsD server to send every metric to
+        profile (str):
+            * A filename to dump :mod:`cProfile` stats to
+        query_stats (bool):
+            * Yield a :class:`ipcrawl.database.stats.QueryStats` to attach
+              to engines and print its summary as JSON when the block exits
+        slow_query (float):
+            * Seconds after which a statement is logged with its plan
 
-def get_request(url, save_as=None, save_mode='wb', **kwargs):
-    resp = requests.get(url, **kwargs)
+    """
+    sinks = [StatsdSink(statsd)] if statsd else []
+    recorder = QueryStats(float(slow_query)) if query_stats else None
 
-    if resp.status_code != 200:
-        err_msg = 'url={} status_code={} reason={}'.format(
-            url,
-            resp.status_code,
-            resp.reason,
-        )
-        raise ValueError(err_msg)
+    if stats or sinks:
+        metrics.reset()
+        metrics.enable(*sinks)
 
-    if save_as:
-        if resp.encoding is None:
-            resp.encoding = 'utf-8'
+    try:
+        with profiled(profile):
+            yield recorder
+    finally:
+        if metrics.enabled:
+            metrics.disable()
 
-        with open(save_as, save_mode) as fd:
-            shutil.copyfileobj(resp.raw, fd)
+            if stats:
+                print(to_json(metrics.summary()))
 
-    return resp
+        if recorder is not None:
+            print(to_json(recorder.summary()))
 
 
 @task
@@ -244,6 +237,111 @@ def benchmark_raw_csv(
     print(result_as_json)
 
 
+@task
+def benchmark(
+    c, output=None, baseline=None, threshold=0.10, corpus_size=1048576,
+    rows=20000, lookups=5000, number=3,
+):
+    """Runs the lexing, lookup and ingestion benchmark suite
+
+    Results are printed and written to @output as JSON. When @baseline is
+    a previous output, fails if any metric regressed past @threshold.
+
+    """
+    from invoke.exceptions import Exit
+    from ipcrawl import benchmark as ipcrawl_benchmark
+
+    results = ipcrawl_benchmark.run(
+        corpus_size=int(corpus_size),
+        rows=int(rows),
+        lookups=int(lookups),
+        number=int(number),
+    )
+    result_as_json = to_json(results)
+    print(result_as_json)
+
+    if output:
+        with open(output, mode='w') as fd:
+            fd.write(result_as_json)
+
+    if baseline:
+        regressions = ipcrawl_benchmark.compare(
+            read_json(baseline), results, threshold=float(threshold),
+        )
+
+        if regressions:
+            raise Exit(
+                'Benchmark regressions:\n{}'.format(to_json(regressions)),
+                code=1,
+            )
+
+
+@task
+def benchmark_json(c, records=10000, number=5):
+    """Perform timeit calculations on encoding enrichment records to JSON
+
+    """
+    from ipcrawl.utils import JSON_BACKENDS
+    from ipcrawl.utils import get_json_backend
+    from ipcrawl.utils import to_json_compact
+    from timeit import timeit
+
+    data = [
+        {
+            'ip': '1.0.{}.{}'.format(i // 256 % 256, i % 256),
+            'geolite2_asn_blocks_ipv4': {
+                'id': 16777216 + i,
+                'network': '1.0.0.0/24',
+                'autonomous_system_number': 13335,
+                'autonomous_system_organization': 'CLOUDFLARENET',
+            },
+            'geolite2_city_blocks_ipv4': {
+                'id': 16777216 + i,
+                'network': '1.0.0.0/24',
+                'geoname_id': 2077456,
+                'is_anonymous_proxy': False,
+                'latitude': -33.494,
+                'longitude': 143.2104,
+                'postal_code': None,
+            },
+        }
+        for i in range(records)
+    ]
+
+    def encode_all(encode):
+        return sum(len(encode(record)) for record in data)
+
+    def bench(encode):
+        size = encode_all(encode)
+        elapsed = timeit(lambda: encode_all(encode), number=number) / number
+        return {
+            'elapsed': elapsed,
+            'records_per_sec': records / elapsed,
+            'mb_per_sec': size / elapsed / 1024 / 1024,
+        }
+
+    results = {'pretty': bench(to_json)}
+
+    for backend in JSON_BACKENDS:
+        try:
+            get_json_backend(backend)
+        except ImportError:
+            results['compact_{}'.format(backend)] = None
+            continue
+
+        results['compact_{}'.format(backend)] = bench(
+            lambda record: to_json_compact(record, backend=backend)
+        )
+
+    results['summary'] = {
+        'number': number,
+        'records': records,
+        'default_backend': get_json_backend()[0],
+    }
+
+    print(to_json(results))
+
+
 @task
 def clean(c, dir=PROJECT_ROOT_DIR, echo=False):
     """Cleans all compiled artifacts recursively
@@ -277,30 +375,172 @@ def clean(c, dir=PROJECT_ROOT_DIR, echo=False):
 
 
 @task
-def extract_ips(c, filename):
+def extract_ips(
+    c, filename, output=None, format='ndjson', db=None, workers=1,
+    stats=False, statsd=None, profile=None, query_stats=False,
+    slow_query=SLOW_QUERY_THRESHOLD, memory=None, cache=False,
+):
     """Extracts all IPv4 ip addresses out of @filename
 
+    Every address is resolved to the ASN and city network that contains it
+    and one record per address is streamed to @output as soon as it is
+    looked up, see :mod:`ipcrawl.writers` for the available formats. All
+    lookups share one read only connection to @db, or one per thread when
+    @workers is greater than one.
+
+    Pass @stats to print the time spent per stage, @statsd to send it to a
+    StatsD server and @profile to dump cProfile stats to a file. Pass
+    @query_stats to print per statement latencies, statements slower than
+    @slow_query seconds are logged with their query plan.
+
+    Pass @memory to cap the addresses held in memory to that many MiB, the
+    file is lexed a chunk at a time, addresses that do not fit are spilled
+    to sorted runs on disk and every address is looked up once, see
+    :class:`ipcrawl.extsort.ExternalSorter`.
+
+    A gzip, bz2 or xz compressed @filename is decompressed as it is read.
+
+    Pass @cache to remember what every address resolved to in @db, later
+    runs then fetch addresses seen before with a single query. The cache is
+    emptied whenever a new GeoLite2 release is loaded.
+
     """
-    with open(filename, mode='r') as fd:
-        content = fd.read()
+    with instrumented(
+        stats=stats,
+        statsd=statsd,
+        profile=profile,
+        query_stats=query_stats,
+        slow_query=slow_query,
+    ) as recorder, ExitStack() as stack:
+        if memory:
+            sorter = stack.enter_context(
+                ExternalSorter(memory=int(memory) * 1024 * 1024)
+            )
 
-    sorted_ips = sort_ips([t.value for t in create_lexer(content)])
+            with open_text(filename) as fd:
+                sorter.update(t.value for t in iter_tokens(fd))
 
-    tables = [
-        models.GeoLite2AsnBlocksIpv4,
-        models.GeoLite2CityBlocksIpv4,
-    ]
+            sorted_ips = iter(sorter)
+        else:
+            with metrics.timer('extract.read'), \
+                    open_text(filename) as fd:
+                content = fd.read()
+
+            sorted_ips = sort_ips([t.value for t in create_lexer(content)])
+            metrics.gauge('extract.ips', len(sorted_ips))
+
+        output = output or 'results.{}'.format(
+            writers.get_writer_class(format).extension
+        )
+
+        if workers > 1:
+            engine = LookupExecutor(
+                filename=db, workers=workers, query_stats=recorder,
+                cache=cache,
+            )
+            lookup_all = engine.map
+        else:
+            engine = lookup.LookupContext(
+                engine=sqlite3.init_engine(db, query_stats=recorder),
+                cache=cache,
+            )
+
+            def lookup_all(ips):
+                return (engine.lookup_all(ip) for ip in ips)
+
+        # the executor reads ahead of the writer, tee buffers the difference
+        sorted_ips, pending = tee(sorted_ips)
+
+        with writers.open_writer(output, format=format) as writer, engine:
+            results = lookup_all(pending)
+
+            for ip in sorted_ips:
+                with metrics.timer('extract.lookup'):
+                    found = next(results)
+
+                with metrics.timer('extract.write'):
+                    record = {'ip': ip}
 
-    with open('results.json', mode='w') as fd:
-        for ip in sorted_ips:
-            network = '.'.join(ip.split('.')[0:3])
-            network_wildcard = '{}%'.format(network)
+                    for table, result in found.items():
+                        record[table] = result.to_dict() if result else None
 
-            with sqlite3.session_scope() as session:
-                for table in tables:
-                    results = session.query(table).filter(table.network.startswith(network_wildcard))  # noqa
-                    if results.all():
-                        json.dump([x.to_dict() for x in results.all()], fp=fd, ensure_ascii=False, separators=(',', ': '))  # noqa
+                    writer.write(record)
+
+
+@task(iterable=['path'])
+def crawl(
+    c, path, output=None, format='ndjson', jobs=None, strict=False,
+    stats=False, statsd=None, profile=None, cache=None,
+):
+    """Extracts all IPv4 addresses out of many files in parallel
+
+    Every @path is a file, a directory to walk or a glob such as
+    ``logs/**/*.log``, pass ``--path`` once per path. The files are lexed
+    by @jobs processes and one record per address, tagged with the file and
+    line it was found on, is streamed to @output.
+
+    Pass @cache, a directory, to load what was found in files whose content
+    did not change since they were crawled instead of lexing them again.
+
+    """
+    from ipcrawl.cache import LexCache
+    from ipcrawl.crawl import crawl as crawl_paths
+
+    output = output or 'hits.{}'.format(
+        writers.get_writer_class(format).extension
+    )
+
+    with instrumented(stats=stats, statsd=statsd, profile=profile), \
+            writers.open_writer(output, format=format) as writer:
+        for hit in crawl_paths(
+            path, workers=int(jobs) if jobs else None, strict=strict,
+            cache=LexCache(cache) if cache else None,
+        ):
+            writer.write({'ip': hit.ip, 'file': hit.file, 'line': hit.line})
+
+
+@task(iterable=['by'])
+def aggregate_ips(
+    c, filename, by=None, top=10, output=None, format='ndjson', db=None,
+    memory=None, stats=False, statsd=None, profile=None,
+):
+    """Counts the hits of @filename per ASN, organization, country or city
+
+    Pass ``--by`` once per group, every group of
+    :data:`ipcrawl.database.aggregate.GROUPS` by default. The @top keys with
+    the most hits of every group are written to @output, ``--top 0`` writes
+    every key. Country and city keys are GeoNames ids.
+
+    The sorted addresses are merge joined with the networks of @db in one
+    pass, no address is looked up on its own. Pass @memory to sort them
+    within that many MiB, see :class:`ipcrawl.extsort.ExternalSorter`.
+
+    """
+    output = output or 'aggregate.{}'.format(
+        writers.get_writer_class(format).extension
+    )
+
+    with instrumented(stats=stats, statsd=statsd, profile=profile), \
+            ExitStack() as stack:
+        with metrics.timer('aggregate.sort'), open_text(filename) as fd:
+            tokens = (t.value for t in iter_tokens(fd))
+
+            if memory:
+                sorter = stack.enter_context(ExternalSorter(
+                    memory=int(memory) * 1024 * 1024, unique=False,
+                ))
+                sorter.update(tokens)
+                ips = sorter.ints()
+            else:
+                ips = sort_ints(ips_to_array(tokens))
+
+        histograms = aggregate.aggregate(
+            sqlite3.init_engine(db), ips, groups=by or tuple(aggregate.GROUPS),
+        )
+
+        with writers.open_writer(output, format=format) as writer:
+            for record in aggregate.top(histograms, n=int(top)):
+                writer.write(record)
 
 
 @task
@@ -470,166 +710,186 @@ def tests(c, extra=None, pty=True, hide=False):
         c.run(cmd, pty=pty, hide=hide)
 
 
-@task
-def download_geolite_city_db(c, cleanup=True):
-    """Downloads the geolite2 city db
-
-    """
-    with c.cd(PROJECT_ROOT_DIR):
-        filename = 'GeoLite2-City-CSV.zip'
-        md5_filename = '{filename}.md5'.format(filename=filename)
+def download_geolite_editions(
+    c, editions, cleanup=True, extract=False, workers=4
+):
+    """Concurrently downloads and verifies the geolite2 archives of editions
 
-        city_csv_url = urlparse.urljoin(GEOLITE_BASE_URI, filename)
-        city_csv_url_md5 = urlparse.urljoin(GEOLITE_BASE_URI, md5_filename)
+    The small md5 files are fetched first so every archive is hashed while
+    it streams to disk and a mismatch fails before the archive is renamed
+    into place. Everything is fetched concurrently over a pooled session and
+    interrupted transfers resume where they left off the next time this
+    runs. The archives are kept as is, :func:`ipcrawl.geolite2.open_csv`
+    streams the CSVs straight out of them.
 
-        get_request(city_csv_url, save_as=filename, stream=True)
-        get_request(city_csv_url_md5, save_as=md5_filename, stream=True)
+    """
+    archives = [
+        os.path.join(GEOLITE_DATA_DIR, geolite2.ARCHIVES[edition])
+        for edition in editions
+    ]
+    md5_jobs = [
+        (
+            urlparse.urljoin(
+                GEOLITE_BASE_URI,
+                '{}.md5'.format(os.path.basename(archive)),
+            ),
+            '{}.md5'.format(archive),
+        )
+        for archive in archives
+    ]
 
-        validate_md5_checksum(filename, md5_filename)
+    if not os.path.isdir(GEOLITE_DATA_DIR):
+        os.makedirs(GEOLITE_DATA_DIR)
 
-        unzip_file(filename, os.path.join('data', 'geolite2'))
+    started = time.monotonic()
+    results = download.download_all(md5_jobs, workers=workers)
 
-        rename_directory(
-            os.path.join('data', 'geolite2', 'GeoLite2-City-CSV_*'),
-            os.path.join('data', 'geolite2', 'city')
-        )
+    archive_jobs = []
+    for archive, (_, md5_save_as) in zip(archives, md5_jobs):
+        with open(md5_save_as, 'r') as fd:
+            checksums = {'md5': fd.read()}
 
-        whitelist = CONFIG['geolite_data']['city']['whitelist']
-        remove_file(
-            os.path.join('data', 'geolite2', 'city', '*.csv'),
-            whitelist=whitelist,
-        )
+        archive_jobs.append((
+            urlparse.urljoin(GEOLITE_BASE_URI, os.path.basename(archive)),
+            archive,
+            checksums,
+        ))
 
         if cleanup:
-            remove_file(filename)
+            remove_file(md5_save_as)
 
+    results += download.download_all(archive_jobs, workers=workers)
+    summary = download.summarize(results, time.monotonic() - started)
 
-@task
-def download_geolite_asn_db(c, cleanup=True):
-    """Downloads the geolite2 asn db
-
-    """
-    with c.cd(PROJECT_ROOT_DIR):
-        filename = 'GeoLite2-ASN-CSV.zip'
-        md5_filename = '{filename}.md5'.format(filename=filename)
+    if extract:
+        for edition, archive in zip(editions, archives):
+            geolite2.extract_members(
+                archive,
+                os.path.join(GEOLITE_DATA_DIR, edition),
+                whitelist=CONFIG['geolite_data'][edition]['whitelist'],
+            )
 
-        asn_csv_url = urlparse.urljoin(GEOLITE_BASE_URI, filename)
-        asn_csv_url_md5 = urlparse.urljoin(GEOLITE_BASE_URI, md5_filename)
+    print(to_json(summary))
 
-        get_request(asn_csv_url, save_as=filename, stream=True)
-        get_request(asn_csv_url_md5, save_as=md5_filename, stream=True)
 
-        validate_md5_checksum(filename, md5_filename)
+@task
+def download_geolite_city_db(c, cleanup=True, extract=False):
+    """Downloads the geolite2 city db
 
-        unzip_file(filename, os.path.join('data', 'geolite2'))
+    """
+    download_geolite_editions(c, ['city'], cleanup=cleanup, extract=extract)
 
-        rename_directory(
-            os.path.join('data', 'geolite2', 'GeoLite2-ASN-CSV_*'),
-            os.path.join('data', 'geolite2', 'asn')
-        )
 
-        whitelist = CONFIG['geolite_data']['asn']['whitelist']
-        remove_file(
-            os.path.join('data', 'geolite2', 'asn', '*.csv'),
-            whitelist=whitelist,
-        )
+@task
+def download_geolite_asn_db(c, cleanup=True, extract=False):
+    """Downloads the geolite2 asn db
 
-        if cleanup:
-            remove_file(filename)
+    """
+    download_geolite_editions(c, ['asn'], cleanup=cleanup, extract=extract)
 
 
 @task
-def download_geolite_country_db(c, cleanup=True):
+def download_geolite_country_db(c, cleanup=True, extract=False):
     """Downloads the geolite2 country db
 
     """
-    with c.cd(PROJECT_ROOT_DIR):
-        filename = 'GeoLite2-Country-CSV.zip'
-        md5_filename = '{filename}.md5'.format(filename=filename)
-
-        country_csv_url = urlparse.urljoin(GEOLITE_BASE_URI, filename)
-        country_csv_url_md5 = urlparse.urljoin(GEOLITE_BASE_URI, md5_filename)
-
-        get_request(country_csv_url, save_as=filename, stream=True)
-        get_request(country_csv_url_md5, save_as=md5_filename, stream=True)
-
-        validate_md5_checksum(filename, md5_filename)
-
-        unzip_file(filename, os.path.join('data', 'geolite2'))
-
-        rename_directory(
-            os.path.join('data', 'geolite2', 'GeoLite2-Country-CSV_*'),
-            os.path.join('data', 'geolite2', 'country')
-        )
-
-        whitelist = CONFIG['geolite_data']['country']['whitelist']
-        remove_file(
-            os.path.join('data', 'geolite2', 'country', '*.csv'),
-            whitelist=whitelist,
-        )
-
-        if cleanup:
-            # remove the zip file
-            remove_file(filename)
+    download_geolite_editions(
+        c, ['country'], cleanup=cleanup, extract=extract,
+    )
 
 
 @task
-def download_geolite_dbs(c, cleanup=True):
-    """Metajob to run all other download_geolite_*_db tasks
+def download_geolite_dbs(c, cleanup=True, extract=False, workers=4):
+    """Concurrently downloads all geolite2 dbs
 
     """
-    download_geolite_asn_db(c, cleanup=cleanup)
-    download_geolite_city_db(c, cleanup=cleanup)
-    download_geolite_country_db(c, cleanup=cleanup)
+    download_geolite_editions(
+        c,
+        ['asn', 'city', 'country'],
+        cleanup=cleanup,
+        extract=extract,
+        workers=workers,
+    )
 
 
 @task
-def populate_sqlite3(c):
-    """Populate SQLite3 db with geolite2 CSV data
+def migrate_sqlite3(c, filename=None, vacuum=True):
+    """Migrate an existing SQLite3 db to the current schema
 
     """
     with c.cd(PROJECT_ROOT_DIR):
+        engine = sqlite3.init_engine(filename=filename)
+        migrated = sqlite3.migrate_db(engine=engine, vacuum=vacuum)
+        print(to_json({'migrated': migrated}))
 
-        def geolite2_city_blocks_ipv4():
-            return models.GeoLite2CityBlocksIpv4
 
-        def geolite2_asn_blocks_ipv4():
-            return models.GeoLite2AsnBlocksIpv4
+@task
+def generate_synthetic_data(
+    c, directory=SYNTHETIC_DATA_DIR, text_size=100 * 1024 * 1024,
+    networks=100000, seed=0, density=0.05, skew=1.0, style='log',
+    archive=True,
+):
+    """Generates a seeded text corpus and geolite2 CSVs into @directory
 
-        # create a mapping of CSV files to models but to avoid the import
-        # problem we just put this behind a small wrapper function.
-        model_mapping = {
-            'GeoLite2-City-Blocks-IPv4.csv': geolite2_city_blocks_ipv4,
-            'GeoLite2-ASN-Blocks-IPv4.csv': geolite2_asn_blocks_ipv4,
-        }
+    """
+    started = time.time()
+    networks = int(networks)
+    summary = synthetic.generate_geolite2(
+        directory, networks=networks, seed=seed, archive=archive,
+    )
 
-        csv_files = [
-            os.path.join(
-                'data', 'geolite2', 'city', 'GeoLite2-City-Blocks-IPv4.csv',
-            ),
-            os.path.join(
-                'data', 'geolite2', 'asn', 'GeoLite2-ASN-Blocks-IPv4.csv',
-            )
-        ]
+    corpus = os.path.join(directory, 'corpus.{}'.format(
+        'log' if style == 'log' else 'txt'
+    ))
+    pool = synthetic.address_pool(seed=seed, networks=networks)
+    with open(corpus, mode='w', encoding='utf-8', newline='') as fd:
+        summary[os.path.basename(corpus)] = synthetic.write_text(
+            fd,
+            int(text_size),
+            seed=seed,
+            density=float(density),
+            skew=float(skew),
+            pool=pool,
+            style=style,
+        )
 
-        for csv_file in csv_files:
-            reader = csv.reader(open(csv_file))
-            headers = next(reader)
-            ModelClass = model_mapping[os.path.basename(csv_file)]()
+    summary['elapsed'] = time.time() - started
+    print(to_json(summary))
 
-            with sqlite3.session_scope() as session:
-                for i, line in enumerate(reader):
-                    model = ModelClass()
 
-                    for key, value in zip(headers, line):
-                        setattr(model, key, value)
+@task
+def populate_sqlite3(
+    c, analyze=True, vacuum=False, directory=None, stats=False, statsd=None,
+    profile=None, query_stats=False, slow_query=SLOW_QUERY_THRESHOLD,
+    progress=ipcrawl_progress.EVERY, progress_format='text',
+):
+    """Populate SQLite3 db with geolite2 CSV data
 
-                    log.debug('adding model={}'.format(model.__dict__))
-                    session.add(model)
+    Progress is reported on stderr every @progress rows, ``0`` disables it.
+    Pass ``--progress-format json`` for one JSON document per report.
 
-                    if i % 10000 == 0:
-                        # commit every 10000 records to avoid OOM
-                        session.commit()
+    """
+    with c.cd(PROJECT_ROOT_DIR), instrumented(
+        stats=stats,
+        statsd=statsd,
+        profile=profile,
+        query_stats=query_stats,
+        slow_query=slow_query,
+    ) as recorder:
+        reporter = None
+        if int(progress):
+            reporter = ipcrawl_progress.Progress(
+                every=int(progress), format=progress_format,
+            )
+
+        loaded = geolite2.populate(
+            engine=sqlite3.init_engine(query_stats=recorder),
+            progress=reporter,
+            directory=directory or GEOLITE_DATA_DIR,
+            analyze=analyze,
+            vacuum=vacuum,
+        )
+        print(to_json(loaded))
 
 CONFIG = read_json(
     os.path.join(PROJECT_ROOT_DIR, 'config.json'),
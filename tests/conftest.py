@@ -15,6 +15,30 @@ PROJECT_ROOT_DIR = os.path.dirname(
 )
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        '--run-benchmarks',
+        action='store_true',
+        default=False,
+        help='run tests marked with @pytest.mark.benchmark',
+    )
+    parser.addoption(
+        '--benchmark-baseline',
+        default=None,
+        help='a previous `inv benchmark --output` to check for regressions',
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--run-benchmarks'):
+        return
+
+    skip = pytest.mark.skip(reason='needs --run-benchmarks')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
 @pytest.fixture
 def lexer_input():
     """A test fixture for feeding a string into our lexer
@@ -0,0 +1,134 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.database import aggregate
+from ipcrawl.database import lookup
+from ipcrawl.database import models
+from ipcrawl.database import sqlite3
+from ipcrawl.utils import ip_to_int
+
+import pytest
+
+
+ASN_ROWS = [
+    ('1.0.0.0/24', 13335, 'CLOUDFLARENET'),
+    ('1.0.4.0/22', 56203, 'Gtelecom-AUSTRALIA'),
+    ('1.0.8.0/24', 13335, 'CLOUDFLARENET'),
+    ('223.255.254.0/24', 55415, 'MARINA BAY SANDS PTE LTD'),
+]
+
+CITY_ROWS = [
+    ('1.0.0.0/24', '2077456', '2077456'),
+    ('1.0.4.0/22', '2147714', '2077456'),
+]
+
+HITS = [
+    '0.0.0.1',
+    '1.0.0.1', '1.0.0.1', '1.0.0.255',
+    '1.0.4.0', '1.0.7.255',
+    '1.0.8.8',
+    '8.8.8.8',
+    '223.255.254.1',
+]
+
+
+@pytest.fixture
+def aggregate_db(tmpdir):
+    """A db with a few ASN and city networks
+
+    """
+    tmpdir.chdir()
+    sqlite3.Session = sqlite3.sessionmaker()
+    engine = sqlite3.init_db(filename='test.sqlite3')
+
+    with sqlite3.session_scope() as session:
+        for network, number, organization in ASN_ROWS:
+            session.add(models.GeoLite2AsnBlocksIpv4(
+                network=network,
+                autonomous_system_number=number,
+                autonomous_system_organization=organization,
+            ))
+
+        for network, geoname_id, country in CITY_ROWS:
+            session.add(models.GeoLite2CityBlocksIpv4(
+                network=network,
+                geoname_id=geoname_id,
+                registered_country_geoname_id=country,
+            ))
+
+    return engine
+
+
+def sorted_hits(ips=HITS):
+    return sorted(ip_to_int(ip) for ip in ips)
+
+
+def test_histograms_match_lookups(aggregate_db):
+    histograms = aggregate.aggregate(aggregate_db, sorted_hits())
+    expected = {group: {} for group in aggregate.GROUPS}
+
+    with aggregate_db.connect() as conn:
+        context = lookup.LookupContext(conn)
+
+        for ip in HITS:
+            records = context.lookup_all(ip)
+
+            for group, (ModelClass, column) in aggregate.GROUPS.items():
+                record = records[ModelClass.__tablename__]
+                key = None if record is None else getattr(record, column)
+                expected[group][key] = expected[group].get(key, 0) + 1
+
+    assert list(histograms) == list(aggregate.GROUPS)
+    assert {group: dict(h) for group, h in histograms.items()} == expected
+    assert histograms['asn'] == {13335: 4, 56203: 2, 55415: 1, None: 2}
+    assert histograms['city'] == {2077456: 3, 2147714: 2, None: 4}
+    assert histograms['country'] == {2077456: 5, None: 4}
+
+
+def test_groups_and_batches(aggregate_db):
+    histograms = aggregate.aggregate(
+        aggregate_db, sorted_hits(), groups=['organization'], batch_size=1,
+    )
+
+    assert list(histograms) == ['organization']
+    assert histograms['organization'].most_common(1) == [
+        ('CLOUDFLARENET', 4),
+    ]
+
+
+def test_scan_starts_at_the_lowest_address(aggregate_db):
+    histograms = aggregate.aggregate(
+        aggregate_db, sorted_hits(['1.0.5.5', '1.0.8.255', '223.255.255.0']),
+    )
+
+    assert histograms['asn'] == {56203: 1, 13335: 1, None: 1}
+    assert aggregate.aggregate(aggregate_db, [])['asn'] == {}
+
+
+def test_aggregate_given_invalid_arguments(aggregate_db):
+    with pytest.raises(ValueError):
+        aggregate.aggregate(aggregate_db, sorted_hits(), groups=['region'])
+
+    with pytest.raises(ValueError):
+        aggregate.aggregate(aggregate_db, sorted_hits()[::-1])
+
+
+def test_top(aggregate_db):
+    histograms = aggregate.aggregate(
+        aggregate_db, sorted_hits(), groups=['asn', 'country'],
+    )
+    records = list(aggregate.top(histograms, n=1))
+
+    assert records == [
+        {'group': 'asn', 'rank': 1, 'key': 13335, 'hits': 4, 'share': 4 / 9},
+        {
+            'group': 'country',
+            'rank': 1,
+            'key': 2077456,
+            'hits': 5,
+            'share': 5 / 9,
+        },
+    ]
+    assert len(list(aggregate.top(histograms, n=0))) == 4 + 2
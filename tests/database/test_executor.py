@@ -0,0 +1,162 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.database import lookup
+from ipcrawl.database import models
+from ipcrawl.database import sqlite3
+from ipcrawl.database.executor import LookupExecutor
+
+import pytest
+import threading
+
+
+@pytest.fixture
+def executor_db(tmpdir):
+    """A WAL mode db with one /24 ASN network per 1.0.x.0 for x < 200
+
+    """
+    tmpdir.chdir()
+    engine = sqlite3.init_db(
+        engine=sqlite3.init_engine(filename='test.sqlite3'),
+        indexes=False,
+    )
+    engine.execute(models.GeoLite2AsnBlocksIpv4.__table__.insert(), [
+        {
+            'id': 16777216 + x * 256,
+            'network': '1.0.{}.0/24'.format(x),
+            'autonomous_system_number': x,
+        }
+        for x in range(200)
+    ])
+    sqlite3.finalize_db(engine)
+
+    return 'test.sqlite3'
+
+
+def test_map_returns_results_in_input_order(executor_db):
+    ips = ['1.0.{}.1'.format(x) for x in range(250, -1, -1)]
+
+    with LookupExecutor(filename=executor_db, workers=4, chunk_size=7) as ex:
+        results = ex.lookup_all(ips)
+
+    with lookup.LookupContext(filename=executor_db) as ctx:
+        expected = [ctx.lookup_all(ip) for ip in ips]
+
+    assert results == expected
+    assert [
+        r['geolite2_asn_blocks_ipv4'].autonomous_system_number
+        for r in results[-200:]
+    ] == list(range(199, -1, -1))
+
+
+def test_every_worker_thread_uses_its_own_connection(executor_db):
+    ips = list(range(16777216, 16777216 + 200 * 256, 97))
+    seen = {}
+    lock = threading.Lock()
+
+    ex = LookupExecutor(filename=executor_db, workers=3, chunk_size=1)
+    original = ex.lookup_chunk
+
+    def lookup_chunk(chunk):
+        ctx = ex.context()
+        with lock:
+            seen.setdefault(threading.get_ident(), set()).add(id(ctx))
+        return original(chunk)
+
+    ex.lookup_chunk = lookup_chunk
+
+    with ex:
+        ex.lookup_all(ips)
+        contexts = list(ex.contexts)
+
+    assert 1 <= len(seen) <= 3
+    assert all(len(ctx_ids) == 1 for ctx_ids in seen.values())
+    assert len(contexts) == len(seen)
+    assert all(ctx.connection is None for ctx in contexts)
+
+
+def test_finalize_db_switches_to_wal(executor_db):
+    engine = sqlite3.init_engine(filename=executor_db)
+
+    assert engine.execute('PRAGMA journal_mode').scalar() == 'wal'
+
+
+def test_map_consumes_its_input_lazily(executor_db):
+    consumed = []
+
+    def ips():
+        for x in range(200):
+            consumed.append(x)
+            yield '1.0.{}.1'.format(x)
+
+    with LookupExecutor(filename=executor_db, workers=2, chunk_size=10) as ex:
+        results = ex.map(ips())
+        first = next(results)
+
+        assert first['geolite2_asn_blocks_ipv4'].autonomous_system_number == 0
+        assert len(consumed) <= 2 * 2 * 10 + 10
+        assert len(list(results)) == 199
+
+
+def test_cache_tables_are_created_once_before_workers_start(
+    executor_db, monkeypatch
+):
+    # a db built before the cache tables existed
+    engine = sqlite3.init_engine(filename=executor_db)
+    engine.execute('DROP TABLE enrichment_cache')
+    engine.execute('DROP TABLE ipcrawl_metadata')
+
+    calls = []
+    create_tables = sqlite3.create_tables
+
+    def counted(engine):
+        calls.append(threading.get_ident())
+        return create_tables(engine)
+
+    monkeypatch.setattr(sqlite3, 'create_tables', counted)
+    ips = ['1.0.{}.1'.format(x) for x in range(200)]
+
+    with LookupExecutor(
+        filename=executor_db, workers=8, chunk_size=1, cache=True,
+    ) as ex:
+        results = ex.lookup_all(ips)
+
+    assert calls == [threading.get_ident()]
+    assert len(results) == 200
+    assert engine.execute(
+        'SELECT count(*) FROM enrichment_cache'
+    ).scalar() == 200
+
+
+def test_cache_flushes_wait_for_other_writers(executor_db, monkeypatch):
+    monkeypatch.setattr(lookup, 'CACHE_FLUSH_EVERY', 1)
+    engine = sqlite3.init_engine(
+        filename=executor_db, connect_args={'check_same_thread': False},
+    )
+    ips = ['1.0.{}.1'.format(x) for x in range(200)]
+
+    with LookupExecutor(
+        filename=executor_db, workers=8, chunk_size=1, cache=True,
+    ) as ex:
+        # another writer holds the write lock while every lookup flushes
+        writer = engine.raw_connection()
+        writer.cursor().execute('BEGIN IMMEDIATE')
+        timer = threading.Timer(0.5, writer.rollback)
+        timer.start()
+
+        try:
+            results = ex.lookup_all(ips)
+        finally:
+            timer.join()
+            writer.close()
+
+        assert ex.context().connection.execute(
+            'PRAGMA busy_timeout'
+        ).scalar() == sqlite3.BUSY_TIMEOUT * 1000
+
+    assert len(results) == 200
+    assert engine.execute(
+        'SELECT count(*) FROM enrichment_cache'
+    ).scalar() == 200
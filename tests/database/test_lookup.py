@@ -0,0 +1,249 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.database import lookup
+from ipcrawl.database import models
+from ipcrawl.database import sqlite3
+
+import pytest
+
+
+ASN_ROWS = [
+    ('1.0.0.0/24', 13335, 'CLOUDFLARENET'),
+    ('1.0.4.0/22', 56203, 'Gtelecom-AUSTRALIA'),
+    ('223.255.254.0/24', 55415, 'MARINA BAY SANDS PTE LTD'),
+]
+
+
+@pytest.fixture
+def lookup_db(tmpdir):
+    """A db with a few ASN networks and one city network
+
+    """
+    tmpdir.chdir()
+    sqlite3.Session = sqlite3.sessionmaker()
+    engine = sqlite3.init_db(filename='test.sqlite3')
+
+    with sqlite3.session_scope() as session:
+        for network, number, organization in ASN_ROWS:
+            session.add(models.GeoLite2AsnBlocksIpv4(
+                network=network,
+                autonomous_system_number=number,
+                autonomous_system_organization=organization,
+            ))
+
+        session.add(models.GeoLite2CityBlocksIpv4(
+            network='1.0.0.0/24',
+            geoname_id='2077456',
+            is_anonymous_proxy='0',
+            is_satellite_provider='1',
+            latitude='-33.494',
+            longitude='143.2104',
+        ))
+
+    return engine
+
+
+def test_record_class_is_built_once_per_model():
+    cls = lookup.record_class(models.GeoLite2CityBlocksIpv4)
+
+    assert lookup.record_class(models.GeoLite2CityBlocksIpv4) is cls
+    assert cls.__name__ == 'GeoLite2CityBlocksIpv4Record'
+    assert cls._fields == models.GeoLite2CityBlocksIpv4.dict_columns()
+    assert not hasattr(cls(*cls._fields), '__dict__')
+
+
+@pytest.mark.parametrize(
+    'ip, expected',
+    [
+        ('1.0.0.0', 'CLOUDFLARENET'),
+        ('1.0.0.255', 'CLOUDFLARENET'),
+        ('1.0.4.1', 'Gtelecom-AUSTRALIA'),
+        ('1.0.7.255', 'Gtelecom-AUSTRALIA'),
+        (16778241, 'Gtelecom-AUSTRALIA'),
+        ('223.255.254.200', 'MARINA BAY SANDS PTE LTD'),
+        ('0.255.255.255', None),
+        ('1.0.1.0', None),
+        ('1.0.8.0', None),
+        ('255.255.255.255', None),
+    ]
+)
+def test_lookup_finds_the_network_that_contains_the_address(
+    lookup_db, ip, expected
+):
+    with lookup_db.connect() as conn:
+        record = lookup.lookup(conn, models.GeoLite2AsnBlocksIpv4, ip)
+
+    if expected is None:
+        assert record is None
+    else:
+        assert record.autonomous_system_organization == expected
+
+
+def test_lookup_record_matches_the_orm_to_dict(lookup_db):
+    with sqlite3.session_scope() as session:
+        record = lookup.lookup(
+            session, models.GeoLite2CityBlocksIpv4, '1.0.0.1'
+        )
+        model = session.query(models.GeoLite2CityBlocksIpv4).one()
+
+        assert record.to_dict() == model.to_dict()
+        assert record.latitude == -33.494
+        assert record.is_satellite_provider is True
+        assert record.to_dict(columns=['id', 'network']) == {
+            'id': 16777216,
+            'network': '1.0.0.0/24',
+        }
+
+
+def test_iter_records_yields_every_row_in_network_order(lookup_db):
+    with lookup_db.connect() as conn:
+        records = list(lookup.iter_records(
+            conn, models.GeoLite2AsnBlocksIpv4, batch_size=2,
+        ))
+        filtered = list(lookup.iter_records(
+            conn,
+            models.GeoLite2AsnBlocksIpv4,
+            models.GeoLite2AsnBlocksIpv4.autonomous_system_number > 55000,
+        ))
+
+    assert [r.network for r in records] == [row[0] for row in ASN_ROWS]
+    assert [r.autonomous_system_number for r in filtered] == [56203, 55415]
+
+
+class Test_LookupContext(object):
+
+    def test_lookup_returns_the_same_records_as_the_core_path(
+        self, lookup_db
+    ):
+        ips = ['1.0.0.1', '1.0.5.5', '1.0.1.0', '223.255.254.1', 16777217]
+
+        with lookup_db.connect() as conn, \
+                lookup.LookupContext(engine=lookup_db) as ctx:
+            for model in lookup.LOOKUP_MODELS:
+                for ip in ips:
+                    assert ctx.lookup(model, ip) == lookup.lookup(
+                        conn, model, ip
+                    )
+
+    def test_lookup_all(self, lookup_db):
+        with lookup.LookupContext(engine=lookup_db) as ctx:
+            records = ctx.lookup_all('1.0.0.1')
+            missing = ctx.lookup_all('1.0.1.0')
+
+        assert records['geolite2_asn_blocks_ipv4'].autonomous_system_number \
+            == 13335
+        assert records['geolite2_city_blocks_ipv4'].is_anonymous_proxy \
+            is False
+        assert missing == {
+            'geolite2_asn_blocks_ipv4': None,
+            'geolite2_city_blocks_ipv4': None,
+        }
+
+    def test_statements_are_compiled_once_per_model(self, lookup_db):
+        ctx = lookup.LookupContext(engine=lookup_db)
+        model = models.GeoLite2AsnBlocksIpv4
+
+        with ctx:
+            ctx.lookup(model, '1.0.0.1')
+            compiled = ctx.compiled[model]
+            ctx.lookup(model, '1.0.4.1')
+
+            assert ctx.compiled[model] is compiled
+
+    def test_the_connection_is_read_only_and_reused(self, lookup_db):
+        with lookup.LookupContext(engine=lookup_db) as ctx:
+            connection = ctx.connection
+            ctx.lookup_all('1.0.0.1')
+
+            with pytest.raises(Exception) as exp:
+                ctx.connection.execute(
+                    'DELETE FROM geolite2_asn_blocks_ipv4'
+                )
+
+            assert ctx.connection is connection
+
+        assert 'readonly' in str(exp.value)
+        assert ctx.connection is None
+
+    def test_lookup_without_entering_the_context(self, lookup_db):
+        ctx = lookup.LookupContext(engine=lookup_db)
+
+        assert ctx.lookup(models.GeoLite2AsnBlocksIpv4, '1.0.0.1') \
+            is not None
+
+        ctx.close()
+
+
+class Test_enrichment_cache(object):
+
+    IPS = ['1.0.0.1', '1.0.5.5', '1.0.1.0', '223.255.254.1', 16777217]
+
+    def cached_ips(self, engine):
+        return [row[0] for row in engine.execute(
+            'SELECT ip FROM enrichment_cache ORDER BY ip'
+        )]
+
+    def test_cached_lookups_match_uncached_ones(self, lookup_db, monkeypatch):
+        with lookup.LookupContext(engine=lookup_db) as ctx:
+            expected = [ctx.lookup_all(ip) for ip in self.IPS]
+
+        with lookup.LookupContext(engine=lookup_db, cache=True) as ctx:
+            assert [ctx.lookup_all(ip) for ip in self.IPS] == expected
+
+        assert self.cached_ips(lookup_db) == [
+            16777217, 16777472, 16778501, 3758095873,
+        ]
+
+        # every address is read back with the single cached statement
+        monkeypatch.setattr(lookup.LookupContext, 'lookup', None)
+
+        with lookup.LookupContext(engine=lookup_db, cache=True) as ctx:
+            assert [ctx.lookup_all(ip) for ip in self.IPS] == expected
+
+    def test_only_full_lookups_are_cached(self, lookup_db):
+        with lookup.LookupContext(engine=lookup_db, cache=True) as ctx:
+            ctx.lookup_all('1.0.0.1', models=[models.GeoLite2AsnBlocksIpv4])
+
+        assert self.cached_ips(lookup_db) == []
+
+    def test_flushes_keep_the_connection_read_only(
+        self, lookup_db, monkeypatch
+    ):
+        monkeypatch.setattr(lookup, 'CACHE_FLUSH_EVERY', 2)
+
+        with lookup.LookupContext(engine=lookup_db, cache=True) as ctx:
+            for ip in self.IPS:
+                ctx.lookup_all(ip)
+
+            assert len(self.cached_ips(lookup_db)) == 4
+            with pytest.raises(Exception) as exp:
+                ctx.connection.execute('DELETE FROM enrichment_cache')
+
+        assert 'readonly' in str(exp.value)
+
+    def test_a_new_release_clears_the_cache(self, lookup_db):
+        assert sqlite3.set_release(lookup_db, 'a') is True
+
+        with lookup.LookupContext(engine=lookup_db, cache=True) as ctx:
+            ctx.lookup_all('1.0.0.1')
+
+        assert sqlite3.set_release(lookup_db, 'a') is False
+        assert self.cached_ips(lookup_db) == [16777217]
+
+        assert sqlite3.set_release(lookup_db, 'b') is True
+        assert self.cached_ips(lookup_db) == []
+
+    def test_a_cache_of_another_release_is_not_used(self, lookup_db):
+        sqlite3.set_release(lookup_db, 'a')
+
+        with lookup.LookupContext(engine=lookup_db, cache=True) as ctx:
+            ctx.lookup_all('1.0.0.1')
+
+        # loaded by something that does not know about the cache
+        sqlite3.set_metadata(lookup_db, sqlite3.RELEASE_KEY, 'b')
+
+        with lookup.LookupContext(engine=lookup_db, cache=True) as ctx:
+            assert self.cached_ips(lookup_db) == []
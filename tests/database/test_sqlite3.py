@@ -8,6 +8,7 @@ from copy import deepcopy
 from ipcrawl.database import models
 from ipcrawl.database import sqlite3
 from ipcrawl.utils import log
+from ipcrawl.utils import metrics
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
@@ -62,7 +63,7 @@ class Test_GeoLite2AsnBlocksIpv4(object):
         results = session.query(models.GeoLite2AsnBlocksIpv4)
 
         assert len(results.all()) == 1
-        assert isinstance(results.first().id, str)
+        assert results.first().id == 3758095872
         assert isinstance(results.first().network, str)
         assert isinstance(results.first().autonomous_system_number, int)
         assert isinstance(results.first().autonomous_system_organization, str)
@@ -79,13 +80,12 @@ class Test_GeoLite2AsnBlocksIpv4(object):
         rec = models.GeoLite2AsnBlocksIpv4(**data)
 
         with test_db() as session:
-            # rec.id = models.generate_uuid()
             session.add(rec)
 
         results = session.query(models.GeoLite2AsnBlocksIpv4)
 
         assert len(results.all()) == 1
-        assert isinstance(results.first().id, str)
+        assert results.first().id == 3758095872
         assert isinstance(results.first().network, str)
         assert isinstance(results.first().autonomous_system_number, int)
         assert isinstance(results.first().autonomous_system_organization, str)
@@ -161,6 +161,150 @@ class Test_GeoLite2AsnBlocksIpv4(object):
         assert repr(rec) == 'GeoLite2AsnBlocksIpv4(id=None)'
 
 
+class Test_session_scope_metrics(object):
+
+    def test_commits_and_rollbacks_are_counted(self, test_db):
+        metrics.reset()
+        metrics.enable()
+
+        try:
+            with test_db():
+                pass
+
+            with pytest.raises(ValueError):
+                with sqlite3.session_scope():
+                    raise ValueError('boom')
+
+            summary = metrics.summary()
+        finally:
+            metrics.disable()
+            metrics.reset()
+
+        assert summary['counters'] == {
+            'db.session.commit': 1,
+            'db.session.rollback': 1,
+        }
+        assert summary['timers']['db.session']['count'] == 2
+
+
+class Test_deferred_indexes(object):
+
+    def get_index_names(self, engine):
+        return sorted(
+            row[0] for row in engine.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+                " AND name NOT LIKE 'sqlite_%'"
+            )
+        )
+
+    def test_init_db_without_indexes_only_creates_tables(self, tmpdir):
+        tmpdir.chdir()
+        sqlite3.Session = sqlite3.sessionmaker()
+        engine = sqlite3.init_db(filename='test.sqlite3', indexes=False)
+
+        assert self.get_index_names(engine) == []
+        assert sorted(engine.table_names()) == [
+            'enrichment_cache',
+            'geolite2_asn_blocks_ipv4',
+            'geolite2_city_blocks_ipv4',
+            'ipcrawl_metadata',
+        ]
+
+    def test_finalize_db_creates_indexes_and_analyzes(self, tmpdir):
+        tmpdir.chdir()
+        sqlite3.Session = sqlite3.sessionmaker()
+        engine = sqlite3.init_db(filename='test.sqlite3', indexes=False)
+
+        sqlite3.finalize_db(engine, vacuum=True)
+
+        assert self.get_index_names(engine) == [
+            'ix_geolite2_asn_blocks_ipv4_autonomous_system_number',
+            'ix_geolite2_city_blocks_ipv4_geoname_id',
+        ]
+        assert 'sqlite_stat1' in engine.table_names()
+
+        # running again is a no-op
+        sqlite3.finalize_db(engine)
+
+    def test_drop_indexes(self, tmpdir):
+        tmpdir.chdir()
+        sqlite3.Session = sqlite3.sessionmaker()
+        engine = sqlite3.init_db(filename='test.sqlite3')
+
+        sqlite3.drop_indexes(engine)
+
+        assert self.get_index_names(engine) == []
+
+
+def legacy_asn_db(values):
+    """A db with an ASN table keyed by uuid4 hex strings
+
+    """
+    engine = sqlite3.init_engine(filename='legacy.sqlite3')
+    engine.execute(
+        'CREATE TABLE geolite2_asn_blocks_ipv4 ('
+        ' id VARCHAR(16) NOT NULL,'
+        ' network VARCHAR(18) NOT NULL,'
+        ' autonomous_system_number INTEGER,'
+        ' autonomous_system_organization VARCHAR,'
+        ' PRIMARY KEY (id))'
+    )
+    engine.execute(
+        'CREATE INDEX ix_geolite2_asn_blocks_ipv4_id'
+        ' ON geolite2_asn_blocks_ipv4 (id)'
+    )
+    engine.execute(
+        'INSERT INTO geolite2_asn_blocks_ipv4 VALUES {}'.format(values)
+    )
+    return engine
+
+
+class Test_migrate_db(object):
+
+    def test_migrating_a_table_with_uuid_string_primary_keys(self, tmpdir):
+        tmpdir.chdir()
+        engine = legacy_asn_db(
+            "('6fa459ea', '1.0.0.0/24', 13335, 'CLOUDFLARENET'),"
+            " ('0e1c7c1a', '1.0.4.0/22', 56203, 'Gtelecom-AUSTRALIA')"
+        )
+
+        migrated = sqlite3.migrate_db(engine=engine)
+        rows = engine.execute(
+            'SELECT id, network, autonomous_system_number'
+            ' FROM geolite2_asn_blocks_ipv4 ORDER BY id'
+        ).fetchall()
+        table_info = engine.execute(
+            'PRAGMA table_info(geolite2_asn_blocks_ipv4)'
+        ).fetchall()
+
+        assert migrated == ['geolite2_asn_blocks_ipv4']
+        assert rows == [
+            (16777216, '1.0.0.0/24', 13335),
+            (16778240, '1.0.4.0/22', 56203),
+        ]
+        assert table_info[0][1:3] == ('id', 'INTEGER')
+        assert sqlite3.migrate_db(engine=engine) == []
+
+    def test_colliding_networks_are_never_dropped(self, tmpdir):
+        tmpdir.chdir()
+        engine = legacy_asn_db(
+            "('6fa459ea', '1.0.0.0/24', 13335, 'CLOUDFLARENET'),"
+            " ('0e1c7c1a', '1.0.0.1/24', 56203, 'Gtelecom-AUSTRALIA'),"
+            " ('7b2e90c4', '1.0.4.0/22', 56203, 'Gtelecom-AUSTRALIA')"
+        )
+
+        with pytest.raises(ValueError, match='1.0.0.0/24, 1.0.0.1/24'):
+            sqlite3.migrate_db(engine=engine)
+
+        rows = engine.execute(
+            'SELECT id FROM geolite2_asn_blocks_ipv4 ORDER BY rowid'
+        ).fetchall()
+        tables = engine.table_names()
+
+        assert rows == [('6fa459ea',), ('0e1c7c1a',), ('7b2e90c4',)]
+        assert 'geolite2_asn_blocks_ipv4_legacy' not in tables
+
+
 class Test_GeoLite2CityBlocksIpv4(object):
 
     def test_saving_a_single_record_given_data_that_contains_all_strings(
@@ -186,7 +330,7 @@ class Test_GeoLite2CityBlocksIpv4(object):
 
         results = session.query(models.GeoLite2CityBlocksIpv4)
         expected = deepcopy(data)
-        expected['id'] = results.first().id
+        expected['id'] = 16777216
         expected['geoname_id'] = 8349238
         expected['is_anonymous_proxy'] = False
         expected['is_satellite_provider'] = False
@@ -0,0 +1,185 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl.database import lookup
+from ipcrawl.database import models
+from ipcrawl.database import sqlite3
+from ipcrawl.database import stats
+
+import logging
+import pytest
+import threading
+import time
+
+
+ASN_ROWS = [
+    ('1.0.0.0/24', 13335, 'CLOUDFLARENET'),
+    ('1.0.4.0/22', 56203, 'Gtelecom-AUSTRALIA'),
+    ('223.255.254.0/24', 55415, 'MARINA BAY SANDS PTE LTD'),
+]
+
+
+@pytest.fixture
+def stats_db(tmpdir):
+    """A db with a few ASN networks and :class:`QueryStats` attached
+
+    """
+    tmpdir.chdir()
+    query_stats = stats.QueryStats()
+    engine = sqlite3.init_engine(
+        filename='test.sqlite3', query_stats=query_stats,
+    )
+
+    sqlite3.Session = sqlite3.sessionmaker()
+    sqlite3.init_db(engine=engine)
+
+    with sqlite3.session_scope() as session:
+        for network, number, organization in ASN_ROWS:
+            session.add(models.GeoLite2AsnBlocksIpv4(
+                network=network,
+                autonomous_system_number=number,
+                autonomous_system_organization=organization,
+            ))
+
+    query_stats.statements.clear()
+    return engine, query_stats
+
+
+def by_statement(query_stats, text):
+    matches = [
+        item for item in query_stats.summary() if text in item['statement']
+    ]
+    assert len(matches) == 1
+    return matches[0]
+
+
+def test_full_scans_are_flagged(stats_db):
+    engine, query_stats = stats_db
+    model = models.GeoLite2AsnBlocksIpv4
+
+    with sqlite3.session_scope() as session:
+        session.query(model).filter(model.network.like('1.%')).all()
+
+    item = by_statement(query_stats, 'LIKE')
+
+    assert item['full_scan'] is True
+    assert item['rows'] == 2
+    assert item['plan'][0].startswith('SCAN')
+
+
+def test_lookups_are_index_searches(stats_db):
+    engine, query_stats = stats_db
+
+    with engine.connect() as conn:
+        for ip in ('1.0.0.1', '1.0.5.1', '2.0.0.0'):
+            lookup.lookup(conn, models.GeoLite2AsnBlocksIpv4, ip)
+
+    item = by_statement(query_stats, 'LIMIT')
+
+    assert item['count'] == 3
+    assert item['rows'] == 3
+    assert item['full_scan'] is False
+    assert item['plan'][0].startswith('SEARCH')
+    assert 0 < item['mean'] <= item['p99'] <= item['max']
+
+
+def test_rows_affected_by_dml_are_counted(stats_db):
+    engine, query_stats = stats_db
+
+    engine.execute(
+        'UPDATE geolite2_asn_blocks_ipv4 SET autonomous_system_number = 1'
+    )
+
+    assert by_statement(query_stats, 'UPDATE')['rows'] == 3
+
+
+def test_slow_statements_are_logged_with_their_plan(stats_db, caplog):
+    engine, query_stats = stats_db
+    query_stats.slow_threshold = 0
+
+    with caplog.at_level(logging.WARNING, logger='ipcrawl'):
+        engine.execute(
+            'SELECT count(*) FROM geolite2_asn_blocks_ipv4'
+        ).scalar()
+
+    assert any(
+        'slow query' in message and 'SCAN' in message
+        for message in caplog.messages
+    )
+
+
+def test_lookup_context_lookups_are_recorded(stats_db):
+    engine, query_stats = stats_db
+
+    with lookup.LookupContext(engine=engine) as ctx:
+        assert ctx.query_stats is query_stats
+
+        for ip in ('1.0.0.1', '1.0.1.1'):
+            ctx.lookup(models.GeoLite2AsnBlocksIpv4, ip)
+
+    item = by_statement(query_stats, 'geolite2_asn_blocks_ipv4.id <= ?')
+
+    assert item['count'] == 2
+    assert item['rows'] == 2
+    assert item['full_scan'] is False
+
+
+def test_statements_are_explained_once_across_threads(stats_db, monkeypatch):
+    engine, query_stats = stats_db
+    explained = []
+    query_plan = stats.query_plan
+
+    def slow_query_plan(*args):
+        explained.append(args[1])
+        time.sleep(0.05)
+        return query_plan(*args)
+
+    monkeypatch.setattr(stats, 'query_plan', slow_query_plan)
+    barrier = threading.Barrier(8)
+
+    def run():
+        with lookup.LookupContext(engine=engine) as ctx:
+            barrier.wait()
+            for ip in ('1.0.0.1', '1.0.4.1', '2.0.0.1'):
+                ctx.lookup(models.GeoLite2AsnBlocksIpv4, ip)
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    item = by_statement(query_stats, 'geolite2_asn_blocks_ipv4.id <= ?')
+
+    assert explained.count(item['statement']) == 1
+    assert item['count'] == 24
+    assert item['rows'] == 24
+    assert item['plan']
+
+
+@pytest.mark.parametrize(
+    'plan, expected',
+    [
+        (['SCAN geolite2_asn_blocks_ipv4'], True),
+        (['SCAN TABLE geolite2_asn_blocks_ipv4'], True),
+        (['SCAN geolite2_asn_blocks_ipv4 USING COVERING INDEX ix'], True),
+        (['SEARCH geolite2_asn_blocks_ipv4 USING INTEGER PRIMARY KEY'], False),
+        (['SCAN sqlite_master'], False),
+        (['SCAN CONSTANT ROW'], False),
+        ([], False),
+    ]
+)
+def test_is_full_scan(plan, expected):
+    assert stats.is_full_scan(plan) is expected
+
+
+def test_detach(stats_db):
+    engine, query_stats = stats_db
+    query_stats.detach(engine)
+
+    engine.execute('SELECT 1')
+
+    assert stats.attached(engine) is None
+    assert query_stats.summary() == []
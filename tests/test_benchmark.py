@@ -0,0 +1,95 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import benchmark
+from ipcrawl.utils import read_json
+from ipcrawl.utils import to_json
+
+import json
+import pytest
+
+
+def make_results(**values):
+    return {
+        'results': {
+            name: benchmark.metric(
+                value, 'x', higher_is_better=name != 'peak_rss',
+            )
+            for name, value in values.items()
+        }
+    }
+
+
+def test_compare_when_nothing_regressed():
+    baseline = make_results(lexer_mb_per_sec=10.0, peak_rss=100)
+    current = make_results(lexer_mb_per_sec=9.5, peak_rss=105)
+
+    assert benchmark.compare(baseline, current, threshold=0.10) == []
+
+
+def test_compare_reports_throughput_drops_past_the_threshold():
+    baseline = make_results(lexer_mb_per_sec=10.0, ingestion_rows_per_sec=5.0)
+    current = make_results(lexer_mb_per_sec=8.0, ingestion_rows_per_sec=5.0)
+
+    regressions = benchmark.compare(baseline, current, threshold=0.10)
+
+    assert [r['metric'] for r in regressions] == ['lexer_mb_per_sec']
+    assert regressions[0]['change'] == pytest.approx(-0.2)
+
+
+def test_compare_reports_memory_growth_past_the_threshold():
+    baseline = make_results(peak_rss=100)
+    current = make_results(peak_rss=150)
+
+    assert [
+        r['metric'] for r in benchmark.compare(baseline, current)
+    ] == ['peak_rss']
+
+
+def test_compare_ignores_metrics_missing_from_either_run():
+    baseline = make_results(lexer_mb_per_sec=10.0, old_metric=1.0)
+    current = make_results(lexer_mb_per_sec=10.0, new_metric=0.0)
+
+    assert benchmark.compare(baseline, current) == []
+
+
+def test_machine_metadata_is_json_serializable():
+    metadata = benchmark.machine_metadata()
+
+    assert json.loads(to_json(metadata)) == metadata
+    assert metadata['cpu_count'] >= 1
+
+
+def test_sample_corpus_is_at_least_the_requested_size():
+    assert len(benchmark.sample_corpus(50000)) >= 50000
+
+
+def test_benchmarks_leave_the_global_session_alone(tmpdir):
+    from ipcrawl.database import sqlite3
+
+    session = sqlite3.Session
+    bind = session.kw.get('bind')
+    filename = str(tmpdir.join('bench.sqlite3'))
+
+    benchmark.bench_ingestion(filename, rows=100)
+    benchmark.bench_lookups(filename, ['1.0.0.1', '8.8.8.8'], workers=1)
+
+    assert sqlite3.Session is session
+    assert session.kw.get('bind') is bind
+
+
+@pytest.mark.benchmark
+def test_benchmark_suite(request, tmpdir):
+    results = benchmark.run(
+        corpus_size=256 * 1024, rows=5000, lookups=1000, number=1,
+    )
+    tmpdir.join('benchmark.json').write(to_json(results))
+
+    assert results['results']['lexer_mb_per_sec']['value'] > 0
+    assert results['results']['lookup_context_per_sec']['value'] > 0
+
+    baseline = request.config.getoption('--benchmark-baseline')
+    if baseline:
+        assert benchmark.compare(read_json(baseline), results) == []
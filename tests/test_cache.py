@@ -0,0 +1,127 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import cache as lexcache
+from ipcrawl import crawl
+from ipcrawl.cache import LexCache
+from ipcrawl.crawl import Hit
+
+import os
+import pytest
+
+
+class Lexer(object):
+    """:func:`ipcrawl.crawl.crawl_file` that counts its calls
+
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, filename):
+        self.calls.append(os.path.basename(filename))
+        return crawl.crawl_file(filename)
+
+
+@pytest.fixture
+def lex():
+    return Lexer()
+
+
+@pytest.fixture
+def log(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('up 10.0.0.1\n\nfrom 10.0.0.2 to 255.255.255.255\n')
+    # old enough that size and mtime alone are trusted
+    os.utime(str(log), ns=(0, 10 ** 9))
+    return log
+
+
+def test_encode_result_round_trip():
+    ips = ['10.0.0.1', '0.0.0.0', '255.255.255.255']
+    data = lexcache.encode_result(ips, [1, 3, 4294967295])
+
+    assert len(data) == 8 + 3 * 8
+    assert lexcache.decode_result(data) == (ips, [1, 3, 4294967295])
+    assert lexcache.decode_result(lexcache.encode_result([], [])) == ([], [])
+
+
+@pytest.mark.parametrize('data', [b'', b'IPCR\x00\x00\x00\x00', b'IPLC\x01'])
+def test_decode_result_given_invalid_data(data):
+    with pytest.raises(ValueError):
+        lexcache.decode_result(data)
+
+
+def test_unchanged_files_are_not_lexed_again(tmpdir, log, lex, monkeypatch):
+    cache = LexCache(str(tmpdir.join('cache')))
+    expected = (['10.0.0.1', '10.0.0.2', '255.255.255.255'], [1, 3, 3])
+
+    assert cache.get(str(log), lex) == expected
+    assert cache.get(str(log), lex) == expected
+    assert lex.calls == ['app.log']
+
+    # a copy has the same content
+    log.copy(tmpdir.join('app.log.1'))
+    assert cache.get(str(tmpdir.join('app.log.1')), lex) == expected
+    assert lex.calls == ['app.log']
+
+    # size and mtime match, the content is not hashed
+    monkeypatch.setattr(lexcache, 'file_digest', None)
+    assert cache.get(str(log), lex) == expected
+
+
+def test_changed_files_are_lexed_again(tmpdir, log, lex):
+    cache = LexCache(str(tmpdir.join('cache')))
+    cache.get(str(log), lex)
+
+    log.write('now 9.9.9.9\n')
+    assert cache.get(str(log), lex) == (['9.9.9.9'], [1])
+
+    # same size and mtime, but recorded too soon after the file was written
+    mtime_ns = os.stat(str(log)).st_mtime_ns
+    log.write('now 8.8.8.8\n')
+    os.utime(str(log), ns=(mtime_ns, mtime_ns))
+    assert cache.get(str(log), lex) == (['8.8.8.8'], [1])
+    assert lex.calls == ['app.log'] * 3
+
+
+def test_results_are_keyed_by_lexer_version(tmpdir, log, lex, monkeypatch):
+    cache = LexCache(str(tmpdir.join('cache')))
+    cache.get(str(log), lex)
+
+    monkeypatch.setattr(lexcache, 'LEXER_VERSION', lexcache.LEXER_VERSION + 1)
+    cache.get(str(log), lex)
+
+    assert lex.calls == ['app.log'] * 2
+
+
+def test_corrupt_entries_are_lexed_again(tmpdir, log, lex):
+    cache = LexCache(str(tmpdir.join('cache')))
+    cache.get(str(log), lex)
+
+    for root, _, names in os.walk(str(tmpdir.join('cache'))):
+        for name in names:
+            with open(os.path.join(root, name), mode='r+b') as fd:
+                fd.truncate(5)
+
+    assert cache.get(str(log), lex)[0][0] == '10.0.0.1'
+    assert lex.calls == ['app.log'] * 2
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_crawl_with_a_cache(tmpdir, log, workers):
+    cache = LexCache(str(tmpdir.join('cache')))
+    tmpdir.join('other.log').write('9.9.9.9\n')
+    paths = [str(log), str(tmpdir.join('other.log'))]
+
+    first = list(crawl.crawl(
+        paths, workers=workers, files_per_task=1, cache=cache,
+    ))
+    again = list(crawl.crawl(
+        paths, workers=workers, files_per_task=1, cache=cache,
+    ))
+
+    assert first == again
+    assert again[-1] == Hit(str(tmpdir.join('other.log')), 1, '9.9.9.9')
@@ -0,0 +1,236 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import cli
+from ipcrawl.database import models
+from ipcrawl.database import sqlite3
+
+import gzip
+import json
+import pytest
+import subprocess
+import sys
+
+
+def test_extract_prints_sorted_addresses(tmpdir, capsys):
+    crawl = tmpdir.join('crawl.log')
+    crawl.write('seen 10.0.0.2 and 9.9.9.9\nthen 10.0.0.2 again\n')
+
+    assert cli.main(['extract', str(crawl)]) == 0
+
+    out = capsys.readouterr().out
+    assert out.split() == ['9.9.9.9', '10.0.0.2', '10.0.0.2']
+
+
+def test_extract_unique_in_found_order(tmpdir):
+    crawl = tmpdir.join('crawl.log')
+    crawl.write('seen 10.0.0.2 and 9.9.9.9 then 10.0.0.2 again\n')
+    output = tmpdir.join('ips.txt')
+
+    cli.main([
+        'extract', str(crawl), '--unique', '--no-sort', '-o', str(output),
+    ])
+
+    assert output.read().split() == ['10.0.0.2', '9.9.9.9']
+
+
+def test_extract_reports_lexer_errors(tmpdir, capsys):
+    crawl = tmpdir.join('crawl.log')
+    crawl.write('1.2.3.4 #\n')
+
+    with pytest.raises(SystemExit) as exp:
+        cli.main(['extract', str(crawl)])
+
+    assert exp.value.code == 1
+    assert 'Illegal character' in capsys.readouterr().err
+
+
+def test_extract_does_not_import_the_database_layer(tmpdir):
+    crawl = tmpdir.join('crawl.log')
+    crawl.write('seen 1.2.3.4\n')
+
+    script = (
+        'import sys\n'
+        'from ipcrawl import cli\n'
+        'cli.main(["extract", sys.argv[1], "-o", sys.argv[2]])\n'
+        'print(" ".join(\n'
+        '    m for m in sys.modules if m.startswith(cli.HEAVY_MODULES)\n'
+        '))\n'
+    )
+    out = subprocess.check_output([
+        sys.executable, '-c', script, str(crawl), str(tmpdir.join('out')),
+    ])
+
+    assert out.decode().split() == []
+
+
+@pytest.mark.parametrize('memory', [None, '1'])
+def test_extract_decompresses_stdin(tmpdir, capsys, monkeypatch, memory):
+    tmpdir.join('crawl.log.gz').write_binary(
+        gzip.compress(b'seen 10.0.0.2\nand 9.9.9.9\n'),
+    )
+    argv = ['extract'] + (['--memory', memory] if memory else [])
+
+    with tmpdir.join('crawl.log.gz').open(mode='r') as fd:
+        monkeypatch.setattr(sys, 'stdin', fd)
+        assert cli.main(argv) == 0
+
+    assert capsys.readouterr().out.split() == ['9.9.9.9', '10.0.0.2']
+
+
+@pytest.mark.parametrize('cache', [[], ['--cache']])
+def test_lookup_reads_addresses_from_stdin(
+    tmpdir, capsys, monkeypatch, cache
+):
+    tmpdir.chdir()
+    engine = sqlite3.init_engine(filename='test.sqlite3')
+    sqlite3.Session = sqlite3.sessionmaker()
+    sqlite3.init_db(engine=engine)
+
+    with sqlite3.session_scope() as session:
+        session.add(models.GeoLite2AsnBlocksIpv4(
+            network='1.0.0.0/24',
+            autonomous_system_number=13335,
+            autonomous_system_organization='CLOUDFLARENET',
+        ))
+
+    tmpdir.join('ips').write('1.0.0.1\n\n2.0.0.1\n')
+
+    with tmpdir.join('ips').open() as fd:
+        monkeypatch.setattr(sys, 'stdin', fd)
+        assert cli.main(['lookup', '--db', 'test.sqlite3'] + cache) == 0
+
+    records = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+
+    assert [record['ip'] for record in records] == ['1.0.0.1', '2.0.0.1']
+    assert records[0]['geolite2_asn_blocks_ipv4'][
+        'autonomous_system_number'
+    ] == 13335
+    assert records[1]['geolite2_asn_blocks_ipv4'] is None
+
+
+def test_unknown_subcommands_exit_with_usage(capsys):
+    with pytest.raises(SystemExit) as exp:
+        cli.main(['crawl'])
+
+    assert exp.value.code == 2
+    assert 'usage: ipcrawl' in capsys.readouterr().err
+
+
+def test_extract_within_a_memory_cap(tmpdir, capsys, monkeypatch):
+    monkeypatch.setattr('ipcrawl.extsort.BYTES_PER_ADDRESS', 1024 * 1024)
+    first = tmpdir.join('first.log')
+    first.write('seen 10.0.0.2 and 9.9.9.9\n')
+    second = tmpdir.join('second.log')
+    second.write('then 10.0.0.2 and 8.8.8.8\n')
+
+    assert cli.main(['extract', '-m', '1', str(first), str(second)]) == 0
+
+    out = capsys.readouterr().out
+    assert out.split() == ['8.8.8.8', '9.9.9.9', '10.0.0.2']
+
+
+def test_crawl_tags_every_address(tmpdir, capsys):
+    tmpdir.join('a.log').write('seen 10.0.0.2\n')
+    tmpdir.join('b.log').write('\nseen 9.9.9.9\n')
+
+    assert cli.main(['crawl', str(tmpdir), '-j', '1']) == 0
+
+    records = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+    assert records == [
+        {'ip': '10.0.0.2', 'file': str(tmpdir.join('a.log')), 'line': 1},
+        {'ip': '9.9.9.9', 'file': str(tmpdir.join('b.log')), 'line': 2},
+    ]
+
+
+def test_follow_once_resumes_from_the_checkpoint(tmpdir, capsys):
+    log = tmpdir.join('app.log')
+    log.write('up 10.0.0.1\n')
+    argv = ['follow', str(log), '--once', '-c', str(tmpdir.join('ckpt'))]
+
+    assert cli.main(argv) == 0
+    log.write('from 10.0.0.2\n', mode='a')
+    assert cli.main(argv) == 0
+
+    records = [json.loads(line) for line in capsys.readouterr().out.split()]
+    assert records == [
+        {'ip': '10.0.0.1', 'line': 1}, {'ip': '10.0.0.2', 'line': 2},
+    ]
+
+
+def test_crawl_with_a_cache(tmpdir, capsys):
+    tmpdir.join('app.log').write('up 10.0.0.1\n')
+    argv = ['crawl', str(tmpdir.join('app.log')), '--cache', str(tmpdir)]
+
+    assert cli.main(argv) == 0
+    assert cli.main(argv) == 0
+
+    records = [json.loads(line) for line in capsys.readouterr().out.split()]
+    assert records == [
+        {'ip': '10.0.0.1', 'file': str(tmpdir.join('app.log')), 'line': 1},
+    ] * 2
+
+
+@pytest.mark.parametrize('memory', [[], ['-m', '1']])
+def test_aggregate_counts_hits_per_asn(tmpdir, capsys, memory):
+    tmpdir.chdir()
+    engine = sqlite3.init_engine(filename='test.sqlite3')
+    sqlite3.Session = sqlite3.sessionmaker()
+    sqlite3.init_db(engine=engine)
+
+    with sqlite3.session_scope() as session:
+        session.add(models.GeoLite2AsnBlocksIpv4(
+            network='1.0.0.0/24',
+            autonomous_system_number=13335,
+            autonomous_system_organization='CLOUDFLARENET',
+        ))
+
+    tmpdir.join('a.log').write('from 2.0.0.1 to 1.0.0.1\n')
+    tmpdir.join('b.log').write('1.0.0.1 again\n1.0.0.9\n')
+
+    args = ['aggregate', 'a.log', 'b.log', '--db', 'test.sqlite3', '-b', 'asn']
+    assert cli.main(args + memory) == 0
+
+    records = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+
+    assert [(r['key'], r['hits']) for r in records] == [(13335, 3), (None, 1)]
+    assert records[0]['share'] == 0.75
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_lookup_rejects_invalid_addresses(tmpdir, capsys, workers):
+    tmpdir.chdir()
+    sqlite3.init_db(filename='test.sqlite3')
+
+    with pytest.raises(SystemExit) as exp:
+        cli.main([
+            'lookup', '--db', 'test.sqlite3', '-w', workers,
+            '1.0.0.1', '999.1.1.1',
+        ])
+
+    assert exp.value.code == 1
+    assert capsys.readouterr().err == (
+        "ipcrawl: error: invalid IPv4 address '999.1.1.1'\n"
+    )
+
+
+@pytest.mark.parametrize('command', [['lookup', '1.1.1.1'], ['aggregate']])
+def test_missing_db_is_an_error(tmpdir, capsys, command):
+    tmpdir.chdir()
+
+    with pytest.raises(SystemExit) as exp:
+        cli.main(command + ['--db', 'missing.db'])
+
+    assert exp.value.code == 1
+    assert capsys.readouterr().err.splitlines() == [
+        'ipcrawl: error: no db at missing.db, create it with `ipcrawl load`',
+    ]
+    assert not tmpdir.join('missing.db').exists()
@@ -0,0 +1,84 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import crawl
+from ipcrawl.crawl import Hit
+
+import gzip
+import logging
+import lzma
+import pytest
+
+
+@pytest.fixture
+def logs(tmpdir):
+    """Rotated logs in nested directories, one of them unreadable
+
+    """
+    tmpdir.join('app.log').write('up 10.0.0.1\n\nfrom 10.0.0.2 to 8.8.8.8\n')
+    tmpdir.mkdir('archive').join('app.log.1').write('from 9.9.9.9\n')
+    tmpdir.join('archive').mkdir('old').join('app.log.2').write('1.1.1.1\n')
+    tmpdir.join('archive', 'bad.log').write('see @ 2.2.2.2\n')
+    return tmpdir
+
+
+def test_expand_paths(logs):
+    expected = [
+        str(logs.join('archive', 'app.log.1')),
+        str(logs.join('archive', 'bad.log')),
+        str(logs.join('archive', 'old', 'app.log.2')),
+    ]
+
+    assert crawl.expand_paths([str(logs.join('archive'))]) == expected
+    assert crawl.expand_paths([
+        str(logs.join('**', 'app.log*')), str(logs.join('app.log')),
+    ]) == [
+        str(logs.join('app.log')),
+        str(logs.join('archive', 'app.log.1')),
+        str(logs.join('archive', 'old', 'app.log.2')),
+    ]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_hits_are_tagged_with_their_file_and_line(logs, workers, caplog):
+    with caplog.at_level(logging.WARNING, logger='ipcrawl'):
+        hits = list(crawl.crawl(
+            [str(logs)], workers=workers, files_per_task=1,
+        ))
+
+    assert hits == [
+        Hit(str(logs.join('app.log')), 1, '10.0.0.1'),
+        Hit(str(logs.join('app.log')), 3, '10.0.0.2'),
+        Hit(str(logs.join('app.log')), 3, '8.8.8.8'),
+        Hit(str(logs.join('archive', 'app.log.1')), 1, '9.9.9.9'),
+        Hit(str(logs.join('archive', 'old', 'app.log.2')), 1, '1.1.1.1'),
+    ]
+    assert any('bad.log' in message for message in caplog.messages)
+
+
+def test_strict_raises_on_the_first_bad_file(logs):
+    with pytest.raises(ValueError) as exp:
+        list(crawl.crawl([str(logs.join('archive'))], strict=True))
+
+    assert 'bad.log' in str(exp.value)
+
+
+def test_missing_files_are_skipped(tmpdir):
+    assert list(crawl.crawl([str(tmpdir.join('missing.log'))])) == []
+
+
+def test_compressed_files_are_decompressed(tmpdir, caplog):
+    tmpdir.join('app.log.gz').write_binary(gzip.compress(b'\n10.0.0.1\n'))
+    tmpdir.join('app.log.xz').write_binary(lzma.compress(b'9.9.9.9\n'))
+    tmpdir.join('bad.log.gz').write_binary(gzip.compress(b'1.1.1.1\n')[:-8])
+
+    with caplog.at_level(logging.WARNING, logger='ipcrawl'):
+        hits = list(crawl.crawl([str(tmpdir)], workers=1))
+
+    assert hits == [
+        Hit(str(tmpdir.join('app.log.gz')), 2, '10.0.0.1'),
+        Hit(str(tmpdir.join('app.log.xz')), 1, '9.9.9.9'),
+    ]
+    assert any('bad.log.gz' in message for message in caplog.messages)
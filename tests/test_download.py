@@ -0,0 +1,305 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+from ipcrawl import download
+
+from socketserver import ThreadingMixIn
+
+import gzip
+import hashlib
+import os
+import pytest
+import re
+import threading
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves ``server.files`` with ``Range`` support, like the MaxMind CDN
+
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        name = self.path.lstrip('/')
+        server.requests.append((name, self.headers.get('Range')))
+        server.encodings.append(self.headers.get('Accept-Encoding'))
+
+        if name not in server.files:
+            self.send_error(404)
+            return
+
+        body = server.files[name]
+        start = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+
+        if match and server.ranges:
+            # a misaligned server sends a range other than the one asked for
+            start = 0 if server.misaligned else int(match.group(1))
+
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(
+                    len(body)
+                ))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(body) - 1, len(body)
+            ))
+        else:
+            self.send_response(200)
+
+        if name in server.gzipped:
+            # a body that is served gzip encoded whatever was asked for
+            self.send_header('Content-Encoding', 'gzip')
+
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+
+        payload = body[start:]
+        if name in server.truncate:
+            # simulate a dropped connection half way through
+            payload = payload[:len(payload) // 2]
+
+        self.wfile.write(payload)
+
+
+@pytest.fixture
+def http_server(tmpdir):
+    """A local stand-in for ``GEOLITE_BASE_URI``
+
+    """
+    tmpdir.chdir()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.files = {}
+    server.requests = []
+    server.encodings = []
+    server.gzipped = set()
+    server.truncate = set()
+    server.ranges = True
+    server.misaligned = False
+    server.base_uri = 'http://127.0.0.1:{}/'.format(server.server_port)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_saves_the_response_body(http_server):
+    http_server.files['a.zip'] = os.urandom(200000)
+
+    result = download.download(http_server.base_uri + 'a.zip', 'a.zip')
+
+    with open('a.zip', 'rb') as fd:
+        assert fd.read() == http_server.files['a.zip']
+
+    assert result.size == 200000
+    assert result.transferred == 200000
+    assert result.resumed is False
+    assert result.rate > 0
+    assert not os.path.exists('a.zip.part')
+
+
+def test_download_saves_content_encoded_bodies_as_sent(http_server):
+    # such as a .tar.gz served with Content-Encoding: gzip
+    body = gzip.compress(os.urandom(100000))
+    http_server.files['a.tar.gz'] = body
+    http_server.gzipped.add('a.tar.gz')
+
+    result = download.download(
+        http_server.base_uri + 'a.tar.gz',
+        'a.tar.gz',
+        checksums={'sha256': hashlib.sha256(body).hexdigest()},
+    )
+
+    with open('a.tar.gz', 'rb') as fd:
+        assert fd.read() == body
+
+    assert result.size == len(body)
+    assert http_server.encodings == ['identity']
+
+
+def test_download_resumes_a_partial_file_with_a_range_request(http_server):
+    body = os.urandom(100000)
+    http_server.files['a.zip'] = body
+
+    with open('a.zip.part', 'wb') as fd:
+        fd.write(body[:30000])
+
+    result = download.download(http_server.base_uri + 'a.zip', 'a.zip')
+
+    with open('a.zip', 'rb') as fd:
+        assert fd.read() == body
+
+    assert http_server.requests == [('a.zip', 'bytes=30000-')]
+    assert result.transferred == 70000
+    assert result.resumed is True
+
+
+def test_download_restarts_when_the_server_ignores_ranges(http_server):
+    body = os.urandom(1000)
+    http_server.files['a.zip'] = body
+    http_server.ranges = False
+
+    with open('a.zip.part', 'wb') as fd:
+        fd.write(b'stale')
+
+    download.download(http_server.base_uri + 'a.zip', 'a.zip')
+
+    with open('a.zip', 'rb') as fd:
+        assert fd.read() == body
+
+
+def test_download_restarts_when_the_server_sends_another_range(http_server):
+    body = os.urandom(1000)
+    http_server.files['a.zip'] = body
+    http_server.misaligned = True
+
+    with open('a.zip.part', 'wb') as fd:
+        fd.write(body[:300])
+
+    result = download.download(http_server.base_uri + 'a.zip', 'a.zip')
+
+    with open('a.zip', 'rb') as fd:
+        assert fd.read() == body
+
+    assert http_server.requests == [('a.zip', 'bytes=300-'), ('a.zip', None)]
+    assert result.resumed is False
+
+
+def test_download_when_the_partial_file_is_already_complete(http_server):
+    body = os.urandom(1000)
+    http_server.files['a.zip'] = body
+
+    with open('a.zip.part', 'wb') as fd:
+        fd.write(body)
+
+    result = download.download(http_server.base_uri + 'a.zip', 'a.zip')
+
+    assert result.transferred == 0
+    assert os.path.getsize('a.zip') == 1000
+
+
+def test_an_interrupted_download_can_be_resumed(http_server):
+    body = os.urandom(100000)
+    http_server.files['a.zip'] = body
+    http_server.truncate.add('a.zip')
+    url = http_server.base_uri + 'a.zip'
+
+    with pytest.raises(Exception):
+        download.download(url, 'a.zip', chunk_size=1024)
+
+    partial_size = os.path.getsize('a.zip.part')
+
+    assert not os.path.exists('a.zip')
+    assert 0 < partial_size <= 50000
+
+    http_server.truncate.clear()
+    download.download(url, 'a.zip')
+
+    with open('a.zip', 'rb') as fd:
+        assert fd.read() == body
+
+    assert http_server.requests[-1] == (
+        'a.zip', 'bytes={}-'.format(partial_size)
+    )
+
+
+def test_download_raises_on_an_unexpected_status(http_server):
+    with pytest.raises(ValueError) as exp:
+        download.download(http_server.base_uri + 'nope.zip', 'nope.zip')
+
+    assert 'status_code=404' in str(exp.value)
+
+
+def test_download_all_returns_results_in_job_order(http_server):
+    names = ['asn.zip', 'city.zip', 'country.zip']
+    for i, name in enumerate(names):
+        http_server.files[name] = os.urandom(50000 * (3 - i))
+
+    jobs = [(http_server.base_uri + name, name) for name in names]
+    results = download.download_all(jobs, workers=3)
+    summary = download.summarize(results)
+
+    assert [r.filename for r in results] == names
+    assert [r.size for r in results] == [150000, 100000, 50000]
+    assert summary['transferred'] == 300000
+    assert summary['rate'] > 0
+
+
+def test_download_hashes_the_file_while_it_streams(http_server):
+    body = os.urandom(100000)
+    http_server.files['a.zip'] = body
+
+    result = download.download(
+        http_server.base_uri + 'a.zip',
+        'a.zip',
+        checksums={
+            'md5': hashlib.md5(body).hexdigest(),
+            'sha256': '{}  a.zip\n'.format(hashlib.sha256(body).hexdigest()),
+        },
+    )
+
+    assert result.checksums == {
+        'md5': hashlib.md5(body).hexdigest(),
+        'sha256': hashlib.sha256(body).hexdigest(),
+    }
+
+
+def test_download_hashes_a_resumed_file_from_the_start(http_server):
+    body = os.urandom(100000)
+    http_server.files['a.zip'] = body
+
+    with open('a.zip.part', 'wb') as fd:
+        fd.write(body[:30000])
+
+    result = download.download(
+        http_server.base_uri + 'a.zip',
+        'a.zip',
+        checksums={'md5': hashlib.md5(body).hexdigest()},
+    )
+
+    assert result.resumed is True
+    assert result.checksums['md5'] == hashlib.md5(body).hexdigest()
+
+
+def test_download_with_a_checksum_mismatch_discards_the_transfer(
+    http_server
+):
+    http_server.files['a.zip'] = b'tampered'
+
+    with open('a.zip', 'wb') as fd:
+        fd.write(b'previous release')
+
+    with pytest.raises(ValueError) as exp:
+        download.download(
+            http_server.base_uri + 'a.zip',
+            'a.zip',
+            checksums={'md5': hashlib.md5(b'original').hexdigest()},
+        )
+
+    assert 'MD5 checksum mismatch' in str(exp.value)
+    assert not os.path.exists('a.zip.part')
+
+    with open('a.zip', 'rb') as fd:
+        assert fd.read() == b'previous release'
@@ -0,0 +1,118 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import extsort
+from ipcrawl.extsort import ExternalSorter
+from ipcrawl.extsort import external_sort
+from ipcrawl.utils import int_to_ip
+from ipcrawl.utils import ips_to_array
+
+import io
+import os
+import pytest
+import random
+
+
+def addresses(seed, count, distinct=5000):
+    rnd = random.Random(seed)
+    pool = [rnd.getrandbits(32) for _ in range(distinct)]
+    return [rnd.choice(pool) for _ in range(count)]
+
+
+def test_run_round_trip():
+    values = ips_to_array(['1.2.3.4', '10.0.0.1', '255.255.255.255'])
+    fd = io.BytesIO()
+
+    extsort.write_run(fd, values)
+    fd.seek(0)
+
+    assert len(fd.getvalue()) == 12
+    assert list(extsort.read_run(fd, read_size=6)) == values.tolist()
+
+
+@pytest.mark.parametrize('unique', [True, False])
+def test_spilled_runs_merge_in_order(tmpdir, unique):
+    values = addresses(0, 20000)
+    memory = 1000 * extsort.BYTES_PER_ADDRESS
+
+    with ExternalSorter(
+        memory=memory, directory=str(tmpdir), unique=unique,
+    ) as sorter:
+        sorter.update(iter(values))
+        sorter.add('0.0.0.1')
+
+        assert len(sorter.runs) == 20
+        assert len(sorter.buffer) == 1
+
+        expected = sorted(set(values) if unique else values)
+        assert list(sorter.ints()) == [1] + expected
+        assert list(sorter)[1] == int_to_ip(expected[0])
+
+    assert os.listdir(str(tmpdir)) == []
+
+
+@pytest.mark.parametrize('unique', [True, False])
+def test_runs_are_merged_fan_in_at_a_time(tmpdir, monkeypatch, unique):
+    values = addresses(2, 20000)
+    memory = 1000 * extsort.BYTES_PER_ADDRESS
+    opened = set()
+    most = []
+
+    class Tracked(io.FileIO):
+        def __init__(self, *args, **kwargs):
+            super(Tracked, self).__init__(*args, **kwargs)
+            opened.add(self)
+            most.append(len(opened))
+
+        def close(self):
+            opened.discard(self)
+            super(Tracked, self).close()
+
+    monkeypatch.setattr(extsort, 'open', Tracked, raising=False)
+
+    with ExternalSorter(
+        memory=memory, directory=str(tmpdir), unique=unique, fan_in=3,
+    ) as sorter:
+        sorter.update(values)
+
+        assert len(sorter.runs) == 20
+        assert list(sorter.ints()) == sorted(set(values) if unique else values)
+        assert len(sorter.runs) == 3
+        assert len(os.listdir(sorter.tmpdir)) == 3
+
+    # the runs merged plus the one written
+    assert max(most) == 4
+    assert not opened
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_fan_in_must_merge_something():
+    with pytest.raises(ValueError):
+        ExternalSorter(fan_in=1)
+
+
+def test_nothing_is_spilled_under_the_memory_cap(tmpdir):
+    with ExternalSorter(directory=str(tmpdir)) as sorter:
+        sorter.update(['10.0.0.2', '9.9.9.9', '10.0.0.2'])
+
+        assert list(sorter) == ['9.9.9.9', '10.0.0.2']
+        assert sorter.runs == []
+
+
+def test_external_sort_removes_its_runs(tmpdir):
+    values = addresses(1, 5000)
+
+    actual = external_sort(
+        values,
+        memory=100 * extsort.BYTES_PER_ADDRESS,
+        directory=str(tmpdir),
+        as_int=True,
+    )
+
+    assert next(actual) == min(values)
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    assert [min(values)] + list(actual) == sorted(set(values))
+    assert os.listdir(str(tmpdir)) == []
@@ -0,0 +1,98 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import follow
+from ipcrawl.follow import Tail
+
+import json
+import os
+
+
+def ips(hits):
+    return [(hit.line, hit.ip) for hit in hits]
+
+
+def test_only_appended_lines_are_lexed(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('up 10.0.0.1\n')
+
+    with Tail(str(log)) as tail:
+        assert ips(tail.poll()) == [(1, '10.0.0.1')]
+        assert ips(tail.poll()) == []
+
+        log.write('from 10.0.0.2\nto 8.8', mode='a')
+        assert ips(tail.poll()) == [(2, '10.0.0.2')]
+
+        log.write('.8.8\n', mode='a')
+        assert ips(tail.poll()) == [(3, '8.8.8.8')]
+        assert tail.state['offset'] == log.size()
+
+
+def test_resumes_from_the_checkpoint(tmpdir):
+    log = tmpdir.join('app.log')
+    checkpoint = tmpdir.join('app.log.checkpoint')
+    log.write('up 10.0.0.1\nfrom 10.0.0.2\n')
+
+    with Tail(str(log), checkpoint=str(checkpoint)) as tail:
+        assert len(list(tail.poll())) == 2
+
+    assert json.loads(checkpoint.read())['lineno'] == 3
+
+    log.write('then 10.0.0.3\n', mode='a')
+
+    with Tail(str(log), checkpoint=str(checkpoint)) as tail:
+        assert ips(tail.poll()) == [(3, '10.0.0.3')]
+
+
+def test_truncated_logs_are_read_from_the_start(tmpdir):
+    log = tmpdir.join('app.log')
+    checkpoint = tmpdir.join('app.log.checkpoint')
+    log.write('up 10.0.0.1\nfrom 10.0.0.2\n')
+
+    with Tail(str(log)) as tail:
+        list(tail.poll())
+        log.write('to 9.9.9.9\n')
+        assert ips(tail.poll()) == [(1, '9.9.9.9')]
+
+    with Tail(str(log), checkpoint=str(checkpoint)) as tail:
+        list(tail.poll())
+
+    # copied and truncated, then grown past the offset between runs
+    log.write('at 1.1.1.1\nand more lines than before\n')
+
+    with Tail(str(log), checkpoint=str(checkpoint)) as tail:
+        assert ips(tail.poll()) == [(1, '1.1.1.1')]
+
+
+def test_rotation_drains_the_old_log_first(tmpdir):
+    log = tmpdir.join('app.log')
+    log.write('up 10.0.0.1\n')
+
+    with Tail(str(log)) as tail:
+        list(tail.poll())
+
+        log.write('from 10.0.0.2', mode='a')
+        os.rename(str(log), str(tmpdir.join('app.log.1')))
+        assert ips(tail.poll()) == [(2, '10.0.0.2')]
+        assert ips(tail.poll()) == []
+
+        log.write('to 9.9.9.9\n')
+        assert ips(tail.poll()) == [(1, '9.9.9.9')]
+
+
+def test_follow_polls_until_closed(tmpdir, monkeypatch):
+    log = tmpdir.join('app.log')
+    log.write('up 10.0.0.1\n')
+    lines = iter(['from 10.0.0.2\n', 'to 9.9.9.9\n'])
+
+    monkeypatch.setattr(
+        follow.time, 'sleep', lambda _: log.write(next(lines), mode='a'),
+    )
+    hits = follow.follow(str(log), interval=0)
+
+    assert [next(hits).ip for _ in range(3)] == [
+        '10.0.0.1', '10.0.0.2', '9.9.9.9',
+    ]
+    hits.close()
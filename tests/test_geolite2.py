@@ -0,0 +1,220 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import geolite2
+from ipcrawl import progress
+from ipcrawl.database import models
+from ipcrawl.database import sqlite3
+
+import io
+import json
+import os
+import pytest
+import zipfile
+
+
+ASN_CSV = (
+    'network,autonomous_system_number,autonomous_system_organization\r\n'
+    '1.0.0.0/24,13335,CLOUDFLARENET\r\n'
+    '1.0.4.0/22,56203,"Gtelecom, AUSTRALIA"\r\n'
+)
+
+CITY_CSV = (
+    'network,geoname_id,registered_country_geoname_id,'
+    'represented_country_geoname_id,is_anonymous_proxy,'
+    'is_satellite_provider,postal_code,latitude,longitude,accuracy_radius\r\n'
+    '1.0.0.0/24,2077456,2077456,,0,0,,-33.4940,143.2104,1000\r\n'
+)
+
+
+@pytest.fixture
+def geolite2_archives(tmpdir):
+    """Create minimal GeoLite2 archives laid out like the MaxMind ones
+
+    """
+    tmpdir.chdir()
+    directory = tmpdir.mkdir('geolite2')
+
+    def write_archive(edition, members):
+        archive = os.path.join(str(directory), geolite2.ARCHIVES[edition])
+        prefix = geolite2.ARCHIVES[edition].replace('.zip', '_20190618')
+
+        with zipfile.ZipFile(archive, 'w') as zipf:
+            for name, content in members.items():
+                zipf.writestr('{}/{}'.format(prefix, name), content)
+
+        return archive
+
+    write_archive('asn', {
+        'GeoLite2-ASN-Blocks-IPv4.csv': ASN_CSV,
+        'COPYRIGHT.txt': 'copyright',
+    })
+    write_archive('city', {
+        'GeoLite2-City-Blocks-IPv4.csv': CITY_CSV,
+        'GeoLite2-City-Locations-en.csv': 'geoname_id\r\n',
+    })
+
+    sqlite3.Session = sqlite3.sessionmaker()
+    return str(directory)
+
+
+def test_open_csv_streams_the_member_out_of_the_archive(geolite2_archives):
+    with geolite2.open_csv(
+        'asn', 'GeoLite2-ASN-Blocks-IPv4.csv', directory=geolite2_archives
+    ) as fd:
+        content = fd.read()
+
+    assert content == ASN_CSV
+    assert sorted(os.listdir(geolite2_archives)) == [
+        'GeoLite2-ASN-CSV.zip',
+        'GeoLite2-City-CSV.zip',
+    ]
+
+
+def test_open_csv_when_the_member_does_not_exist(geolite2_archives):
+    with pytest.raises(IOError) as exp:
+        with geolite2.open_csv('asn', 'nope.csv', directory=geolite2_archives):
+            pass
+
+    assert 'nope.csv is not a member of' in str(exp.value)
+
+
+def test_open_csv_falls_back_to_an_extracted_file(tmpdir):
+    tmpdir.mkdir('asn').join('GeoLite2-ASN-Blocks-IPv4.csv').write(ASN_CSV)
+
+    with geolite2.open_csv(
+        'asn', 'GeoLite2-ASN-Blocks-IPv4.csv', directory=str(tmpdir)
+    ) as fd:
+        content = fd.read()
+
+    assert content == ASN_CSV
+
+
+def test_extract_members_only_extracts_the_whitelist(
+    geolite2_archives, tmpdir
+):
+    archive = os.path.join(geolite2_archives, 'GeoLite2-ASN-CSV.zip')
+    directory = os.path.join(str(tmpdir), 'asn')
+
+    extracted = geolite2.extract_members(
+        archive,
+        directory,
+        whitelist=['GeoLite2-ASN-Blocks-IPv4.csv', 'LICENSE.txt'],
+    )
+
+    assert extracted == [
+        os.path.join(directory, 'GeoLite2-ASN-Blocks-IPv4.csv'),
+    ]
+    assert os.listdir(directory) == ['GeoLite2-ASN-Blocks-IPv4.csv']
+
+
+def test_populate_loads_every_block_csv_from_the_archives(geolite2_archives):
+    engine = sqlite3.init_engine(filename='test.sqlite3')
+
+    loaded = geolite2.populate(directory=geolite2_archives, engine=engine)
+
+    with sqlite3.session_scope() as session:
+        asn = session.query(models.GeoLite2AsnBlocksIpv4).order_by(
+            models.GeoLite2AsnBlocksIpv4.id
+        ).all()
+        city = session.query(models.GeoLite2CityBlocksIpv4).all()
+
+        assert loaded == {
+            'geolite2_city_blocks_ipv4': 1,
+            'geolite2_asn_blocks_ipv4': 2,
+        }
+        assert [a.autonomous_system_organization for a in asn] == [
+            'CLOUDFLARENET',
+            'Gtelecom, AUSTRALIA',
+        ]
+        assert city[0].latitude == -33.494
+
+
+def test_failed_populate_keeps_the_earlier_release(geolite2_archives):
+    engine = sqlite3.init_engine(filename='test.sqlite3')
+    geolite2.populate(directory=geolite2_archives, engine=engine)
+    indexes = sqlite3._existing_indexes(engine)
+    release = sqlite3.get_metadata(engine, sqlite3.RELEASE_KEY)
+
+    # the city CSV loads, then the ASN archive is missing
+    os.remove(os.path.join(geolite2_archives, geolite2.ARCHIVES['asn']))
+
+    with pytest.raises(IOError):
+        geolite2.populate(directory=geolite2_archives, engine=engine)
+
+    with sqlite3.session_scope() as session:
+        assert session.query(models.GeoLite2AsnBlocksIpv4).count() == 2
+        assert session.query(models.GeoLite2CityBlocksIpv4).count() == 1
+
+    assert sqlite3._existing_indexes(engine) == indexes
+    assert sqlite3.get_metadata(engine, sqlite3.RELEASE_KEY) == release
+
+
+def test_release_identifies_the_loaded_data(geolite2_archives, tmpdir):
+    engine = sqlite3.init_engine(filename='test.sqlite3')
+    release = geolite2.release(geolite2_archives)
+
+    assert release.startswith('GeoLite2-City-CSV_20190618:')
+    assert 'GeoLite2-ASN-CSV_20190618:' in release
+
+    geolite2.populate(directory=geolite2_archives, engine=engine)
+    assert sqlite3.get_metadata(engine, sqlite3.RELEASE_KEY) == release
+
+    # a newer release of the same edition, or the same CSVs extracted
+    directory = tmpdir.join('extracted')
+    for edition, name, _ in geolite2.BLOCKS:
+        geolite2.extract_members(
+            os.path.join(geolite2_archives, geolite2.ARCHIVES[edition]),
+            str(directory.join(edition)),
+            [name],
+        )
+
+    assert geolite2.release(str(directory)) not in ('', release)
+
+
+def test_csv_size_is_the_uncompressed_size(geolite2_archives, tmpdir):
+    assert geolite2.csv_size(
+        'asn', 'GeoLite2-ASN-Blocks-IPv4.csv', directory=geolite2_archives,
+    ) == len(ASN_CSV)
+    assert geolite2.csv_size(
+        'asn', 'nope.csv', directory=geolite2_archives,
+    ) is None
+    assert geolite2.csv_size(
+        'country', 'GeoLite2-Country-Blocks-IPv4.csv',
+        directory=geolite2_archives,
+    ) is None
+
+
+def test_populate_reports_progress(geolite2_archives):
+    stream = io.StringIO()
+    reporter = progress.Progress(every=1, format='json', stream=stream)
+
+    geolite2.populate(directory=geolite2_archives, progress=reporter)
+    reports = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    assert [(r['label'], r['rows'], r['done']) for r in reports] == [
+        ('geolite2_city_blocks_ipv4', 1, False),
+        ('geolite2_city_blocks_ipv4', 1, True),
+        ('geolite2_asn_blocks_ipv4', 1, False),
+        ('geolite2_asn_blocks_ipv4', 2, False),
+        ('geolite2_asn_blocks_ipv4', 2, True),
+    ]
+    assert reports[-1]['bytes'] == reports[-1]['total_bytes'] == len(ASN_CSV)
+
+
+def test_populate_replaces_the_rows_of_an_earlier_load(geolite2_archives):
+    engine = sqlite3.init_engine(filename='test.sqlite3')
+
+    geolite2.populate(directory=geolite2_archives, engine=engine)
+    loaded = geolite2.populate(directory=geolite2_archives, engine=engine)
+
+    with sqlite3.session_scope() as session:
+        assert session.query(models.GeoLite2AsnBlocksIpv4).count() == 2
+        assert session.query(models.GeoLite2CityBlocksIpv4).count() == 1
+
+    assert loaded == {
+        'geolite2_city_blocks_ipv4': 1,
+        'geolite2_asn_blocks_ipv4': 2,
+    }
@@ -0,0 +1,176 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import ipset
+from ipcrawl.ipset import IPv4Set
+from ipcrawl.utils import int_to_ip
+
+import io
+import pytest
+import random
+import tracemalloc
+
+
+def addresses(seed, count, dense=0):
+    """``count`` random addresses plus ``dense`` ones packed in one /16
+
+    More than :data:`ipcrawl.ipset.ARRAY_MAX` ``dense`` addresses make a
+    bitmap container.
+
+    """
+    rnd = random.Random(seed)
+    values = [rnd.getrandbits(32) for _ in range(count)]
+    values += [(10 << 24) + rnd.getrandbits(16) for _ in range(dense)]
+    return values
+
+
+@pytest.fixture(params=[0, 20000], ids=['arrays', 'bitmaps'])
+def pair(request):
+    left = addresses(1, 3000, dense=request.param)
+    right = left[::3] + addresses(2, 3000, dense=request.param)
+    return left, right
+
+
+def test_add_and_contains():
+    ips = IPv4Set(['10.0.0.2'])
+    ips.add('10.0.0.1')
+    ips.add(167772161)
+    ips.add('255.255.255.255')
+
+    assert len(ips) == 3
+    assert '10.0.0.1' in ips
+    assert 167772162 in ips
+    assert '10.0.0.3' not in ips
+    assert 'not an address' not in ips
+    assert list(ips) == ['10.0.0.1', '10.0.0.2', '255.255.255.255']
+
+
+def test_add_switches_to_a_bitmap():
+    ips = IPv4Set()
+
+    for low in range(ipset.ARRAY_MAX + 1):
+        ips.add((10 << 24) + low * 2)
+
+    assert isinstance(ips.containers[10 << 8], bytearray)
+    assert ips.nbytes == ipset.BITMAP_SIZE
+    assert len(ips) == ipset.ARRAY_MAX + 1
+    assert IPv4Set(ips.ints()) == ips
+
+
+@pytest.mark.parametrize('ip', ['10.0.0.256', -1, 1 << 32])
+def test_invalid_addresses(ip):
+    with pytest.raises(ValueError):
+        IPv4Set([ip])
+
+    with pytest.raises(ValueError):
+        IPv4Set().add(ip)
+
+
+def test_iteration_is_ordered_and_unique(pair):
+    left, _ = pair
+    ips = IPv4Set(left)
+
+    assert list(ips.ints()) == sorted(set(left))
+    assert len(ips) == len(set(left))
+    assert next(iter(ips)) == int_to_ip(min(left))
+
+
+def test_set_operations_match_python_sets(pair):
+    left, right = pair
+    a, b = IPv4Set(left), IPv4Set(right)
+
+    assert list((a | b).ints()) == sorted(set(left) | set(right))
+    assert list((a & b).ints()) == sorted(set(left) & set(right))
+    assert list((a - b).ints()) == sorted(set(left) - set(right))
+    assert list((b - a).ints()) == sorted(set(right) - set(left))
+
+
+def test_operations_keep_containers_canonical(pair):
+    left, right = pair
+    a, b = IPv4Set(left), IPv4Set(right)
+
+    for result in (a | b, a & b, a - b):
+        assert result == IPv4Set(result.ints())
+
+
+def test_operations_leave_their_operands_alone(pair):
+    left, right = pair
+    a, b = IPv4Set(left), IPv4Set(right)
+
+    union = a | b
+    union.add('1.2.3.4')
+    union.update(right)
+
+    assert a == IPv4Set(left)
+    assert b == IPv4Set(right)
+
+
+def test_update_merges_into_existing_containers(pair):
+    left, right = pair
+    ips = IPv4Set(left)
+    ips.update(right)
+
+    assert ips == IPv4Set(left + right)
+
+
+@pytest.mark.parametrize('batch_size', [1, 100, 5000])
+def test_update_in_batches(pair, batch_size):
+    left, right = pair
+    ips = IPv4Set()
+    ips.update(left + right, batch_size=batch_size)
+
+    assert list(ips.ints()) == sorted(set(left + right))
+    assert ips == IPv4Set(ips.ints())
+
+
+def test_update_holds_less_than_a_python_set():
+    def generate():
+        # a /10 crawled address by address, one batch is held at a time
+        rnd = random.Random(3)
+        return (
+            int_to_ip((10 << 24) + rnd.getrandbits(22))
+            for _ in range(200000)
+        )
+
+    def peak(build):
+        tracemalloc.start()
+
+        try:
+            result = build(generate())
+            return tracemalloc.get_traced_memory()[1], len(result)
+        finally:
+            tracemalloc.stop()
+
+    ipset_peak, count = peak(IPv4Set)
+    set_peak, _ = peak(set)
+
+    assert count > 190000
+    assert ipset_peak < set_peak
+
+
+def test_serialization_round_trip(pair):
+    left, _ = pair
+    ips = IPv4Set(left)
+    fd = io.BytesIO()
+
+    ips.dump(fd)
+    fd.seek(0)
+
+    assert IPv4Set.load(fd) == ips
+    assert IPv4Set.from_bytes(IPv4Set().to_bytes()) == IPv4Set()
+
+
+@pytest.mark.parametrize(
+    'data',
+    [
+        b'',
+        b'IPCR\x01\x00\x00\x00\x00',
+        b'IPS4\x02\x00\x00\x00\x00',
+        IPv4Set(['10.0.0.1', '10.0.0.2']).to_bytes()[:-1],
+    ]
+)
+def test_from_bytes_given_invalid_data(data):
+    with pytest.raises(ValueError):
+        IPv4Set.from_bytes(data)
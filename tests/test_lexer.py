@@ -3,8 +3,11 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from ipcrawl.lexer import iter_tokens
+
 from tests.conftest import PROJECT_ROOT_DIR
 
+import io
 import os
 import pytest
 
@@ -118,3 +121,25 @@ class Test_CrawlLexer(object):
 
         result = lexer_input(content)
         assert len(result) == 5000
+
+
+class Test_iter_tokens(object):
+
+    def test_matches_lexing_the_whole_file(self, lexer_input):
+        parse_filename = os.path.join(PROJECT_ROOT_DIR, 'data', 'parse.data')
+
+        with open(parse_filename, mode='r') as fd:
+            expected = [t.value for t in lexer_input(fd.read())]
+
+        with open(parse_filename, mode='r') as fd:
+            actual = [t.value for t in iter_tokens(fd, chunk_size=1000)]
+
+        assert actual == expected
+
+    def test_errors_count_lines_from_the_start_of_the_file(self):
+        fd = io.StringIO('1.2.3.4\n' * 10 + 'foo @\n')
+
+        with pytest.raises(ValueError) as exp:
+            list(iter_tokens(fd, chunk_size=16))
+
+        assert "line: '11'" in str(exp.value)
@@ -0,0 +1,87 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import progress
+
+import io
+import json
+import pytest
+
+
+@pytest.fixture
+def csv_fd():
+    content = 'network\n' + '1.0.0.0/24\n' * 1000
+    return io.TextIOWrapper(io.BytesIO(content.encode('utf-8')))
+
+
+def test_current_rss():
+    assert progress.current_rss() > 0
+
+
+def test_reports_label_the_peak_rss_without_proc(csv_fd, monkeypatch):
+    monkeypatch.setattr(progress, 'current_rss', lambda: None)
+    stream = io.StringIO()
+    reporter = progress.Progress(every=10, stream=stream)
+    reporter.start('asn', fd=csv_fd)
+
+    sample = reporter.report(10)
+
+    assert sample['rss'] is None
+    assert sample['peak_rss'] > 0
+    assert ', peak RSS ' in stream.getvalue()
+
+
+def test_text_reports(csv_fd):
+    stream = io.StringIO()
+    reporter = progress.Progress(every=10, stream=stream)
+    reporter.start('asn', fd=csv_fd, total=11008)
+
+    csv_fd.read(10)
+    reporter.report(10)
+    reporter.finish(1000)
+
+    running, done = stream.getvalue().splitlines()
+
+    assert running.startswith('asn: 10 rows, ')
+    assert ' rows/s, ' in running
+    assert ' of 0.0 MB (' in running
+    assert 'ETA ' in running
+    assert 'RSS ' in running
+    assert done.startswith('asn: 1,000 rows, ')
+    assert '(100.0%), done in 0:00:00' in done
+
+
+def test_json_reports(csv_fd):
+    stream = io.StringIO()
+    reporter = progress.Progress(format='json', stream=stream)
+    reporter.start('asn', fd=csv_fd, total=11008)
+
+    csv_fd.read(10)
+    sample = reporter.report(10)
+
+    assert json.loads(stream.getvalue()) == sample
+    assert 0 < sample['bytes'] <= sample['total_bytes'] == 11008
+    assert 0 < sample['percent'] <= 100
+    assert sample['eta'] >= 0
+    assert sample['done'] is False
+
+
+def test_reports_without_a_file_or_total():
+    stream = io.StringIO()
+    reporter = progress.Progress(stream=stream)
+    reporter.start('asn')
+
+    sample = reporter.report(5)
+
+    assert sample['bytes'] is None
+    assert sample['eta'] is None
+    assert 'ETA' not in stream.getvalue()
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError) as exp:
+        progress.Progress(format='xml')
+
+    assert 'Unknown progress format' in str(exp.value)
@@ -0,0 +1,140 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import geolite2
+from ipcrawl import synthetic
+from ipcrawl.database import lookup
+from ipcrawl.database import sqlite3
+from ipcrawl.lexer import create_lexer
+
+import csv
+import io
+import pytest
+
+
+@pytest.mark.parametrize('count', [1, 10, 1000, 50000])
+def test_iter_networks_are_sorted_aligned_and_do_not_overlap(count):
+    networks = list(synthetic.iter_networks(seed=1, count=count))
+
+    assert len(networks) == count
+
+    end = synthetic.FIRST_ADDRESS
+    for start, prefixlen in networks:
+        size = 1 << (32 - prefixlen)
+
+        assert start % size == 0
+        assert start >= end
+        end = start + size
+
+    assert end - 1 <= synthetic.LAST_ADDRESS
+
+
+def test_iter_networks_spread_over_the_address_space():
+    networks = list(synthetic.iter_networks(count=1000))
+
+    assert networks[-1][0] > synthetic.LAST_ADDRESS * 0.9
+
+
+def test_the_same_seed_generates_the_same_data():
+    assert list(synthetic.iter_networks(seed=7, count=100)) \
+        == list(synthetic.iter_networks(seed=7, count=100))
+    assert list(synthetic.iter_networks(seed=7, count=100)) \
+        != list(synthetic.iter_networks(seed=8, count=100))
+
+    first, second = io.StringIO(), io.StringIO()
+    synthetic.write_text(first, 10000, seed=7)
+    synthetic.write_text(second, 10000, seed=7)
+
+    assert first.getvalue() == second.getvalue()
+
+
+def test_generate_locations():
+    countries, cities = synthetic.generate_locations(countries=10, cities=50)
+    country_codes = {row[4] for row in countries}
+
+    assert len(country_codes) == 10
+    assert len({row[0] for row in cities}) == 50
+    assert all(len(row) == len(synthetic.COUNTRY_LOCATIONS_HEADER)
+               for row in countries)
+    assert all(len(row) == len(synthetic.CITY_LOCATIONS_HEADER)
+               for row in cities)
+    assert {row[4] for row in cities} <= country_codes
+
+
+def test_iter_blocks_are_consistent_across_editions():
+    countries, cities = synthetic.generate_locations()
+    city_countries = {row[0]: row[4] for row in cities}
+    country_ids = {row[4]: row[0] for row in countries}
+
+    for asn, city, country in synthetic.iter_blocks(networks=200):
+        assert asn[0] == city[0] == country[0]
+        assert country[1] == country_ids[city_countries[city[1]]]
+        assert len(city) == len(synthetic.CITY_BLOCKS_HEADER)
+
+
+@pytest.mark.parametrize('style', synthetic.STYLES)
+def test_write_text_embeds_addresses_at_the_requested_density(style):
+    fd = io.StringIO()
+    written = synthetic.write_text(fd, 200000, density=0.1, style=style)
+    text = fd.getvalue()
+    words = sum(len(line.split('\t')[-1].split()) for line in
+                text.splitlines())
+    ips = create_lexer(text)
+
+    assert written == len(text) >= 200000
+    assert text.endswith('\n')
+    assert 0.08 < len(ips) / words < 0.12
+
+
+def test_write_text_skew_concentrates_on_fewer_addresses():
+    def distinct(skew):
+        fd = io.StringIO()
+        synthetic.write_text(fd, 100000, skew=skew, density=0.2)
+        return len({t.value for t in create_lexer(fd.getvalue())})
+
+    assert distinct(2.0) < distinct(0.0) / 4
+
+
+def test_write_text_with_an_unknown_style():
+    with pytest.raises(ValueError) as exp:
+        synthetic.write_text(io.StringIO(), 10, style='html')
+
+    assert 'Unknown style' in str(exp.value)
+
+
+@pytest.mark.parametrize('archive', [True, False])
+def test_generate_geolite2_can_be_populated(tmpdir, archive):
+    tmpdir.chdir()
+    directory = str(tmpdir.join('synthetic'))
+
+    written = synthetic.generate_geolite2(
+        directory, networks=500, countries=5, cities=20, archive=archive,
+    )
+
+    with geolite2.open_csv(
+        'country', 'GeoLite2-Country-Blocks-IPv4.csv', directory=directory,
+    ) as fd:
+        rows = list(csv.reader(fd))
+
+    assert written['GeoLite2-City-Locations-en.csv'] == 20
+    assert rows[0] == list(synthetic.COUNTRY_BLOCKS_HEADER)
+    assert len(rows) == 501
+
+    sqlite3.Session = sqlite3.sessionmaker()
+    engine = sqlite3.init_engine(filename='test.sqlite3')
+    loaded = geolite2.populate(directory=directory, engine=engine)
+
+    assert loaded == {
+        'geolite2_asn_blocks_ipv4': 500,
+        'geolite2_city_blocks_ipv4': 500,
+    }
+
+    pool = synthetic.address_pool(size=50, networks=500)
+    with lookup.LookupContext(engine=engine) as ctx:
+        assert all(
+            record is not None
+            for ip in pool
+            for record in ctx.lookup_all(ip).values()
+        )
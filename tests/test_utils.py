@@ -3,11 +3,34 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from ipcrawl.lexer import create_lexer
+from ipcrawl.utils import array_to_ips
+from ipcrawl.utils import get_json_backend
+from ipcrawl.utils import int_to_ip
+from ipcrawl.utils import ip_to_int
+from ipcrawl.utils import ips_to_array
+from ipcrawl.utils import Metrics
+from ipcrawl.utils import metrics
+from ipcrawl.utils import NULL_TIMER
+from ipcrawl.utils import network_range
+from ipcrawl.utils import open_text
+from ipcrawl.utils import peak_rss
+from ipcrawl.utils import profile
 from ipcrawl.utils import read_json
+from ipcrawl.utils import sort_ints
+from ipcrawl.utils import sort_ips
+from ipcrawl.utils import StatsdSink
 from ipcrawl.utils import to_json
+from ipcrawl.utils import to_json_compact
 
+import bz2
+import gzip
 import json
+import lzma
 import os
+import pstats
+import pytest
+import socket
 
 
 def test_read_json_given_a_file_that_contains_valid_json(tmpdir):
@@ -26,6 +49,22 @@ def test_read_json_given_a_file_that_contains_valid_json(tmpdir):
     assert actual == data
 
 
+@pytest.mark.parametrize('module', [None, gzip, bz2, lzma])
+def test_open_text_decompresses_by_magic_bytes(tmpdir, module):
+    text = 'seen 10.0.0.1\nthen 9.9.9.9 \u00e9\n' * 1000
+    compress = module.compress if module else bytes
+
+    # the extension says nothing about the compression
+    tmpdir.join('crawl.log').write_binary(compress(text.encode('utf-8')))
+    tmpdir.join('foo.json').write_binary(compress(b'{"name": "foo"}'))
+
+    with open_text(str(tmpdir.join('crawl.log'))) as fd:
+        assert fd.readline() == 'seen 10.0.0.1\n'
+        assert fd.read() == text[14:]
+
+    assert read_json(str(tmpdir.join('foo.json'))) == {'name': 'foo'}
+
+
 def test_to_json_can_read_a_properly_formatted_json_file(tmpdir):
     tmpdir.chdir()
     data = dict(name='foo', age=2)
@@ -35,3 +74,232 @@ def test_to_json_can_read_a_properly_formatted_json_file(tmpdir):
         data, indent=2, sort_keys=True, ensure_ascii=False,
         separators=(',', ': ')
     )
+
+
+@pytest.mark.parametrize(
+    'ip, expected',
+    [
+        ('0.0.0.0', 0),
+        ('1.0.0.0', 16777216),
+        ('255.255.255.255', 4294967295),
+    ]
+)
+def test_ip_to_int(ip, expected):
+    assert ip_to_int(ip) == expected
+    assert int_to_ip(expected) == ip
+
+
+@pytest.mark.parametrize(
+    'network, expected',
+    [
+        ('1.0.0.0/24', (16777216, 16777471)),
+        ('1.0.0.1/24', (16777216, 16777471)),
+        ('5.145.149.142/32', (93427086, 93427086)),
+        ('5.145.149.142', (93427086, 93427086)),
+        ('0.0.0.0/0', (0, 4294967295)),
+    ]
+)
+def test_network_range(network, expected):
+    assert network_range(network) == expected
+
+
+UNSORTED_IPS = ['10.0.0.2', '9.9.9.9', '255.255.255.255', '0.0.0.0', '9.9.9.9']
+
+
+def test_ips_to_array_round_trip():
+    values = ips_to_array(UNSORTED_IPS)
+
+    assert values.itemsize == 4
+    assert values.tolist() == [ip_to_int(ip) for ip in UNSORTED_IPS]
+    assert ips_to_array(values.tolist()) == values
+    assert array_to_ips(values) == UNSORTED_IPS
+    # the caller's array is left as is
+    assert values.tolist() == [ip_to_int(ip) for ip in UNSORTED_IPS]
+
+
+@pytest.mark.parametrize('numpy', [False, True])
+class Test_sort_ips(object):
+
+    @pytest.fixture(autouse=True)
+    def numpy_installed(self, numpy):
+        if numpy:
+            pytest.importorskip('numpy')
+
+    def test_strings(self, numpy):
+        assert sort_ips(UNSORTED_IPS, numpy=numpy) == [
+            '0.0.0.0', '9.9.9.9', '9.9.9.9', '10.0.0.2', '255.255.255.255',
+        ]
+
+    def test_unique_as_int(self, numpy):
+        assert sort_ips(
+            iter(UNSORTED_IPS), as_int=True, unique=True, numpy=numpy,
+        ) == [0, 151587081, 167772162, 4294967295]
+
+    def test_ints_as_strings(self, numpy):
+        ints = [ip_to_int(ip) for ip in UNSORTED_IPS]
+
+        assert sort_ips(ints, unique=True, numpy=numpy) == [
+            '0.0.0.0', '9.9.9.9', '10.0.0.2', '255.255.255.255',
+        ]
+
+    def test_sort_ints(self, numpy):
+        values = sort_ints(ips_to_array(UNSORTED_IPS), numpy=numpy)
+
+        assert values.typecode == ips_to_array([]).typecode
+        assert array_to_ips(values) == sort_ips(UNSORTED_IPS, numpy=False)
+
+    def test_empty(self, numpy):
+        assert sort_ips([], numpy=numpy) == []
+        assert sort_ips([], as_int=True, numpy=numpy) == []
+
+    @pytest.mark.parametrize('as_int', [False, True])
+    @pytest.mark.parametrize('ips, culprit', [
+        (['9.9.9.9', '10.0.0.2', 167772162], "167772162 at index 2"),
+        ([167772162, '9.9.9.9'], "'9.9.9.9' at index 1"),
+    ])
+    def test_mixed_types(self, numpy, as_int, ips, culprit):
+        with pytest.raises(ValueError, match=culprit):
+            sort_ips(ips, as_int=as_int, numpy=numpy)
+
+
+@pytest.mark.parametrize('backend', ['orjson', 'ujson', 'json'])
+def test_to_json_compact_given_each_backend(backend):
+    pytest.importorskip(backend)
+    data = {'ip': '1.0.0.1', 'asn': [{'org': 'Akamai ☃ a/b', 'n': 1.5}]}
+
+    actual = to_json_compact(data, backend=backend)
+
+    assert json.loads(actual) == data
+    assert ' ' not in actual.replace('Akamai ☃ a/b', '')
+    assert '☃' in actual
+    assert 'a/b' in actual
+
+
+def test_to_json_compact_falls_back_to_stdlib_for_unsupported_data():
+    assert to_json_compact({1: 'one'}) == '{"1":"one"}'
+
+
+def test_get_json_backend_prefers_the_first_installed_backend():
+    name, dumps = get_json_backend()
+    installed = [b for b in ('orjson', 'ujson', 'json') if _importable(b)]
+
+    assert name == installed[0]
+    assert dumps({'a': 1}) == '{"a":1}'
+
+
+def test_get_json_backend_given_a_backend_that_is_not_installed():
+    with pytest.raises(ImportError):
+        get_json_backend('not_a_json_backend')
+
+
+def _importable(name):
+    try:
+        __import__(name)
+    except ImportError:
+        return False
+    return True
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.reset()
+    metrics.enable()
+    yield metrics
+    metrics.disable()
+    metrics.reset()
+
+
+class Test_Metrics(object):
+
+    def test_nothing_is_recorded_while_disabled(self):
+        m = Metrics()
+
+        with m.timer('stage') as timer:
+            m.incr('count')
+            m.gauge('size', 10)
+
+        assert timer is NULL_TIMER
+        assert m.summary() == {'counters': {}, 'gauges': {}, 'timers': {}}
+
+    def test_summary(self):
+        m = Metrics()
+        m.enable()
+
+        for seconds in (0.1, 0.3):
+            m.timing('stage', seconds)
+
+        m.incr('count')
+        m.incr('count', 2)
+        m.gauge('size', 10)
+        m.gauge('size', 20)
+
+        with m.timer('block'):
+            pass
+
+        summary = m.summary()
+
+        assert summary['counters'] == {'count': 3}
+        assert summary['gauges'] == {'size': 20}
+        assert summary['timers']['stage'] == {
+            'count': 2,
+            'total': pytest.approx(0.4),
+            'mean': pytest.approx(0.2),
+            'min': 0.1,
+            'max': 0.3,
+        }
+        assert summary['timers']['block']['count'] == 1
+
+    def test_events_are_sent_to_a_statsd_server(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        address = '127.0.0.1:{}'.format(server.getsockname()[1])
+
+        m = Metrics()
+        m.enable(StatsdSink(address, prefix='test'))
+        m.incr('count', 2)
+        m.gauge('size', 10)
+        m.timing('stage', 0.5)
+        m.disable()
+
+        packets = [server.recv(1024).decode() for _ in range(3)]
+        server.close()
+
+        assert packets == [
+            'test.count:2|c',
+            'test.size:10|g',
+            'test.stage:500.0|ms',
+        ]
+        assert m.sinks == []
+
+    def test_pipeline_stages_are_instrumented(self, enabled_metrics):
+        tokens = create_lexer('foo 1.1.1.1 bar 1.0.0.1')
+        sort_ips([t.value for t in tokens])
+
+        summary = enabled_metrics.summary()
+
+        assert summary['counters'] == {'lexer.chars': 23, 'lexer.tokens': 2}
+        assert set(summary['timers']) == {'lexer.tokenize', 'sort_ips'}
+
+
+def test_peak_rss_is_in_bytes():
+    # any Python process is far past a megabyte, kilobytes would not be
+    assert peak_rss() > 1024 * 1024
+
+
+def test_profile_dumps_cprofile_stats(tmpdir):
+    filename = str(tmpdir.join('extract.prof'))
+
+    with profile(filename):
+        sort_ips(['1.1.1.1', '1.0.0.1'])
+
+    stats = pstats.Stats(filename)
+
+    assert any(func[2] == 'sort_ips' for func in stats.stats)
+
+
+def test_profile_without_a_filename():
+    with profile() as profiler:
+        pass
+
+    assert profiler is None
@@ -0,0 +1,203 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from ipcrawl import writers
+
+import csv
+import io
+import json
+import pytest
+
+
+RECORDS = [
+    {
+        'ip': '1.0.0.1',
+        'asn': {
+            'network': '1.0.0.0/24',
+            'autonomous_system_number': 13335,
+            'autonomous_system_organization': 'CLOUDFLARENET',
+        },
+        'city': {
+            'latitude': -33.494,
+            'is_anonymous_proxy': False,
+            'postal_code': None,
+        },
+    },
+    {
+        'ip': '2.21.92.1',
+        'asn': {
+            'network': '2.21.92.0/29',
+            'autonomous_system_number': -1,
+            'autonomous_system_organization': 'Akamai, Intl. ☃',
+        },
+        'city': {
+            'latitude': 0.0,
+            'is_anonymous_proxy': True,
+            'postal_code': '5107',
+        },
+    },
+]
+
+
+def test_flatten():
+    assert writers.flatten(RECORDS[0]) == {
+        'ip': '1.0.0.1',
+        'asn.network': '1.0.0.0/24',
+        'asn.autonomous_system_number': 13335,
+        'asn.autonomous_system_organization': 'CLOUDFLARENET',
+        'city.latitude': -33.494,
+        'city.is_anonymous_proxy': False,
+        'city.postal_code': None,
+    }
+
+
+def test_ndjson_writer_writes_one_valid_document_per_line(tmpdir):
+    tmpdir.chdir()
+
+    with writers.open_writer('out.ndjson', format='ndjson') as writer:
+        for record in RECORDS:
+            writer.write(record)
+
+    with io.open('out.ndjson', encoding='utf-8') as fd:
+        lines = fd.read().splitlines()
+
+    assert [json.loads(line) for line in lines] == RECORDS
+    assert writer.count == 2
+
+
+def test_ndjson_writer_output_is_readable_while_writing(tmpdir):
+    tmpdir.chdir()
+    writer = writers.open_writer('out.ndjson', flush_every=1)
+
+    writer.write(RECORDS[0])
+
+    with io.open('out.ndjson', encoding='utf-8') as fd:
+        assert json.loads(fd.readline()) == RECORDS[0]
+
+    writer.close()
+
+
+def test_csv_writer_flattens_records(tmpdir):
+    tmpdir.chdir()
+
+    with writers.open_writer('out.csv', format='csv') as writer:
+        for record in RECORDS:
+            writer.write(record)
+        writer.write({'ip': '3.3.3.3', 'tags': [1, 2]})
+
+    with io.open('out.csv', encoding='utf-8', newline='') as fd:
+        rows = list(csv.DictReader(fd))
+
+    assert rows[0]['ip'] == '1.0.0.1'
+    assert rows[1]['asn.autonomous_system_organization'] == 'Akamai, Intl. ☃'
+    assert rows[1]['city.latitude'] == '0.0'
+    assert rows[2]['asn.network'] == ''
+    assert 'tags' not in rows[2]
+
+
+def test_csv_writer_encodes_lists_as_json():
+    fd = io.StringIO()
+    writer = writers.CSVWriter(fd, fieldnames=['ip', 'tags'])
+
+    writer.write({'ip': '3.3.3.3', 'tags': [1, 'a']})
+
+    assert fd.getvalue().splitlines() == ['ip,tags', '3.3.3.3,"[1,""a""]"']
+
+
+def test_binary_writer_round_trips(tmpdir):
+    tmpdir.chdir()
+    records = RECORDS + [{'ip': '3.3.3.3', 'tags': [1, [2**40, -2**40]]}]
+
+    with writers.open_writer('out.ipcr', format='binary') as writer:
+        for record in records:
+            writer.write(record)
+
+    with io.open('out.ipcr', 'rb') as fd:
+        actual = list(writers.read_binary(fd))
+
+    assert actual == records
+
+
+def test_binary_writer_keeps_its_keys_when_a_record_fails():
+    fd = io.BytesIO()
+    record = {'ip': '1.2.3.4', 'geo': {'country': 'FR'}}
+
+    with writers.BinaryWriter(fd) as writer:
+        with pytest.raises(ValueError):
+            writer.write({'ip': '1.2.3.4', 'geo': {'when': object()}})
+
+        writer.write(record)
+
+    fd.seek(0)
+    assert list(writers.read_binary(fd)) == [record]
+
+
+def test_binary_writer_is_smaller_than_ndjson():
+    ndjson = io.StringIO()
+    binary = io.BytesIO()
+    ndjson_writer = writers.NDJSONWriter(ndjson)
+    binary_writer = writers.BinaryWriter(binary)
+
+    for _ in range(100):
+        for record in RECORDS:
+            ndjson_writer.write(record)
+            binary_writer.write(record)
+
+    assert len(binary.getvalue()) < len(ndjson.getvalue().encode('utf-8'))
+
+
+def test_read_binary_given_a_stream_that_is_not_binary_results():
+    with pytest.raises(ValueError):
+        list(writers.read_binary(io.BytesIO(b'{"ip": "1.2.3.4"}')))
+
+
+def test_read_binary_given_truncated_or_corrupt_records():
+    fd = io.BytesIO()
+    with writers.BinaryWriter(fd) as writer:
+        writer.write(RECORDS[0])
+        complete = len(fd.getvalue())
+        writer.write(RECORDS[1])
+
+    data = fd.getvalue()
+    header = len(writers.BINARY_MAGIC) + 1
+
+    # every cut within the second record
+    for end in range(complete + 1, len(data)):
+        with pytest.raises(ValueError, match='Truncated'):
+            list(writers.read_binary(io.BytesIO(data[:end])))
+
+    # a record whose length is right but whose payload is not
+    corrupt = data[:header] + bytes([2, writers.TAG_DICT, 5])
+    with pytest.raises(ValueError, match='Corrupt'):
+        list(writers.read_binary(io.BytesIO(corrupt)))
+
+
+def test_open_writer_given_an_unknown_format(tmpdir):
+    tmpdir.chdir()
+
+    with pytest.raises(ValueError) as exp:
+        writers.open_writer('out.xml', format='xml')
+
+    assert "Unknown output format 'xml'" in str(exp.value)
+
+
+def test_register_writer(tmpdir):
+    tmpdir.chdir()
+
+    class TSVWriter(writers.ResultWriter):
+        extension = 'tsv'
+
+        def write_record(self, record):
+            self.fd.write('\t'.join(str(v) for v in record.values()) + '\n')
+
+    writers.register_writer('tsv', TSVWriter)
+
+    try:
+        with writers.open_writer('out.tsv', format='tsv') as writer:
+            writer.write({'ip': '1.2.3.4', 'asn': 1})
+    finally:
+        writers.WRITERS.pop('tsv')
+
+    assert tmpdir.join('out.tsv').read() == '1.2.3.4\t1\n'